@@ -0,0 +1,2 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
@@ -0,0 +1,178 @@
+#
+# Sinfonia
+#
+# Synthetic Tier2 cloudlet fleets and Tier3 client streams
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Generate reproducible cloudlets and clients for benchmarks
+
+Cloudlets are clustered around metropolitan areas, each one has its own
+public /24 as local network, a few restrict or reject client networks, and
+they report the same resource metrics as Sinfonia Tier2 (see RESOURCE_QUERIES
+in cluster.py). Clients are located near the same metropolitan areas and a
+fraction of them is on the local network of a cloudlet.
+"""
+
+from __future__ import annotations
+
+import random
+from ipaddress import IPv4Address, IPv4Network
+from pathlib import Path
+from typing import Iterator
+from uuid import UUID
+
+from yarl import URL
+
+from sinfonia.client_info import ClientInfo
+from sinfonia.cloudlets import Cloudlet
+from sinfonia.deployment_recipe import DeploymentRecipe
+from sinfonia.deployment_repository import DeploymentRepository
+from sinfonia.geo_location import GeoLocation
+
+METRO_AREAS = [
+    (40.71, -74.01),  # New York
+    (40.44, -79.99),  # Pittsburgh
+    (41.88, -87.63),  # Chicago
+    (37.77, -122.42),  # San Francisco
+    (34.05, -118.24),  # Los Angeles
+    (47.61, -122.33),  # Seattle
+    (29.76, -95.37),  # Houston
+    (-23.55, -46.63),  # Sao Paulo
+    (51.51, -0.13),  # London
+    (48.86, 2.35),  # Paris
+    (52.52, 13.40),  # Berlin
+    (38.72, -9.14),  # Lisbon
+    (55.76, 37.62),  # Moscow
+    (19.08, 72.88),  # Mumbai
+    (1.35, 103.82),  # Singapore
+    (35.68, 139.69),  # Tokyo
+    (37.57, 126.98),  # Seoul
+    (31.23, 121.47),  # Shanghai
+    (-33.87, 151.21),  # Sydney
+    (-26.20, 28.05),  # Johannesburg
+]
+
+# cloudlet local networks are consecutive /24s starting from here
+FLEET_NETWORK = IPv4Address("20.0.0.0")
+
+BENCHMARK_WGKEY = "YpdTsMtb/QCdYKzHlzKkLcLzEbdTK0vP4ILmdcIvnhc="
+
+GiB = 1024**3
+
+
+def _nearby(rng: random.Random, spread: float = 1.0) -> GeoLocation:
+    latitude, longitude = rng.choice(METRO_AREAS)
+    return GeoLocation(
+        max(-90.0, min(90.0, rng.gauss(latitude, spread))),
+        (rng.gauss(longitude, spread) + 180.0) % 360.0 - 180.0,
+    )
+
+
+def _local_network(index: int) -> IPv4Network:
+    return IPv4Network((int(FLEET_NETWORK) + (index << 8), 24))
+
+
+def synthetic_resources(rng: random.Random) -> dict[str, float]:
+    """Resource metrics as reported by a Tier2 cloudlet.
+    cpu_avail/cpu_used are cpu seconds over the last minute, memory and disk
+    are in bytes and network rates in bytes per second.
+    """
+    cores = rng.choice([16, 32, 64, 128])
+    mem_total = cores * rng.choice([2, 4, 8]) * GiB
+    cpu_ratio = rng.betavariate(2, 3)
+    mem_ratio = rng.betavariate(2, 3)
+
+    resources = {
+        "cpu_ratio": cpu_ratio,
+        "mem_ratio": mem_ratio,
+        "net_rx_rate": rng.lognormvariate(15, 1.5),
+        "net_tx_rate": rng.lognormvariate(15, 1.5),
+        "cpu_avail": (1 - cpu_ratio) * cores * 60,
+        "cpu_used": cpu_ratio * cores * 60,
+        "mem_avail": (1 - mem_ratio) * mem_total,
+        "mem_used": mem_ratio * mem_total,
+        "disk_avail": rng.uniform(10, 1000) * GiB,
+    }
+    if rng.random() < 0.2:
+        resources["gpu_ratio"] = rng.random()
+    return resources
+
+
+def synthetic_cloudlet(index: int, rng: random.Random) -> Cloudlet:
+    local_network = _local_network(index)
+
+    accepted_clients = [IPv4Network("0.0.0.0/0")]
+    rejected_clients = []
+    draw = rng.random()
+    if draw < 0.1:
+        # only accepts clients from its own region
+        accepted_clients = [local_network.supernet(new_prefix=12)]
+    elif draw < 0.15:
+        rejected_clients = [_local_network(rng.randrange(index + 1)).supernet(8)]
+
+    return Cloudlet.new(
+        uuid=UUID(int=rng.getrandbits(128), version=4),
+        endpoint=URL(f"http://cloudlet{index}.example.com/api/v1/deploy"),
+        name=f"cloudlet{index}",
+        locations=[_nearby(rng) for _ in range(rng.choice([1, 1, 1, 2, 3]))],
+        local_networks=[local_network],
+        accepted_clients=accepted_clients,
+        rejected_clients=rejected_clients,
+        resources=synthetic_resources(rng),
+    )
+
+
+def synthetic_fleet(size: int, seed: int = 0) -> list[Cloudlet]:
+    """Create a reproducible fleet of cloudlets"""
+    rng = random.Random(seed)
+    return [synthetic_cloudlet(index, rng) for index in range(size)]
+
+
+def synthetic_resource_reqs(rng: random.Random) -> dict[str, float]:
+    """Resource requirements of a client, about a third of the clients does
+    not specify any requirements.
+    """
+    if rng.random() < 0.3:
+        return {}
+    return {
+        "cpu": rng.choice([1, 2, 4, 8]) * 60.0,
+        "mem": rng.choice([0.5, 1, 2, 4]) * GiB,
+        "disk": rng.choice([1, 5, 10]) * GiB,
+    }
+
+
+def synthetic_clients(
+    fleet_size: int, seed: int = 0, local_fraction: float = 0.3
+) -> Iterator[ClientInfo]:
+    """Endless stream of clients, local_fraction of the clients are on the
+    local network of one of the cloudlets in a fleet of fleet_size cloudlets.
+    Client locations are not known for 10% of the clients.
+    """
+    rng = random.Random(seed)
+    while True:
+        if fleet_size and rng.random() < local_fraction:
+            network = _local_network(rng.randrange(fleet_size))
+            address = network[rng.randrange(1, 255)]
+        else:
+            address = IPv4Address(rng.randrange(int(IPv4Address("1.0.0.0")), 2**31))
+
+        location = _nearby(rng) if rng.random() < 0.9 else None
+        yield ClientInfo(
+            BENCHMARK_WGKEY, address, location, synthetic_resource_reqs(rng)
+        )
+
+
+def synthetic_recipe() -> DeploymentRecipe:
+    """Deployment recipe passed to the match functions"""
+    return DeploymentRecipe(
+        repository=DeploymentRepository(Path("RECIPES")),
+        uuid=UUID(int=0, version=4),
+        description="benchmark",
+        chart="benchmark",
+        version="0.1.0",
+        values={},
+        restricted=False,
+    )
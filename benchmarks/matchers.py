@@ -0,0 +1,212 @@
+#
+# Sinfonia
+#
+# Measure the cost of Tier1 match functions for growing fleets
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Benchmark the registered tier1 match functions and matcher chains
+
+Every match function plugin, and the default chain of Tier1 match functions,
+is timed while placing a stream of synthetic clients on synthetic fleets of
+increasing size. Reports the p50 and p99 latency per placement and the peak
+memory allocated while placing a client.
+
+Results can be saved with --output and compared against an earlier run with
+--baseline, the benchmark fails when a latency regressed by more than the
+tolerance.
+
+    python -m benchmarks.matchers --sizes 10,1000,100000 --output baseline.json
+    python -m benchmarks.matchers --baseline baseline.json --tolerance 0.2
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import time
+import tracemalloc
+from itertools import islice
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from sinfonia.app_tier1 import Tier1DefaultConfig
+from sinfonia.candidates import Candidates
+from sinfonia.matchers import (
+    Tier1MatchFunction,
+    get_match_function_plugins,
+    tier1_best_match,
+)
+from sinfonia.registry import CloudletRegistry
+
+from .fleet import synthetic_clients, synthetic_fleet, synthetic_recipe
+
+DEFAULT_SIZES = "10,100,1000,10000,100000"
+
+console = Console()
+
+
+def matcher_chains(
+    names: Sequence[str] = (),
+) -> dict[str, list[Tier1MatchFunction]]:
+    """Every match function plugin by itself and the default Tier1 chain"""
+    plugins = get_match_function_plugins()
+    if not names:
+        names = sorted(plugins)
+
+    chains = {name: [plugins[name].load()] for name in names}
+    default = Tier1DefaultConfig.MATCHERS
+    chains["default"] = [plugins[name].load() for name in default]
+    return chains
+
+
+def benchmark_chain(
+    registry: CloudletRegistry,
+    chain: list[Tier1MatchFunction],
+    clients: list,
+    limit: int = 3,
+    memory_samples: int = 20,
+) -> dict[str, float]:
+    """Place all clients, returns latency percentiles in milliseconds and the
+    mean of the peak memory allocated per placement in KiB.
+    """
+    recipe = synthetic_recipe()
+
+    def place(client_info) -> list:
+        candidates = Candidates(registry.snapshot(), registry)
+        return list(
+            tier1_best_match(chain, client_info, recipe, candidates, limit=limit)
+        )
+
+    # warm up, i.e. build the spatial index
+    for client_info in clients[:3]:
+        place(client_info)
+
+    latencies = np.empty(len(clients))
+    placed = 0
+    for index, client_info in enumerate(clients):
+        start = time.perf_counter_ns()
+        placed += bool(place(client_info))
+        latencies[index] = time.perf_counter_ns() - start
+
+    # tracing allocations slows everything down, so it is measured separately
+    peaks = []
+    for client_info in clients[:memory_samples]:
+        tracemalloc.start()
+        try:
+            place(client_info)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak)
+        finally:
+            tracemalloc.stop()
+
+    p50, p99 = np.percentile(latencies, [50, 99]) / 1e6
+    return {
+        "p50_ms": float(p50),
+        "p99_ms": float(p99),
+        "peak_kib": float(np.mean(peaks)) / 1024 if peaks else 0.0,
+        "placed": placed / len(clients),
+    }
+
+
+def run_benchmarks(
+    sizes: Sequence[int],
+    chains: dict[str, list[Tier1MatchFunction]],
+    placements: int,
+    seed: int = 0,
+) -> list[dict[str, Any]]:
+    results = []
+    for size in sizes:
+        registry = CloudletRegistry(synthetic_fleet(size, seed))
+        clients = list(islice(synthetic_clients(size, seed), placements))
+
+        for name, chain in chains.items():
+            result = benchmark_chain(registry, chain, clients)
+            results.append(dict(size=size, matcher=name, **result))
+            console.log(f"{size} cloudlets, {name}: {result['p50_ms']:.3f} ms")
+    return results
+
+
+def find_regressions(
+    results: list[dict[str, Any]],
+    baseline: list[dict[str, Any]],
+    tolerance: float,
+) -> list[str]:
+    """Compare latencies with the baseline, returns a list of regressions"""
+    previous = {(entry["size"], entry["matcher"]): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        before = previous.get((entry["size"], entry["matcher"]))
+        if before is None:
+            continue
+        for metric in ["p50_ms", "p99_ms"]:
+            if entry[metric] > before[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{entry['matcher']} with {entry['size']} cloudlets: "
+                    f"{metric} {before[metric]:.3f} -> {entry[metric]:.3f}"
+                )
+    return regressions
+
+
+def print_results(results: list[dict[str, Any]]) -> None:
+    table = Table(title="Tier1 placement cost")
+    for column in ["cloudlets", "matcher", "p50 ms", "p99 ms", "peak KiB", "placed"]:
+        table.add_column(column, justify="left" if column == "matcher" else "right")
+    for entry in results:
+        table.add_row(
+            str(entry["size"]),
+            entry["matcher"],
+            f"{entry['p50_ms']:.3f}",
+            f"{entry['p99_ms']:.3f}",
+            f"{entry['peak_kib']:.1f}",
+            f"{entry['placed']:.0%}",
+        )
+    console.print(table)
+
+
+def main(
+    sizes: str = typer.Option(DEFAULT_SIZES, help="Comma separated fleet sizes"),
+    matchers: str = typer.Option(
+        "", help="Comma separated match functions [default: all]"
+    ),
+    placements: int = typer.Option(200, help="Placements per fleet and matcher"),
+    seed: int = typer.Option(0, help="Seed for the synthetic fleets and clients"),
+    output: Optional[Path] = typer.Option(None, help="Save results as JSON"),
+    baseline: Optional[Path] = typer.Option(
+        None, exists=True, dir_okay=False, help="Compare with earlier results"
+    ),
+    tolerance: float = typer.Option(
+        0.2, help="Allowed relative latency increase compared to the baseline"
+    ),
+):
+    """Benchmark Tier1 match functions on synthetic fleets"""
+    # don't measure (and print) the per placement logging
+    logging.getLogger("sinfonia").setLevel(logging.WARNING)
+
+    fleet_sizes = [int(size) for size in sizes.split(",")]
+    names = [name for name in matchers.split(",") if name]
+    results = run_benchmarks(fleet_sizes, matcher_chains(names), placements, seed)
+    print_results(results)
+
+    if output is not None:
+        output.write_text(json.dumps(results, indent=2))
+
+    if baseline is not None:
+        regressions = find_regressions(
+            results, json.loads(baseline.read_text()), tolerance
+        )
+        for regression in regressions:
+            console.print(f"[red]Regression[/red] {regression}")
+        if regressions:
+            raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
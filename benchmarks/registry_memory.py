@@ -0,0 +1,137 @@
+#
+# Sinfonia
+#
+# Measure the memory footprint of the Tier1 cloudlet registry
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Benchmark the memory used by the Tier1 registry for growing fleets
+
+For every fleet size a synthetic fleet is created and added to a registry.
+Reports the memory allocated per cloudlet for the Cloudlet objects and for
+the registry indexes, the number of objects tracked by the garbage collector
+per cloudlet and the time of a full collection, and the memory retained after
+applying heartbeats from known cloudlets.
+
+    python -m benchmarks.registry_memory --sizes 1000,10000,100000
+"""
+
+from __future__ import annotations
+
+import gc
+import json
+import random
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import pendulum
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from sinfonia.registry import CloudletRegistry
+
+from .fleet import synthetic_cloudlet, synthetic_resources
+
+DEFAULT_SIZES = "1000,10000,100000"
+
+console = Console()
+
+
+def _tracked_objects() -> int:
+    gc.collect()
+    return len(gc.get_objects())
+
+
+def measure_registry(size: int, seed: int = 0, heartbeats: int = 1000) -> dict:
+    """Memory per cloudlet in bytes, gc tracked objects per cloudlet, full
+    collection time in milliseconds and bytes retained per heartbeat.
+    """
+    rng = random.Random(seed)
+    objects = _tracked_objects()
+
+    tracemalloc.start()
+    try:
+        cloudlets = [synthetic_cloudlet(index, rng) for index in range(size)]
+        created, _ = tracemalloc.get_traced_memory()
+
+        registry = CloudletRegistry(cloudlets)
+        indexed, _ = tracemalloc.get_traced_memory()
+
+        tracked = _tracked_objects() - objects
+
+        start = time.perf_counter()
+        gc.collect()
+        collection = time.perf_counter() - start
+
+        # heartbeats of known cloudlets only replace their resources
+        now = pendulum.now()
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(heartbeats):
+            uuid = cloudlets[rng.randrange(size)].uuid
+            registry.report(uuid, synthetic_resources(rng), now)
+        heartbeat, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "cloudlet_bytes": created / size,
+        "index_bytes": (indexed - created) / size,
+        "gc_objects": tracked / size,
+        "gc_ms": collection * 1e3,
+        "heartbeat_bytes": (heartbeat - before) / heartbeats,
+    }
+
+
+def run_benchmarks(sizes: Sequence[int], seed: int = 0) -> list[dict[str, Any]]:
+    results = []
+    for size in sizes:
+        result = measure_registry(size, seed)
+        results.append(dict(size=size, **result))
+        console.log(f"{size} cloudlets: {result['cloudlet_bytes']:.0f} bytes")
+    return results
+
+
+def print_results(results: list[dict[str, Any]]) -> None:
+    table = Table(title="Tier1 registry memory")
+    for column in [
+        "cloudlets",
+        "bytes/cloudlet",
+        "index bytes/cloudlet",
+        "gc objects/cloudlet",
+        "full gc ms",
+        "bytes/heartbeat",
+    ]:
+        table.add_column(column, justify="right")
+    for entry in results:
+        table.add_row(
+            str(entry["size"]),
+            f"{entry['cloudlet_bytes']:.0f}",
+            f"{entry['index_bytes']:.0f}",
+            f"{entry['gc_objects']:.1f}",
+            f"{entry['gc_ms']:.1f}",
+            f"{entry['heartbeat_bytes']:.0f}",
+        )
+    console.print(table)
+
+
+def main(
+    sizes: str = typer.Option(DEFAULT_SIZES, help="Comma separated fleet sizes"),
+    seed: int = typer.Option(0, help="Seed for the synthetic fleets"),
+    output: Optional[Path] = typer.Option(None, help="Save results as JSON"),
+):
+    """Measure the memory used by the Tier1 registry on synthetic fleets"""
+    fleet_sizes = [int(size) for size in sizes.split(",")]
+    results = run_benchmarks(fleet_sizes, seed)
+    print_results(results)
+
+    if output is not None:
+        output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    typer.run(main)
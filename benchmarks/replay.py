@@ -0,0 +1,344 @@
+#
+# Sinfonia
+#
+# Replay recorded Tier2 metrics to compare Tier1 placement policies
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Offline placement simulator
+
+Every metrics file recorded by report_to_tier1_endpoints (see jobs.py) becomes
+a simulated cloudlet that reports its recorded metrics to an in-process Tier1
+registry at the recorded times. Deployment requests arrive either as a
+Poisson process, or at the times found in a cloudlet association log, and are
+placed by the actual match functions. Every placed deployment consumes the
+requested cpu and memory on the selected cloudlet until it terminates, this
+consumption is added to the recorded metrics in later reports.
+
+The same arrivals are replayed for each matcher chain, and for each one the
+simulator reports the load imbalance between the cloudlets, how many requests
+could not be placed or were placed on a cloudlet that did not actually have
+the resources, and the throughput of the match functions.
+
+    python -m benchmarks.replay performance_tests/balance_cpu_cloudlet02*.csv \\
+        --chain balance_cpu --chain balance_cpu_mem --rate 0.5
+"""
+
+from __future__ import annotations
+
+import csv
+import heapq
+import logging
+import random
+import time
+from ipaddress import IPv4Address
+from pathlib import Path
+from typing import Any, List, Optional, Sequence
+from uuid import UUID
+
+import attrs
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+from yarl import URL
+
+from sinfonia.candidates import Candidates
+from sinfonia.client_info import ClientInfo
+from sinfonia.cloudlets import Cloudlet
+from sinfonia.matchers import (
+    Tier1MatchFunction,
+    get_match_function_plugins,
+    tier1_best_match,
+)
+from sinfonia.registry import CloudletRegistry
+from sinfonia.resource_matrix import requirements
+
+from .fleet import BENCHMARK_WGKEY, GiB, synthetic_recipe
+
+# column order of the metrics files written by report_to_tier1_endpoints
+METRICS_COLUMNS = (
+    "time",
+    "cpu_ratio",
+    "mem_ratio",
+    "net_rx_rate",
+    "net_tx_rate",
+    "mem_avail",
+    "cpu_avail",
+    "cpu_used",
+    "mem_used",
+)
+
+# longer intervals between reports are gaps between recording sessions
+MAX_REPORT_GAP = 60.0
+
+# the recorded metrics predate disk_avail, assume disk space is not a limit
+DISK_AVAIL = 1024 * GiB
+
+console = Console()
+
+
+@attrs.define
+class MetricsTimeline:
+    """Recorded metrics of a single cloudlet, times relative to the start"""
+
+    name: str
+    times: np.ndarray
+    metrics: np.ndarray  # one column per METRICS_COLUMNS[1:]
+
+    @classmethod
+    def load(cls, path: Path) -> MetricsTimeline:
+        with path.open() as stream:
+            rows = [
+                [float(value) for value in row[: len(METRICS_COLUMNS)]]
+                for row in csv.reader(stream)
+                if len(row) >= len(METRICS_COLUMNS)
+            ]
+        values = np.array(rows)
+
+        # concatenate recording sessions, replacing the gaps between them
+        # with a single reporting interval
+        intervals = np.diff(values[:, 0])
+        interval = np.median(intervals)
+        intervals[intervals > MAX_REPORT_GAP] = interval
+        times = np.concatenate(([0.0], np.cumsum(intervals)))
+        return cls(path.stem, times, values[:, 1:])
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1])
+
+    def resources(self, index: int) -> dict[str, float]:
+        resources = dict(zip(METRICS_COLUMNS[1:], self.metrics[index].tolist()))
+        resources["disk_avail"] = DISK_AVAIL
+        return resources
+
+
+def load_arrivals(path: Path) -> list[float]:
+    """Arrival times relative to the first entry of an association log"""
+    with path.open() as stream:
+        times = [float(row[0]) for row in csv.reader(stream) if row]
+    return [arrival - times[0] for arrival in sorted(times)]
+
+
+def poisson_arrivals(rate: float, duration: float, seed: int = 0) -> list[float]:
+    rng = random.Random(seed)
+    arrivals: list[float] = []
+    now = rng.expovariate(rate)
+    while now < duration:
+        arrivals.append(now)
+        now += rng.expovariate(rate)
+    return arrivals
+
+
+@attrs.define
+class SimulatedCloudlet:
+    timeline: MetricsTimeline
+    uuid: UUID
+    # cpu and memory consumed by deployments placed by the simulation
+    cpu: float = 0.0
+    mem: float = 0.0
+    placed: int = 0
+    index: int = 0
+
+    def resources(self) -> dict[str, float]:
+        """Recorded metrics plus the consumption of simulated deployments"""
+        resources = self.timeline.resources(self.index)
+        for resource, consumed in [("cpu", self.cpu), ("mem", self.mem)]:
+            used = resources[f"{resource}_used"] + consumed
+            avail = max(resources[f"{resource}_avail"] - consumed, 0.0)
+            resources[f"{resource}_used"] = used
+            resources[f"{resource}_avail"] = avail
+            resources[f"{resource}_ratio"] = used / (used + avail) if used else 0.0
+        return resources
+
+    def cloudlet(self) -> Cloudlet:
+        return Cloudlet.new(
+            uuid=self.uuid,
+            endpoint=URL(f"http://{self.timeline.name}.example.com/api/v1/deploy"),
+            name=self.timeline.name,
+            locations=[],
+            local_networks=[],
+            resources=self.resources(),
+        )
+
+
+# event kinds, in the order they are handled when they happen at the same time
+DEPARTURE, REPORT, ARRIVAL = range(3)
+
+
+def simulate(
+    timelines: Sequence[MetricsTimeline],
+    chain: list[Tier1MatchFunction],
+    arrivals: Sequence[float],
+    resource_reqs: dict[str, float],
+    lifetime: float,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Replay the metrics timelines and place the deployment arrivals"""
+    rng = random.Random(seed)
+    recipe = synthetic_recipe()
+    reqs = requirements(resource_reqs)
+    duration = min(timeline.duration for timeline in timelines)
+
+    now = 0.0
+    registry = CloudletRegistry()
+    registry.resources.clock = lambda: now
+
+    cloudlets = [
+        SimulatedCloudlet(timeline, UUID(int=rng.getrandbits(128), version=4))
+        for timeline in timelines
+    ]
+    events: list[tuple[float, int, int]] = []
+    for index, simulated in enumerate(cloudlets):
+        registry[simulated.uuid] = simulated.cloudlet()
+        heapq.heappush(events, (float(simulated.timeline.times[1]), REPORT, index))
+    for arrival in arrivals:
+        if arrival < duration:
+            heapq.heappush(events, (arrival, ARRIVAL, -1))
+
+    requests = rejected = overcommitted = 0
+    latencies: list[float] = []
+    utilization: list[np.ndarray] = []
+
+    while events:
+        now, kind, index = heapq.heappop(events)
+        if now > duration:
+            break
+
+        if kind == DEPARTURE:
+            cloudlets[index].cpu -= reqs[0]
+            cloudlets[index].mem -= reqs[1]
+
+        elif kind == REPORT:
+            simulated = cloudlets[index]
+            simulated.index += 1
+            registry[simulated.uuid] = simulated.cloudlet()
+
+            if simulated.index + 1 < len(simulated.timeline.times):
+                next_report = float(simulated.timeline.times[simulated.index + 1])
+                heapq.heappush(events, (next_report, REPORT, index))
+
+            # sample the actual load of all cloudlets once per report interval
+            if index == 0:
+                utilization.append(
+                    np.array([c.resources()["cpu_ratio"] for c in cloudlets])
+                )
+
+        else:
+            requests += 1
+            client_info = ClientInfo(
+                BENCHMARK_WGKEY,
+                IPv4Address(rng.randrange(2**24, 2**31)),
+                None,
+                resource_reqs,
+            )
+            candidates = Candidates(registry.snapshot(), registry)
+
+            start = time.perf_counter()
+            selected = next(
+                tier1_best_match(chain, client_info, recipe, candidates, limit=1),
+                None,
+            )
+            latencies.append(time.perf_counter() - start)
+
+            if selected is None:
+                rejected += 1
+                continue
+
+            # charge the reservation just like Tier1 does for a deployment
+            registry.resources.reserve(selected.uuid, reqs)
+
+            index = next(i for i, c in enumerate(cloudlets) if c.uuid == selected.uuid)
+            simulated = cloudlets[index]
+            actual = simulated.resources()
+            if actual["cpu_avail"] < reqs[0] or actual["mem_avail"] < reqs[1]:
+                overcommitted += 1
+
+            simulated.placed += 1
+            simulated.cpu += reqs[0]
+            simulated.mem += reqs[1]
+            departure = now + rng.expovariate(1 / lifetime)
+            heapq.heappush(events, (departure, DEPARTURE, index))
+
+    samples = np.array(utilization) if utilization else np.zeros((1, len(cloudlets)))
+    placed = requests - rejected
+    return {
+        "requests": requests,
+        "rejected": rejected / requests if requests else 0.0,
+        "overcommitted": overcommitted / placed if placed else 0.0,
+        # mean over time of the spread in cpu utilization between cloudlets
+        "imbalance": float(np.mean(samples.max(axis=1) - samples.min(axis=1))),
+        "placements": {c.timeline.name: c.placed for c in cloudlets},
+        "throughput": len(latencies) / sum(latencies) if latencies else 0.0,
+    }
+
+
+def print_results(results: dict[str, dict[str, Any]]) -> None:
+    table = Table(title="Simulated placements")
+    for column in [
+        "matchers",
+        "requests",
+        "rejected",
+        "overcommitted",
+        "cpu imbalance",
+        "placements",
+        "placements/s",
+    ]:
+        table.add_column(column, justify="left" if column == "matchers" else "right")
+    for name, result in results.items():
+        table.add_row(
+            name,
+            str(result["requests"]),
+            f"{result['rejected']:.1%}",
+            f"{result['overcommitted']:.1%}",
+            f"{result['imbalance']:.3f}",
+            "/".join(str(placed) for placed in result["placements"].values()),
+            f"{result['throughput']:.0f}",
+        )
+    console.print(table)
+
+
+def main(
+    metrics: List[Path] = typer.Argument(
+        ..., exists=True, dir_okay=False, help="Recorded Tier2 metrics files"
+    ),
+    chains: List[str] = typer.Option(
+        ["balance_cpu", "balance_cpu_mem"],
+        "--chain",
+        help="Comma separated matcher chain, can be repeated to compare chains",
+    ),
+    rate: float = typer.Option(0.2, help="Deployment requests per second"),
+    arrivals: Optional[Path] = typer.Option(
+        None, exists=True, dir_okay=False, help="Replay arrivals from association log"
+    ),
+    lifetime: float = typer.Option(300.0, help="Mean deployment lifetime (seconds)"),
+    cpu: float = typer.Option(60.0, help="cpu requested per deployment (cpu-sec/m)"),
+    mem: float = typer.Option(1.0, help="Memory requested per deployment (GiB)"),
+    seed: int = typer.Option(0, help="Seed for arrivals and deployment lifetimes"),
+):
+    """Replay recorded Tier2 metrics through the Tier1 match functions"""
+    logging.getLogger("sinfonia").setLevel(logging.WARNING)
+
+    timelines = [MetricsTimeline.load(path) for path in metrics]
+    duration = min(timeline.duration for timeline in timelines)
+    if arrivals is not None:
+        arrival_times = load_arrivals(arrivals)
+    else:
+        arrival_times = poisson_arrivals(rate, duration, seed)
+
+    plugins = get_match_function_plugins()
+    resource_reqs = {"cpu": cpu, "mem": mem * GiB}
+    results = {}
+    for chain in chains:
+        match_functions = [plugins[name].load() for name in chain.split(",")]
+        results[chain] = simulate(
+            timelines, match_functions, arrival_times, resource_reqs, lifetime, seed
+        )
+    print_results(results)
+
+
+if __name__ == "__main__":
+    typer.run(main)
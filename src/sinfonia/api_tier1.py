@@ -8,18 +8,34 @@
 # SPDX-License-Identifier: MIT
 #
 
+from __future__ import annotations
+
 import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from functools import partial
 from itertools import chain, filterfalse, islice, zip_longest
+from uuid import UUID
 
+import pendulum
 from connexion import NoContent
 from connexion.exceptions import ProblemException
 from flask import current_app, request
 from flask.views import MethodView
 
+from .batch_placement import place_batch
+from .candidates import Candidates
 from .client_info import ClientInfo
 from .cloudlets import Cloudlet
 from .deployment_recipe import DeploymentRecipe
 from .matchers import tier1_best_match
+from .registry import CloudletRegistry, ResourceReport
+from .resource_matrix import Reservation, requirements
+
+try:
+    import msgpack
+except ImportError:  # optional, only used for bulk cloudlet reports
+    msgpack = None
 
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,6 +44,161 @@ logger = logging.getLogger(__name__)
 # don't try to deploy to more than MAX_RESULTS cloudlets at a time
 MAX_RESULTS = 3
 
+# compact encoding accepted for bulk cloudlet reports
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# status of the entries in a batch deploy response
+BATCH_DEPLOYED = "deployed"
+BATCH_FAILED = "failed"
+BATCH_INVALID = "invalid"
+BATCH_UNPLACED = "unplaced"
+
+
+def update_cloudlet(
+    cloudlets: CloudletRegistry,
+    report: dict,
+    now: pendulum.DateTime,
+    pending: dict[UUID, ResourceReport] | None = None,
+) -> int:
+    """Apply a cloudlet report to the registry, returns the HTTP status.
+    When pending is passed, reports that only update the resources of a known
+    cloudlet are collected there and applied later with report_many.
+    May raise ValueError when the uuid is badly formatted.
+    """
+    uuid = UUID(str(report["uuid"]))
+
+    # a later report for the same cloudlet builds on the pending one
+    if pending and uuid in pending:
+        cloudlets.report_many(pending.values())
+        pending.clear()
+
+    # delta heartbeats only contain the metrics changed since the last one
+    if "changed" in report:
+        if pending is None:
+            if not cloudlets.apply_delta(
+                uuid,
+                report["sequence"],
+                report["changed"],
+                report.get("removed", []),
+                now,
+            ):
+                return 409
+            return 204
+
+        resources = cloudlets.resolve_delta(
+            uuid, report["sequence"], report["changed"], report.get("removed", [])
+        )
+        if resources is None:
+            return 409
+        pending[uuid] = (uuid, resources, now, report["sequence"])
+        return 204
+
+    # heartbeats from known cloudlets usually only change the resources
+    known = cloudlets.get(uuid)
+    if known is not None and known.reported_unchanged(report):
+        update = (
+            known.uuid,
+            report.get("resources") or {},
+            now,
+            report.get("sequence"),
+        )
+        if pending is None:
+            cloudlets.report(*update)
+        else:
+            pending[uuid] = update
+        return 204
+
+    cloudlet = Cloudlet.new_from_api(report)
+    cloudlets[cloudlet.uuid] = cloudlet
+    return 204
+
+
+def _cancel_deployment(
+    registry: CloudletRegistry,
+    cloudlet: Cloudlet,
+    reservation: Reservation | None,
+    app_uuid: UUID,
+    client_info: ClientInfo,
+    future: Future,
+) -> None:
+    """Remove the deployment created by a request that lost the race"""
+    registry.resources.release(reservation)
+    if future.result():
+        logger.info(f"Removing hedged deployment from {cloudlet}")
+        cloudlet.undeploy(app_uuid, client_info, registry.sessions)
+
+
+def deploy_hedged(
+    registry: CloudletRegistry,
+    candidates: list[Cloudlet],
+    app_uuid: UUID,
+    client_info: ClientInfo,
+    wanted: int,
+    percentile: float,
+    default_delay: float,
+) -> list:
+    """Deploy to the best wanted candidates. When a cloudlet takes longer
+    than the given percentile of its recent response times, or fails, the
+    request is also sent to the next candidate. Deployments beyond the wanted
+    ones are removed again once their request completes.
+    """
+    reqs = requirements(client_info.resourceReqs)
+    spares = list(candidates[wanted:])
+    # deadline after which a request is hedged, None once it was hedged
+    pending: dict[Future, tuple[Cloudlet, Reservation | None, float | None]] = {}
+
+    def launch(cloudlet: Cloudlet) -> None:
+        reservation = registry.resources.reserve(cloudlet.uuid, reqs)
+        future = cloudlet.deploy_async(app_uuid, client_info)
+        delay = registry.sessions.latency(cloudlet.uuid, percentile, default_delay)
+        pending[future] = (cloudlet, reservation, time.monotonic() + delay)
+
+    for cloudlet in candidates[:wanted]:
+        launch(cloudlet)
+
+    responses: list = []
+    while pending and len(responses) < wanted:
+        deadlines = [deadline for *_, deadline in pending.values() if deadline]
+        timeout = None
+        if spares and deadlines:
+            timeout = max(min(deadlines) - time.monotonic(), 0.0)
+
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            cloudlet, reservation, _ = pending.pop(future)
+            response = future.result()
+            if not response:
+                registry.resources.release(reservation)
+                if spares:
+                    launch(spares.pop(0))
+            elif len(responses) < wanted:
+                responses.append(response)
+            else:
+                _cancel_deployment(
+                    registry, cloudlet, reservation, app_uuid, client_info, future
+                )
+
+        # hedge the requests that took too long
+        now = time.monotonic()
+        for future, (cloudlet, reservation, deadline) in list(pending.items()):
+            if spares and deadline is not None and deadline <= now:
+                pending[future] = (cloudlet, reservation, None)
+                launch(spares.pop(0))
+
+    # requests that are still running lost the race
+    for future, (cloudlet, reservation, _) in pending.items():
+        future.add_done_callback(
+            partial(
+                _cancel_deployment,
+                registry,
+                cloudlet,
+                reservation,
+                app_uuid,
+                client_info,
+            )
+        )
+    return responses
+
 
 class CloudletsView(MethodView):
     def post(self):
@@ -35,14 +206,92 @@ class CloudletsView(MethodView):
         if not isinstance(body, dict) or "uuid" not in body:
             return "Bad Request, missing UUID", 400
 
-        cloudlet = Cloudlet.new_from_api(body)
         cloudlets = current_app.config["cloudlets"]
-        cloudlets[cloudlet.uuid] = cloudlet
+        cloudlets.sync()
+        try:
+            status = update_cloudlet(cloudlets, body, pendulum.now())
+        except ValueError:
+            return "Bad Request, malformed UUID", 400
+        if status == 409:
+            return "Conflict, missed earlier report", 409
         return NoContent, 204
 
-    def search(self):
+    def bulk(self):
+        """Reports for many cloudlets, encoded as JSON or msgpack"""
+        if request.mimetype == MSGPACK_MIMETYPE:
+            if msgpack is None:
+                raise ProblemException(
+                    415, "Unsupported Media Type", "msgpack is not installed"
+                )
+            try:
+                reports = msgpack.unpackb(request.get_data())
+            except ValueError:
+                reports = None
+        else:
+            reports = request.json
+
+        if not isinstance(reports, list):
+            raise ProblemException(400, "Bad Request", "Expected a list of reports")
+
+        # reject malformed reports before updating anything
+        statuses = [
+            204 if isinstance(report, dict) and "uuid" in report else 400
+            for report in reports
+        ]
+
+        # deltas may follow reports that were handled by another worker
+        cloudlets = current_app.config["cloudlets"]
+        cloudlets.sync(wait=True)
+        now = pendulum.now()
+        pending: dict[UUID, ResourceReport] = {}
+        for index, report in enumerate(reports):
+            if statuses[index] == 204:
+                try:
+                    statuses[index] = update_cloudlet(cloudlets, report, now, pending)
+                except (KeyError, TypeError, ValueError):
+                    statuses[index] = 400
+        cloudlets.report_many(pending.values())
+
+        return [
+            dict(
+                uuid=report.get("uuid") if isinstance(report, dict) else None,
+                status=status,
+            )
+            for report, status in zip(reports, statuses)
+        ]
+
+    def search(self, offset=0, limit=None):
         cloudlets = current_app.config["cloudlets"]
-        return [cloudlet.summary() for cloudlet in cloudlets.values()]
+        cloudlets.sync()
+        page = current_app.config["summary_cache"].get(cloudlets, offset, limit)
+
+        if request.if_none_match.contains_weak(page.etag):
+            response = current_app.response_class(status=304)
+        else:
+            # the cached list is passed through as a stream, which also skips
+            # validating every summary against the response schema again
+            compress = "gzip" in request.accept_encodings
+            body = page.gzipped() if compress else page.body
+            response = current_app.response_class(
+                page.chunks(body),
+                mimetype="application/json",
+                direct_passthrough=True,
+            )
+            response.content_length = len(body)
+            if compress:
+                response.content_encoding = "gzip"
+
+        response.set_etag(page.etag, weak=True)
+        response.vary.add("Accept-Encoding")
+        response.headers["X-Total-Count"] = str(page.total)
+        return response
+
+    def sessions(self):
+        """Counters of the connections used to forward deployment requests"""
+        sessions = current_app.config["cloudlets"].sessions
+        return [
+            dict(uuid=str(uuid), **stats) for uuid, stats in sessions.stats().items()
+        ]
 
 
 class DeployView(MethodView):
@@ -57,16 +306,55 @@ class DeployView(MethodView):
             raise ProblemException(400, "Bad Request", "Incorrectly formatted request")
 
         matchers = current_app.config["match_functions"]
-        available = list(current_app.config["cloudlets"].values())
-        candidates = islice(
-            tier1_best_match(matchers, client_info, requested, available), max_results
-        )
+        registry = current_app.config["cloudlets"]
+        registry.sync()
 
-        # fire off deployment requests
-        requests = [
-            cloudlet.deploy_async(requested.uuid, client_info)
-            for cloudlet in candidates
-        ]
+        # when hedging, a spare candidate is kept for slow or failed requests
+        hedging = current_app.config["DEPLOY_HEDGING"]
+        limit = max_results + 1 if hedging else max_results
+
+        # similar requests from the same client network are placed on the same
+        # cloudlets until the registry changes, i.e. with the next report or
+        # reservation
+        placement_cache = current_app.config["placement_cache"]
+        cache_key = placement_cache.key(client_info, requested.uuid, registry, limit)
+        candidates = placement_cache.get(cache_key, client_info, registry)
+        if candidates is None:
+            available = Candidates(registry.snapshot(), registry)
+            candidates = list(
+                tier1_best_match(
+                    matchers, client_info, requested, available, limit=limit
+                )
+            )
+            placement_cache.put(cache_key, candidates)
+
+        if hedging:
+            responses = deploy_hedged(
+                registry,
+                candidates,
+                requested.uuid,
+                client_info,
+                max_results,
+                float(current_app.config["DEPLOY_HEDGE_PERCENTILE"]),
+                float(current_app.config["DEPLOY_HEDGE_DELAY"]),
+            )
+        else:
+            # fire off deployment requests, and charge the requested resources
+            # to the cloudlets until their next reports reflect the deployments
+            reqs = requirements(client_info.resourceReqs)
+            requests = []
+            for cloudlet in candidates:
+                reservation = registry.resources.reserve(cloudlet.uuid, reqs)
+                future = cloudlet.deploy_async(requested.uuid, client_info)
+                requests.append((future, reservation))
+
+            # release the reservations for cloudlets that failed to deploy
+            responses = []
+            for future, reservation in requests:
+                response = future.result()
+                if not response:
+                    registry.resources.release(reservation)
+                responses.append(response)
 
         # gather the results,
         # - interleave results from cloudlets in case any returned more than requested.
@@ -75,7 +363,7 @@ class DeployView(MethodView):
             islice(
                 filterfalse(
                     lambda r: r is None,
-                    chain(*zip_longest(*(request.result() for request in requests))),
+                    chain(*zip_longest(*responses)),
                 ),
                 max_results,
             )
@@ -90,6 +378,72 @@ class DeployView(MethodView):
     def get(self, uuid, application_key):
         raise ProblemException(500, "Error", "Not implemented")
 
+    def delete(self, uuid, application_key):
+        raise ProblemException(500, "Error", "Not implemented")
+
+
+class DeployBatchView(MethodView):
+    def post(self):
+        items = request.json or []
+        registry = current_app.config["cloudlets"]
+        registry.sync()
+
+        results = [
+            dict(
+                uuid=item["uuid"],
+                application_key=item["application_key"],
+                status=BATCH_INVALID,
+            )
+            for item in items
+        ]
+
+        recipes: dict[str, DeploymentRecipe | None] = {}
+        entries = []
+        for index, item in enumerate(items):
+            if item["uuid"] not in recipes:
+                try:
+                    recipes[item["uuid"]] = DeploymentRecipe.from_uuid(item["uuid"])
+                except ValueError:
+                    recipes[item["uuid"]] = None
+
+            recipe = recipes[item["uuid"]]
+            try:
+                client_info = ClientInfo.from_batch_item(item)
+            except ValueError:
+                continue
+            if recipe is not None:
+                entries.append((index, recipe, client_info))
+
+        # place all requests jointly before firing off deployment requests
+        placements = place_batch(
+            current_app.config["match_functions"],
+            [(recipe, client_info) for _, recipe, client_info in entries],
+            registry,
+            horizon=float(current_app.config["FORECAST_HORIZON"]),
+        )
+
+        requests = []
+        for (index, recipe, client_info), cloudlet in zip(entries, placements):
+            if cloudlet is None:
+                results[index]["status"] = BATCH_UNPLACED
+                continue
+
+            reqs = requirements(client_info.resourceReqs)
+            reservation = registry.resources.reserve(cloudlet.uuid, reqs)
+            future = cloudlet.deploy_async(recipe.uuid, client_info)
+            requests.append((index, future, reservation))
+
+        for index, future, reservation in requests:
+            response = future.result()
+            if not response:
+                registry.resources.release(reservation)
+                results[index]["status"] = BATCH_FAILED
+            else:
+                results[index]["status"] = BATCH_DEPLOYED
+                results[index]["deployments"] = response
+
+        return results
+
 
 class RecipeView(MethodView):
     def get(self, uuid):
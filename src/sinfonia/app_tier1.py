@@ -11,7 +11,6 @@ from __future__ import annotations
 import logging
 import sys
 from pathlib import Path
-from uuid import UUID
 
 import connexion
 import typer
@@ -31,12 +30,25 @@ from .app_common import (
     recipes_option,
     version_option,
 )
-from .cloudlets import Cloudlet
 from .cloudlets import load as cloudlets_load
 from .deployment_repository import DeploymentRepository
-from .jobs import scheduler, start_expire_cloudlets_job
-from .matchers import Tier1MatchFunction, get_match_function_plugins
+from .jobs import (
+    scheduler,
+    start_expire_cloudlets_job,
+    start_reload_settings_job,
+    start_snapshot_job,
+)
+from .matchers import (
+    DEFAULT_MATCHER_WEIGHTS,
+    Tier1MatchFunction,
+    get_match_function_plugins,
+)
 from .openapi import load_spec
+from .placement_cache import PlacementCache
+from .registry import CloudletRegistry
+from .shared_registry import SharedCloudletRegistry
+from .snapshot import load_snapshot
+from .summary_cache import SummaryCache
 
 
 class Tier1DefaultConfig:
@@ -44,26 +56,108 @@ class Tier1DefaultConfig:
     MATCHERS: list[str] = ["network", "location", "random", "resources", "balance_cpu", "balance_mem", "balance_cpu_mem"]
     RECIPES: str | Path | URL = "RECIPES"
 
+    # Weights of the objectives used by the "weighted" match function, changes
+    # to MATCHER_WEIGHTS in the SINFONIA_SETTINGS file apply without a restart.
+    MATCHER_WEIGHTS: dict[str, float] = dict(DEFAULT_MATCHER_WEIGHTS)
+
+    # Number of recent placement decisions to reuse for similar requests from
+    # the same client network, 0 disables the cache.
+    PLACEMENT_CACHE_SIZE: int = 1024
+
+    # Resources requested by a deployment are reserved on the selected
+    # cloudlet until it reports at least RESERVATION_SETTLE seconds later, or
+    # for at most RESERVATION_TIMEOUT seconds if the cloudlet does not report.
+    RESERVATION_SETTLE: float = 10.0
+    RESERVATION_TIMEOUT: float = 60.0
+
+    # Deployment requests are forwarded to a cloudlet over up to
+    # DEPLOY_POOL_SIZE kept alive connections. Requests fail when Tier2 does
+    # not accept the connection within DEPLOY_CONNECT_TIMEOUT seconds or does
+    # not respond within DEPLOY_READ_TIMEOUT seconds.
+    DEPLOY_POOL_SIZE: int = 4
+    DEPLOY_CONNECT_TIMEOUT: float = 3.05
+    DEPLOY_READ_TIMEOUT: float = 120.0
+
+    # With DEPLOY_HEDGING a deployment request is first only forwarded to the
+    # best cloudlet. When that cloudlet does not respond within the
+    # DEPLOY_HEDGE_PERCENTILE of its recent response times, or within
+    # DEPLOY_HEDGE_DELAY seconds until enough responses were seen, the request
+    # is also forwarded to the next best cloudlet. The deployment on the
+    # cloudlet that responds last is removed again.
+    DEPLOY_HEDGING: bool = False
+    DEPLOY_HEDGE_PERCENTILE: float = 95.0
+    DEPLOY_HEDGE_DELAY: float = 10.0
+
+    # SQLite database shared by all Tier1 worker processes on a host, so that
+    # every worker sees the reports received by the others. By default each
+    # process keeps its own registry.
+    REGISTRY_DATABASE: str | Path | None = None
+
+    # Match functions rank cloudlets by their cpu and memory load forecast
+    # this many seconds ahead, roughly the time it takes to deploy, based on
+    # the trend of their recent reports. 0 uses the last reported values.
+    FORECAST_HORIZON: float = 30.0
+
+    # File where the reporting cloudlets are saved every
+    # REGISTRY_SNAPSHOT_INTERVAL seconds. A restarted Tier1 restores them from
+    # the snapshot instead of waiting for every cloudlet to report again.
+    REGISTRY_SNAPSHOT: str | Path | None = None
+    REGISTRY_SNAPSHOT_INTERVAL: float = 30.0
+
     # These are initialized by the wsgi app factory from the config
-    # cloudlets: dict[UUID, Cloudlet] = {}                          # CLOUDLETS
+    # cloudlets: CloudletRegistry = CloudletRegistry()  # CLOUDLETS, REGISTRY_DATABASE
     # executor = Executor(flask_app)
     # geolite2_reader = geolite2.reader()
     # match_functions: list[Tier1MatchFunction] = []                # MATCHERS
+    # placement_cache = PlacementCache()                # PLACEMENT_CACHE_SIZE
+    # summary_cache = SummaryCache()
     # deployment_repository: DeploymentRepository | None = None     # RECIPES
 
 
-def load_cloudlets_conf(cloudlets_conf: str | Path | None) -> dict[UUID, Cloudlet]:
+# logged by connexion for every streamed response
+STREAMED_VALIDATION_WARNING = "Skipping response validation for streamed response."
+
+
+class SkipStreamedValidation(logging.Filter):
+    """Only drops the streamed response warning, other messages still pass"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.getMessage() != STREAMED_VALIDATION_WARNING
+
+
+skip_streamed_validation = SkipStreamedValidation()
+
+
+def load_cloudlets_conf(
+    cloudlets_conf: str | Path | None, database: str | Path | None = None
+) -> CloudletRegistry:
     """read cloudlets.yaml configuration file to preseed Tier2 cloudlets
 
     this depends on flask_app.config["geolite2_reader"]
     """
-    if cloudlets_conf is None:
-        return {}
+    cloudlets = []
+    if cloudlets_conf is not None:
+        with Path(cloudlets_conf).open() as stream:
+            cloudlets = cloudlets_load(stream)
+
+    if database is not None:
+        return SharedCloudletRegistry(database, cloudlets)
+    return CloudletRegistry(cloudlets)
 
-    with Path(cloudlets_conf).open() as stream:
-        cloudlets = cloudlets_load(stream)
 
-    return {cloudlet.uuid: cloudlet for cloudlet in cloudlets}
+def restore_snapshot(cloudlets: CloudletRegistry, snapshot: str | Path | None) -> None:
+    """add reporting cloudlets saved before a restart, other workers sharing
+    the registry may already have restored or heard from them
+    """
+    if snapshot is None:
+        return
+
+    restored = 0
+    for cloudlet in load_snapshot(snapshot):
+        if cloudlet.uuid not in cloudlets:
+            cloudlets[cloudlet.uuid] = cloudlet
+            restored += 1
+    logging.info(f"Restored {restored} cloudlets from {snapshot}")
 
 
 def list_match_functions(value):
@@ -102,19 +196,41 @@ def wsgi_app_factory(**args) -> connexion.FlaskApp:
 
     with flask_app.app_context():
         flask_app.config["cloudlets"] = load_cloudlets_conf(
-            flask_app.config.get("CLOUDLETS")
+            flask_app.config.get("CLOUDLETS"), flask_app.config["REGISTRY_DATABASE"]
+        )
+        restore_snapshot(
+            flask_app.config["cloudlets"], flask_app.config["REGISTRY_SNAPSHOT"]
         )
+    resources = flask_app.config["cloudlets"].resources
+    resources.reservation_settle = float(flask_app.config["RESERVATION_SETTLE"])
+    resources.reservation_timeout = float(flask_app.config["RESERVATION_TIMEOUT"])
+    sessions = flask_app.config["cloudlets"].sessions
+    sessions.pool_size = int(flask_app.config["DEPLOY_POOL_SIZE"])
+    sessions.connect_timeout = float(flask_app.config["DEPLOY_CONNECT_TIMEOUT"])
+    sessions.read_timeout = float(flask_app.config["DEPLOY_READ_TIMEOUT"])
     flask_app.config["deployment_repository"] = DeploymentRepository(
         flask_app.config["RECIPES"]
     )
     flask_app.config["match_functions"] = load_match_functions(
         flask_app.config["MATCHERS"]
     )
+    flask_app.config["placement_cache"] = PlacementCache(
+        int(flask_app.config["PLACEMENT_CACHE_SIZE"])
+    )
+    flask_app.config["summary_cache"] = SummaryCache()
 
     # start background job to expire Tier2 cloudlets that are no longer reporting
     scheduler.init_app(flask_app)
     scheduler.start()
     start_expire_cloudlets_job()
+    start_reload_settings_job()
+    if flask_app.config["REGISTRY_SNAPSHOT"] is not None:
+        start_snapshot_job(float(flask_app.config["REGISTRY_SNAPSHOT_INTERVAL"]))
+
+    # the cached cloudlet list is streamed without validating it every time
+    logging.getLogger("connexion.decorators.response").addFilter(
+        skip_streamed_validation
+    )
 
     # handle running behind reverse proxy (should this be made configurable?)
     flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app)
@@ -0,0 +1,187 @@
+#
+# Sinfonia
+#
+# Joint placement of a batch of deployment requests
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Place many deployment requests at once
+
+Placing the requests of a batch one at a time with the match functions ranks
+every cloudlet against the same reported capacity for each request. Instead
+the batch is packed onto the capacity matrix of all cloudlets in one pass,
+updating the remaining capacity after every placement.
+
+Finding an optimal assignment is a generalized assignment problem, so a
+greedy heuristic is used. Requests from the same client for the same recipe
+and resources form a group, and the configured match functions run once per
+group. The cloudlets they return keep their rank, as for a single deployment
+the network and location preferences and the acls of the cloudlets apply.
+The first match function that ranks by resources (see resource_matcher) is
+not run, the candidates that are left for it are scored again against the
+remaining capacity for every request of the group, so that the balancing
+match functions spread the batch.
+
+The largest requests are placed first, each on the best ranked cloudlet that
+still has sufficient resources left after the requests placed before it.
+"""
+
+from __future__ import annotations
+
+from typing import Hashable, Iterator, Sequence
+
+import attrs
+import numpy as np
+
+from .candidates import Candidates
+from .client_info import ClientInfo
+from .cloudlets import Cloudlet
+from .deployment_recipe import DeploymentRecipe
+from .matchers import (
+    CandidatesMatchFunction,
+    ResourceScore,
+    Tier1MatchFunction,
+    candidates_matcher,
+    tier1_best_match,
+)
+from .registry import CloudletRegistry, RegistrySnapshot
+from .resource_matrix import AVAILABLE, USED, feasible, requirements, top_k
+
+
+@attrs.frozen
+class GroupRanking:
+    """Candidates of a group of identical requests, as snapshot positions"""
+
+    # returned by the match functions, best match first
+    ranked: list[int]
+    # left for the first resource ranking match function
+    scored: np.ndarray
+    score: ResourceScore | None = None
+    descending: bool = False
+
+    def select(self, values: np.ndarray, demand: np.ndarray) -> int | None:
+        """Best candidate with sufficient resources left in values"""
+        requested = demand > 0
+        for position in self.ranked:
+            if np.all(values[position, AVAILABLE][requested] >= demand[requested]):
+                return position
+
+        scored = self.scored[feasible(values[self.scored], demand)]
+        if not len(scored):
+            return None
+        if self.score is None:
+            return int(scored[0])
+        scores = self.score(values[scored], demand)
+        return int(scored[top_k(scores, 1, self.descending)[0]])
+
+
+def _collect(collected: list[Cloudlet]) -> CandidatesMatchFunction:
+    """Match function that takes all remaining candidates without yielding"""
+
+    @candidates_matcher
+    def collect(
+        _client_info: ClientInfo,
+        _deployment_recipe: DeploymentRecipe,
+        candidates: Candidates,
+    ) -> Iterator[Cloudlet]:
+        collected.extend(candidates)
+        candidates.clear()
+        return iter(())
+
+    return collect
+
+
+def _ranking(
+    match_functions: Sequence[Tier1MatchFunction],
+    client_info: ClientInfo,
+    recipe: DeploymentRecipe,
+    snapshot: RegistrySnapshot,
+    registry: CloudletRegistry,
+) -> GroupRanking:
+    """Run the match functions for a group of requests. Match functions after
+    the first resource ranking one would not see any candidates.
+    """
+    chain = list(match_functions)
+    collected: list[Cloudlet] = []
+    score: ResourceScore | None = None
+    descending = False
+    for index, matcher in enumerate(chain):
+        resource_score = getattr(matcher, "resource_score", None)
+        if resource_score is not None:
+            score, descending = resource_score
+            chain[index:] = [_collect(collected)]
+            break
+
+    candidates = Candidates(snapshot, registry)
+    ranked = [
+        snapshot.positions[cloudlet.uuid]
+        for cloudlet in tier1_best_match(chain, client_info, recipe, candidates)
+        if cloudlet.uuid in snapshot.positions
+    ]
+    scored = np.array(
+        [
+            snapshot.positions[cloudlet.uuid]
+            for cloudlet in collected
+            if cloudlet.uuid in snapshot.positions
+        ],
+        dtype=np.intp,
+    )
+    return GroupRanking(ranked, scored, score, descending)
+
+
+def place_batch(
+    match_functions: Sequence[Tier1MatchFunction],
+    requests: Sequence[tuple[DeploymentRecipe, ClientInfo]],
+    registry: CloudletRegistry,
+    horizon: float = 0.0,
+) -> list[Cloudlet | None]:
+    """Select a cloudlet for each (recipe, client) request, None when none of
+    the candidates of the request has sufficient resources left. Cloudlet load
+    is forecast horizon seconds ahead.
+    """
+    snapshot = registry.snapshot()
+    cloudlets = snapshot.cloudlets
+    if not requests or not cloudlets:
+        return [None] * len(requests)
+
+    # charged with the requests of the batch as they are placed
+    values = registry.resources.take(snapshot.uuids, horizon)
+
+    used = np.nan_to_num(values[:, USED], nan=0.0)
+    available = np.nan_to_num(values[:, AVAILABLE[: len(USED)]], nan=0.0)
+    capacity = used + np.maximum(available, 0.0)
+
+    demands = np.array(
+        [requirements(client_info.resourceReqs) for _, client_info in requests]
+    ).reshape(len(requests), len(AVAILABLE))
+
+    # largest requests first, relative to the average capacity
+    scale = np.where(capacity.any(axis=0), capacity.mean(axis=0), 1.0)
+    order = np.argsort(-(demands[:, : len(USED)] / scale).sum(axis=1), kind="stable")
+
+    # requests from the same client for the same recipe are only matched once
+    rankings: dict[Hashable, GroupRanking] = {}
+    placements: list[Cloudlet | None] = [None] * len(requests)
+    for request in order:
+        recipe, client_info = requests[request]
+        demand = demands[request]
+        location = client_info.location
+        key = (
+            client_info.ipaddress,
+            None if location is None else location.coordinate,
+            tuple(demand.tolist()),
+            recipe.uuid,
+        )
+        if key not in rankings:
+            rankings[key] = _ranking(
+                match_functions, client_info, recipe, snapshot, registry
+            )
+
+        position = rankings[key].select(values, demand)
+        if position is not None:
+            values[position, AVAILABLE] -= demand
+            values[position, USED] += demand[: len(USED)]
+            placements[request] = cloudlets[position]
+    return placements
@@ -0,0 +1,139 @@
+#
+# Sinfonia
+#
+# Candidate cloudlets considered for a single deployment request
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+
+from __future__ import annotations
+
+import random
+from typing import Iterable, Iterator, Mapping, Sequence
+from uuid import UUID
+
+from .cloudlets import Cloudlet
+from .registry import CloudletRegistry, RegistrySnapshot
+
+
+class Candidates:
+    """Ordered set of the cloudlets that are still eligible for a deployment.
+
+    A single instance is shared by all match functions in a tier1_best_match
+    chain. Removing a cloudlet is O(1), and the cloudlets that were already
+    returned to the caller are tracked so that no later match function can
+    return them again. When the caller will only consume a limited number of
+    results, match functions can use `wanted` to avoid ranking everything.
+
+    Candidates taken from a RegistrySnapshot share its mapping and positions,
+    discarded cloudlets are tracked separately instead of copying them.
+    """
+
+    def __init__(
+        self,
+        cloudlets: RegistrySnapshot | Iterable[Cloudlet],
+        registry: CloudletRegistry | None = None,
+        limit: int | None = None,
+    ) -> None:
+        self._cloudlets: Mapping[UUID, Cloudlet]
+        self._position: Mapping[UUID, int] | None
+        self._sampled: Sequence[UUID] | None
+        if isinstance(cloudlets, RegistrySnapshot):
+            self._cloudlets = cloudlets.by_uuid
+            self._position = cloudlets.positions
+            self._sampled = cloudlets.uuids
+        else:
+            self._cloudlets = {cloudlet.uuid: cloudlet for cloudlet in cloudlets}
+            self._position = None
+            self._sampled = None
+        self._discarded: set[UUID] = set()
+        self._registry = registry
+        self.limit = limit
+        self.yielded: list[Cloudlet] = []
+        self._yielded_uuids: set[UUID] = set()
+
+    @property
+    def registry(self) -> CloudletRegistry:
+        """Registry with the indexes (resources, locations, networks) used by
+        the match functions. When the candidates were not taken from the Tier1
+        registry, an index is created on first use.
+        """
+        if self._registry is None:
+            self._registry = CloudletRegistry(self)
+        return self._registry
+
+    @property
+    def wanted(self) -> int | None:
+        """Number of results the caller will still consume, None if unlimited"""
+        if self.limit is None:
+            return None
+        return max(self.limit - len(self.yielded), 0)
+
+    def __len__(self) -> int:
+        return len(self._cloudlets) - len(self._discarded)
+
+    def __iter__(self) -> Iterator[Cloudlet]:
+        if not self._discarded:
+            return iter(self._cloudlets.values())
+        return (
+            cloudlet
+            for uuid, cloudlet in self._cloudlets.items()
+            if uuid not in self._discarded
+        )
+
+    def __contains__(self, cloudlet: object) -> bool:
+        uuid = cloudlet.uuid if isinstance(cloudlet, Cloudlet) else cloudlet
+        return uuid in self._cloudlets and uuid not in self._discarded
+
+    def get(self, uuid: UUID) -> Cloudlet | None:
+        if uuid in self._discarded:
+            return None
+        return self._cloudlets.get(uuid)
+
+    def position(self, uuid: UUID) -> int:
+        """Position of a cloudlet in the original ordering of the candidates,
+        used to break ties.
+        """
+        if self._position is None:
+            self._position = {uuid: index for index, uuid in enumerate(self._cloudlets)}
+        return self._position.get(uuid, len(self._position))
+
+    def sample(self, k: int) -> list[Cloudlet]:
+        """Up to k distinct randomly selected candidates.
+
+        Draws from a list of uuids that is only rebuilt when more than half of
+        them were discarded, so drawing a few samples does not copy all the
+        remaining candidates on every call.
+        """
+        k = min(k, len(self))
+        if self._sampled is None or len(self._sampled) > 2 * len(self):
+            self._sampled = [cloudlet.uuid for cloudlet in self]
+
+        picked: dict[UUID, Cloudlet] = {}
+        while len(picked) < k:
+            uuid = self._sampled[random.randrange(len(self._sampled))]
+            cloudlet = self.get(uuid)
+            if cloudlet is not None:
+                picked[uuid] = cloudlet
+        return list(picked.values())
+
+    def discard(self, cloudlet: Cloudlet) -> None:
+        if cloudlet.uuid in self._cloudlets:
+            self._discarded.add(cloudlet.uuid)
+
+    def clear(self) -> None:
+        self._cloudlets = {}
+        self._discarded.clear()
+
+    def mark_yielded(self, cloudlet: Cloudlet) -> bool:
+        """Remove cloudlet and remember it was returned to the caller.
+        Returns False when the cloudlet was already returned before.
+        """
+        self.discard(cloudlet)
+        if cloudlet.uuid in self._yielded_uuids:
+            return False
+        self._yielded_uuids.add(cloudlet.uuid)
+        self.yielded.append(cloudlet)
+        return True
@@ -26,28 +26,22 @@ class ClientInfo:
     publickey: WireguardKey = field(converter=WireguardKey)
     ipaddress: IPv4Address | IPv6Address
     location: GeoLocation | None
-    resourceReqs: dict
+    resourceReqs: dict = field(factory=dict)
 
     @classmethod
     def from_request(cls, application_key: str) -> ClientInfo:
         """Create ClientInfo object from http request parameters.
         May raise ValueError when parameters are badly formatted.
         """
-        try:
-            client_address: str = request.headers.get("X-ClientIP")
-            client_ipaddress = ip_address(client_address)
-        except (KeyError, ValueError):
-            client_ipaddress = ip_address(request.remote_addr)
+        client_ipaddress = _request_address()
 
         try:
             client_location = GeoLocation.from_request_or_addr(client_ipaddress)
         except ValueError:
             client_location = None
 
-        try:
-            resource_reqs = request.json
-        except ValueError:
-            resource_reqs = None
+        # resource requirements are optional and passed as a json request body
+        resource_reqs = request.get_json(silent=True) or {}
 
         print("LOG: RESOURCE REQS: ", resource_reqs)
 
@@ -58,6 +52,34 @@ class ClientInfo:
             resourceReqs=resource_reqs
         )
 
+    @classmethod
+    def from_batch_item(cls, item: dict) -> ClientInfo:
+        """Create ClientInfo object for an entry of a batch deploy request.
+        The client address and location default to those of the request.
+        May raise ValueError when parameters are badly formatted.
+        """
+        if "client_ip" in item:
+            client_ipaddress = ip_address(item["client_ip"])
+            lookup_location = GeoLocation.from_address
+        else:
+            client_ipaddress = _request_address()
+            lookup_location = GeoLocation.from_request_or_addr
+
+        if "location" in item:
+            client_location = GeoLocation.from_tuple(item["location"])
+        else:
+            try:
+                client_location = lookup_location(client_ipaddress)
+            except ValueError:
+                client_location = None
+
+        return cls(
+            publickey=item["application_key"],
+            ipaddress=client_ipaddress,
+            location=client_location,
+            resourceReqs=item.get("resourceReqs") or {},
+        )
+
     @classmethod
     def from_address(
         cls,
@@ -67,3 +89,12 @@ class ClientInfo:
         ipaddress = ip_address(address)
         location = GeoLocation.from_address(ipaddress)
         return cls(publickey=application_key, ipaddress=ipaddress, location=location)
+
+
+def _request_address() -> IPv4Address | IPv6Address:
+    """Client address from the X-ClientIP header or the http request"""
+    try:
+        client_address: str = request.headers.get("X-ClientIP")
+        return ip_address(client_address)
+    except (KeyError, ValueError):
+        return ip_address(request.remote_addr)
@@ -12,15 +12,23 @@ from __future__ import annotations
 
 import logging
 import socket
+import time
 from concurrent.futures import Future
-from ipaddress import IPv4Network, IPv6Network, ip_interface
-from typing import Any, List, Union
+from ipaddress import (
+    IPv4Interface,
+    IPv4Network,
+    IPv6Interface,
+    IPv6Network,
+    ip_interface,
+)
+from threading import Lock
+from typing import Any, List, Mapping, Union
 from uuid import UUID, uuid4
 
 import pendulum
 import requests
 import yaml
-from attrs import define
+from attrs import define, field
 from connexion.exceptions import ProblemException
 from flask import current_app
 from jsonschema import Draft202012Validator
@@ -28,6 +36,8 @@ from yarl import URL
 
 from .client_info import ClientInfo
 from .geo_location import GeoLocation, geolocate
+from .resource_matrix import Resources
+from .sessions import SessionPool
 
 CLOUDLET_SCHEMA = {
     "$schema": "https://json-schema.org/draft/2020-12/schema",
@@ -126,6 +136,90 @@ def getaddrinfo(host, port):
 
 
 NetworkList = List[Union[IPv4Network, IPv6Network]]
+InterfaceList = List[Union[IPv4Interface, IPv6Interface]]
+
+# identical networks, such as the default accepted_clients, are shared by all
+# cloudlets that use them. The table is simply cleared when it grows too big,
+# networks that are still in use are shared again once they are seen again.
+INTERNED_NETWORKS = 65536
+_networks: dict[IPv4Network | IPv6Network, IPv4Network | IPv6Network] = {}
+
+
+def intern_network(network: Any) -> IPv4Network | IPv6Network:
+    """Network for an address or network, identical networks are shared"""
+    network = ip_interface(network).network
+    if len(_networks) >= INTERNED_NETWORKS:
+        _networks.clear()
+    return _networks.setdefault(network, network)
+
+
+# resolved endpoint addresses and their geolocations are reused for this long
+RESOLVE_TTL = 300.0
+
+
+@define
+class ResolvedHost:
+    addresses: InterfaceList
+    expires: float
+    locations: list[GeoLocation] | None = None
+
+
+class ResolverCache:
+    """Cache the addresses and geolocations of cloudlet endpoint hosts.
+
+    Tier2 cloudlets report every few seconds, resolving the endpoint for
+    every report would block a worker thread on DNS for each of them.
+    """
+
+    def __init__(self, ttl: float = RESOLVE_TTL) -> None:
+        self.ttl = ttl
+        self._hosts: dict[tuple[str | None, int | None], ResolvedHost] = {}
+        self._lock = Lock()
+
+    def _lookup(self, host: str | None, port: int | None) -> ResolvedHost:
+        now = time.monotonic()
+        with self._lock:
+            resolved = self._hosts.get((host, port))
+        if resolved is not None and resolved.expires > now:
+            return resolved
+
+        # resolve without holding the lock, concurrently resolving the same
+        # host more than once is harmless
+        resolved = ResolvedHost(getaddrinfo(host, port), now + self.ttl)
+        with self._lock:
+            for key in [key for key, old in self._hosts.items() if old.expires <= now]:
+                del self._hosts[key]
+            self._hosts[(host, port)] = resolved
+        return resolved
+
+    def addresses(self, host: str | None, port: int | None) -> InterfaceList:
+        """Global ip addresses of a host"""
+        return list(self._lookup(host, port).addresses)
+
+    def locations(self, host: str | None, port: int | None) -> list[GeoLocation]:
+        """Geolocations of the addresses of a host"""
+        resolved = self._lookup(host, port)
+        if resolved.locations is None:
+            resolved.locations = [
+                coordinate
+                for coordinate in (geolocate(addr.ip) for addr in resolved.addresses)
+                if coordinate is not None
+            ]
+        return list(resolved.locations)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._hosts.clear()
+
+
+resolver = ResolverCache()
+
+
+def v1_endpoint(endpoint: URL) -> URL:
+    """Deployment endpoint of the v1 api, newer api versions are not used"""
+    if int(endpoint.parent.name[1:]) > 1:
+        return endpoint.parent.with_name("v1") / "deploy"
+    return endpoint
 
 
 @define
@@ -137,9 +231,15 @@ class Cloudlet:
     local_networks: NetworkList
     accepted_clients: NetworkList
     rejected_clients: NetworkList
-    resources: dict[str, float]
+    resources: Resources
     api_version: int
     last_update: pendulum.DateTime | None
+    # sequence number of the last report, deltas have to follow it
+    sequence: int | None = None
+    # the parts of the summary that do not change with reported resources
+    _summary: dict[str, Any] | None = field(
+        default=None, init=False, repr=False, eq=False
+    )
 
     @classmethod
     def new(
@@ -151,8 +251,9 @@ class Cloudlet:
         local_networks: NetworkList | None = None,
         accepted_clients: NetworkList | None = None,
         rejected_clients: NetworkList | None = None,
-        resources: dict[str, float] | None = None,
+        resources: Mapping[str, float] | None = None,
         last_update: pendulum.DateTime | None = None,
+        sequence: int | None = None,
     ) -> Cloudlet:
         # default name to hostname of cloudlet url
         if name is None:
@@ -161,24 +262,19 @@ class Cloudlet:
         api_version = int(endpoint.parent.name[1:])
         if api_version > 1:
             logging.info(f"Downgrading {endpoint} api version to v1")
-            endpoint = endpoint.parent.with_name("v1") / "deploy"
+            endpoint = v1_endpoint(endpoint)
             api_version = 1
 
-        # we may need to resolve the ip address(es) of the cloudlet
-        if locations is None or local_networks is None:
-            local_addresses = getaddrinfo(endpoint.host, endpoint.port)
-
         if locations is None:
             # geoip lookup for addresses associated with hostname
-            locations = [
-                coordinate
-                for coordinate in (geolocate(addr.ip) for addr in local_addresses)
-                if coordinate is not None
-            ]
+            locations = resolver.locations(endpoint.host, endpoint.port)
 
         # set sensible defaults for local_networks and accepted clients
         if local_networks is None:
-            local_networks = local_addresses
+            local_networks = [
+                address.network
+                for address in resolver.addresses(endpoint.host, endpoint.port)
+            ]
 
         if accepted_clients is None:
             accepted_clients = [IPv4Network("0.0.0.0/0")]
@@ -189,20 +285,18 @@ class Cloudlet:
         if rejected_clients is None:
             rejected_clients = []
 
-        if resources is None:
-            resources = {}
-
         return cls(
             uuid,
             endpoint,
             name,
             locations,
-            [ip_interface(network).network for network in local_networks],
-            [ip_interface(network).network for network in accepted_clients],
-            [ip_interface(network).network for network in rejected_clients],
-            resources,
+            [intern_network(network) for network in local_networks],
+            [intern_network(network) for network in accepted_clients],
+            [intern_network(network) for network in rejected_clients],
+            Resources(resources),
             api_version,
             last_update,
+            sequence,
         )
 
     @classmethod
@@ -239,7 +333,7 @@ class Cloudlet:
 
     @classmethod
     def new_from_api(cls, request_body: dict) -> Cloudlet:
-        uuid = request_body["uuid"]
+        uuid = UUID(str(request_body["uuid"]))
         endpoint = URL(request_body["endpoint"])
         locations = [
             GeoLocation.from_tuple(coord) for coord in request_body.get("locations", [])
@@ -256,6 +350,72 @@ class Cloudlet:
             rejected_clients=rejected_clients,
             resources=resources,
             last_update=pendulum.now(),
+            sequence=request_body.get("sequence"),
+        )
+
+    @classmethod
+    def new_from_attributes(
+        cls,
+        uuid: UUID,
+        attributes: dict[str, Any],
+        resources: Mapping[str, float] | None = None,
+        last_update: pendulum.DateTime | None = None,
+        sequence: int | None = None,
+    ) -> Cloudlet:
+        """Recreate a cloudlet from its attributes() without resolving the
+        endpoint address.
+        """
+        return cls.new(
+            uuid=uuid,
+            endpoint=URL(attributes["endpoint"]),
+            name=attributes["name"],
+            locations=[
+                GeoLocation.from_tuple(coord) for coord in attributes["locations"]
+            ],
+            local_networks=attributes["local_networks"],
+            accepted_clients=attributes["accepted_clients"],
+            rejected_clients=attributes["rejected_clients"],
+            resources=resources,
+            last_update=last_update,
+            sequence=sequence,
+        )
+
+    def attributes(self) -> dict[str, Any]:
+        """JSON encodable attributes that do not change with a heartbeat"""
+        return dict(
+            endpoint=str(self.endpoint),
+            name=self.name,
+            locations=[location.coordinate for location in self.locations],
+            local_networks=[str(network) for network in self.local_networks],
+            accepted_clients=[str(network) for network in self.accepted_clients],
+            rejected_clients=[str(network) for network in self.rejected_clients],
+        )
+
+    def reported_unchanged(self, request_body: dict) -> bool:
+        """True when a report from the cloudlet only differs from this cloudlet
+        in the reported resources.
+        """
+        # compare with the endpoint as it was downgraded when it was added
+        if v1_endpoint(URL(request_body["endpoint"])) != self.endpoint:
+            return False
+
+        locations = [
+            GeoLocation.from_tuple(coord) for coord in request_body.get("locations", [])
+        ]
+        if locations != self.locations:
+            return False
+
+        accepted_clients = request_body.get("accepted_clients")
+        if accepted_clients is None:
+            accepted_clients = [IPv4Network("0.0.0.0/0")]
+        rejected_clients = request_body.get("rejected_clients") or []
+        local_networks = resolver.addresses(self.endpoint.host, self.endpoint.port)
+        return (
+            [ip_interface(network).network for network in accepted_clients]
+            == self.accepted_clients
+            and [ip_interface(network).network for network in rejected_clients]
+            == self.rejected_clients
+            and [address.network for address in local_networks] == self.local_networks
         )
 
     def deploy_async(
@@ -265,6 +425,9 @@ class Cloudlet:
     ) -> Future:
         """Initiate backend deployment on this cloudlet."""
 
+        # connections to the cloudlet are kept open by the registry
+        sessions = current_app.config["cloudlets"].sessions
+
         def deploy(
             url: str,
             client_address: str | None,
@@ -276,8 +439,7 @@ class Cloudlet:
                     headers["X-ClientIP"] = client_address
                 if client_location is not None:
                     headers["X-Location"] = f"{client_location[0]},{client_location[1]}"
-                r = requests.post(url, headers=headers)
-                r.raise_for_status()
+                r = sessions.post(self.uuid, url, headers=headers)
                 return r.json()
             except requests.exceptions.RequestException:
                 logger.exception("Exception while forwarding request")
@@ -295,6 +457,18 @@ class Cloudlet:
             else None,
         )
 
+    def undeploy(
+        self, app_uuid: UUID, client_info: ClientInfo, sessions: SessionPool
+    ) -> bool:
+        """Remove a deployment from this cloudlet, returns False on failure."""
+        request_url = self.endpoint / str(app_uuid) / client_info.publickey.urlsafe
+        try:
+            sessions.delete(self.uuid, str(request_url))
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Failed to remove deployment from {self}: {e}")
+            return False
+        return True
+
     def deploy(self, app_uuid: UUID, client_info: ClientInfo) -> dict[str, Any]:
         """Request backend deployment on this cloudlet."""
 
@@ -305,26 +479,31 @@ class Cloudlet:
 
         return result
 
-    def distance_from(self, location: GeoLocation) -> float | None:
+    def distance_from(
+        self, location: GeoLocation, method: str | None = None
+    ) -> float | None:
         """Calculate closest distance to any cloudlet managed by this Tier 2 instance.
         Return distance in kilometers, or None when cloudlet location is unknown.
+        By default the exact geodesic distance is calculated, alternatively pass
+        any of the GeoLocation.distances accuracy modes.
         """
-        closest = None
-        for cloudlet_location in self.locations:
-            distance = cloudlet_location - location
-            if closest is None or distance < closest:
-                closest = distance
-        return closest
+        if not self.locations:
+            return None
+        if method is not None:
+            coordinates = [cloudlet.coordinate for cloudlet in self.locations]
+            return float(location.distances(coordinates, method).min())
+        return min(cloudlet_location - location for cloudlet_location in self.locations)
 
     def summary(self) -> dict[str, Any]:
         """Returns json encodeable 'CloudletSummary'"""
-        summary = dict(
-            endpoint=str(self.endpoint),
-            locations=[location.coordinate for location in self.locations],
-            accepted_clients=[str(client) for client in self.accepted_clients],
-            rejected_clients=[str(client) for client in self.rejected_clients],
-            resources=self.resources,
-        )
+        if self._summary is None:
+            self._summary = dict(
+                endpoint=str(self.endpoint),
+                locations=[location.coordinate for location in self.locations],
+                accepted_clients=[str(client) for client in self.accepted_clients],
+                rejected_clients=[str(client) for client in self.rejected_clients],
+            )
+        summary = dict(self._summary, resources=dict(self.resources))
         if self.last_update is not None:
             summary["last_update"] = str(self.last_update)
         return summary
@@ -99,7 +99,7 @@ class DeploymentRecipe:
             uuid = UUID(uuid)
         try:
             return cls.from_repo(repository, uuid)
-        except RequestException:
+        except (RequestException, OSError):
             raise ValueError(f"Request for unknown recipe {uuid}")
         except ValidationError:
             raise ValueError(f"Failed to validate recipe {uuid}")
@@ -11,11 +11,26 @@
 from __future__ import annotations
 
 from ipaddress import IPv4Address, IPv6Address, ip_address
+from typing import Sequence, Tuple, Union
 
 import geopy.distance
+import numpy as np
 from attrs import define, field
 from flask import current_app, request
 
+# mean earth radius in km
+EARTH_RADIUS = 6371.0088
+
+# WGS-84 ellipsoid, equatorial radius in km and flattening
+WGS84_RADIUS = 6378.137
+WGS84_FLATTENING = 1 / 298.257223563
+
+# accuracy modes for GeoLocation.distances
+HAVERSINE = "haversine"
+ELLIPSOIDAL = "ellipsoidal"
+
+Coordinates = Union[np.ndarray, Sequence[Tuple[float, float]]]
+
 
 @define
 class GeoLocation:
@@ -80,6 +95,70 @@ class GeoLocation:
         """Calculate geographic distance between this and other."""
         return geopy.distance.distance(self.coordinate, other.coordinate).km
 
+    def distances(
+        self, coordinates: Coordinates, method: str = HAVERSINE
+    ) -> np.ndarray:
+        """Calculate distances in km to an array of (latitude, longitude) pairs.
+
+        Much cheaper than subtracting GeoLocations one pair at a time.
+        'haversine' returns great-circle distances on a sphere, which are off by
+        up to 0.5%, 'ellipsoidal' uses Andoyer-Lambert's approximation of the
+        geodesic on the WGS-84 ellipsoid, which is within 0.01% except for
+        nearly antipodal points.
+        """
+        latitudes, longitudes = np.radians(
+            np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        ).T
+        latitude, longitude = np.radians(self.coordinate)
+
+        if method == HAVERSINE:
+            return EARTH_RADIUS * _central_angle(
+                latitude, longitude, latitudes, longitudes
+            )
+        if method == ELLIPSOIDAL:
+            return _andoyer_lambert(latitude, longitude, latitudes, longitudes)
+        raise ValueError(f"Unknown distance method {method}")
+
+
+def _central_angle(
+    latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray
+) -> np.ndarray:
+    """Haversine formula for the central angle between points on a sphere"""
+    haversine = (
+        np.sin((latitudes - latitude) / 2) ** 2
+        + np.cos(latitude)
+        * np.cos(latitudes)
+        * np.sin((longitudes - longitude) / 2) ** 2
+    )
+    return 2 * np.arcsin(np.sqrt(np.clip(haversine, 0.0, 1.0)))
+
+
+def _andoyer_lambert(
+    latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray
+) -> np.ndarray:
+    """Andoyer-Lambert first order flattening correction of the central angle
+    between reduced latitudes, approximates the geodesic on the WGS-84 ellipsoid.
+    """
+    reduced = np.arctan((1 - WGS84_FLATTENING) * np.tan(latitude))
+    reduced_latitudes = np.arctan((1 - WGS84_FLATTENING) * np.tan(latitudes))
+    sigma = _central_angle(reduced, longitude, reduced_latitudes, longitudes)
+
+    P = (reduced + reduced_latitudes) / 2
+    Q = (reduced_latitudes - reduced) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        X = (
+            (sigma - np.sin(sigma))
+            * (np.sin(P) * np.cos(Q)) ** 2
+            / np.cos(sigma / 2) ** 2
+        )
+        Y = (
+            (sigma + np.sin(sigma))
+            * (np.cos(P) * np.sin(Q)) ** 2
+            / np.sin(sigma / 2) ** 2
+        )
+    correction = np.nan_to_num(X + Y, nan=0.0, posinf=0.0)
+    return WGS84_RADIUS * (sigma - WGS84_FLATTENING / 2 * correction)
+
 
 def geolocate(ipaddress: IPv4Address | IPv6Address) -> GeoLocation | None:
     try:
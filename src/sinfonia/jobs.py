@@ -8,15 +8,21 @@
 # SPDX-License-Identifier: MIT
 #
 
+from __future__ import annotations
+
 import logging
+import os
 
 import pendulum
 import requests
 import time
+from flask import Config
 from flask_apscheduler import APScheduler
 from requests.exceptions import RequestException
 from yarl import URL
 
+from .snapshot import save_snapshot
+
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -26,19 +32,19 @@ scheduler = APScheduler()
 def expire_cloudlets():
     cloudlets = scheduler.app.config["cloudlets"]
 
-    expiration = pendulum.now().subtract(minutes=5)
+    expiration = pendulum.now().timestamp() - 5 * 60
 
-    for cloudlet in list(cloudlets.values()):
-        if cloudlet.last_update is not None and cloudlet.last_update < expiration:
-            logging.info(f"Removing stale {cloudlet}")
-            cloudlets.pop(cloudlet.uuid, None)
+    for cloudlet in cloudlets.expire(expiration):
+        logging.info(f"Removing stale {cloudlet}")
 
 
 def start_expire_cloudlets_job():
+    # the registry keeps cloudlets ordered by last update, so checking often
+    # only costs a look at the oldest entry when nothing expired
     scheduler.add_job(
         func=expire_cloudlets,
         trigger="interval",
-        seconds=60,
+        seconds=1,
         max_instances=1,
         coalesce=True,
         id="expire_cloudlets",
@@ -46,6 +52,81 @@ def start_expire_cloudlets_job():
     )
 
 
+def snapshot_cloudlets():
+    cloudlets = scheduler.app.config["cloudlets"]
+    snapshot = scheduler.app.config["REGISTRY_SNAPSHOT"]
+
+    # workers share the snapshot file, only the one expiring cloudlets saves it
+    if not cloudlets.holds_expiry_lease():
+        return
+
+    try:
+        save_snapshot(cloudlets, snapshot)
+    except OSError as e:
+        logger.warning(f"Failed to save snapshot {snapshot}: {e}")
+
+
+def start_snapshot_job(interval: float):
+    scheduler.add_job(
+        func=snapshot_cloudlets,
+        trigger="interval",
+        seconds=interval,
+        max_instances=1,
+        coalesce=True,
+        id="snapshot_cloudlets",
+        replace_existing=True,
+    )
+
+
+# settings that are picked up from SINFONIA_SETTINGS without a restart
+RELOADABLE_SETTINGS = ["MATCHER_WEIGHTS"]
+_settings_mtime: float | None = None
+
+
+def reload_settings():
+    global _settings_mtime
+
+    settings_file = os.environ.get("SINFONIA_SETTINGS")
+    if not settings_file:
+        return
+
+    try:
+        mtime = os.stat(settings_file).st_mtime
+    except OSError:
+        return
+
+    if _settings_mtime is None or mtime == _settings_mtime:
+        _settings_mtime = mtime
+        return
+    _settings_mtime = mtime
+
+    config = scheduler.app.config
+    settings = Config(config.root_path)
+    try:
+        settings.from_pyfile(settings_file)
+    except Exception:
+        logging.exception(f"Failed to reload {settings_file}")
+        return
+
+    for key in RELOADABLE_SETTINGS:
+        if key in settings and settings[key] != config.get(key):
+            logging.info(f"Reloaded {key} = {settings[key]}")
+            config[key] = settings[key]
+
+
+def start_reload_settings_job():
+    reload_settings()
+    scheduler.add_job(
+        func=reload_settings,
+        trigger="interval",
+        seconds=10,
+        max_instances=1,
+        coalesce=True,
+        id="reload_settings",
+        replace_existing=True,
+    )
+
+
 def expire_deployments():
     cluster = scheduler.app.config["K8S_CLUSTER"]
     with scheduler.app.app_context():
@@ -81,19 +162,61 @@ def report_to_tier1_endpoints():
         metrics_string = f"{time.time()},{resources['cpu_ratio']},{resources['mem_ratio']},{resources['net_rx_rate']},{resources['net_tx_rate']},{resources['mem_avail']}, {resources['cpu_avail']},{resources['cpu_used']}, {resources['mem_used']} \n"
         f.write(metrics_string)
 
+    snapshot = {
+        "uuid": str(tier2_uuid),
+        "endpoint": str(tier2_endpoint),
+        "resources": resources,
+    }
     for tier1_url in config["TIER1_URLS"]:
         tier1_endpoint = URL(tier1_url) / "api/v1/cloudlets/"
-        try:
-            requests.post(
-                str(tier1_endpoint),
+        report_heartbeat(str(tier1_endpoint), snapshot)
+
+
+# last report acknowledged by each Tier1 endpoint, as (sequence, resources)
+_heartbeats: dict[str, tuple[int, dict[str, float]]] = {}
+
+
+def report_heartbeat(tier1_endpoint: str, snapshot: dict) -> None:
+    """Report to a Tier1 endpoint. Only the changed resource metrics are sent
+    when the previous report was acknowledged, otherwise a full snapshot
+    which starts a new sequence.
+    """
+    resources = snapshot["resources"]
+    previous = _heartbeats.pop(tier1_endpoint, None)
+
+    try:
+        if previous is not None:
+            sequence, last_resources = previous
+            sequence += 1
+            response = requests.post(
+                tier1_endpoint,
                 json={
-                    "uuid": str(tier2_uuid),
-                    "endpoint": str(tier2_endpoint),
-                    "resources": resources,
+                    "uuid": snapshot["uuid"],
+                    "sequence": sequence,
+                    "changed": {
+                        metric: value
+                        for metric, value in resources.items()
+                        if last_resources.get(metric) != value
+                    },
+                    "removed": [
+                        metric for metric in last_resources if metric not in resources
+                    ],
                 },
             )
-        except RequestException:
-            logging.warn(f"Failed to report to {tier1_endpoint}")
+            # Tier1 restarted, missed a report, or does not support deltas
+            if response.status_code in (400, 409):
+                previous = None
+
+        if previous is None:
+            sequence = 0
+            response = requests.post(tier1_endpoint, json=dict(snapshot, sequence=0))
+
+        response.raise_for_status()
+    except RequestException:
+        logging.warn(f"Failed to report to {tier1_endpoint}")
+        return
+
+    _heartbeats[tier1_endpoint] = (sequence, resources)
 
 
 def start_reporting_job():
@@ -13,26 +13,59 @@ by defining 'sinfonia_tier1_matchers' setuptools entry points.
 
 from __future__ import annotations
 
+import heapq
 import logging
-import random
 import math
-from operator import itemgetter
-from typing import Callable, Iterator, List, Sequence
-
+import random
+from itertools import compress
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Sequence,
+    Union,
+    cast,
+)
+from uuid import UUID
+
+import numpy as np
+from flask import current_app, has_app_context
 from importlib_metadata import EntryPoint, entry_points
 
+from .candidates import Candidates
 from .client_info import ClientInfo
 from .cloudlets import Cloudlet
 from .deployment_recipe import DeploymentRecipe
+from .resource_matrix import (
+    COLUMN,
+    USED,
+    feasible,
+    load_norm,
+    requirements,
+    top_k,
+    weighted_score,
+)
+from .spatial_index import GEODESIC_ERROR
 
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-# Type definition for a Sinfonia Tier1 match function
-Tier1MatchFunction = Callable[
+# Type definitions for a Sinfonia Tier1 match function, the original (legacy)
+# signature receives a list of cloudlets and removes what it has consumed.
+ListMatchFunction = Callable[
     [ClientInfo, DeploymentRecipe, List[Cloudlet]], Iterator[Cloudlet]
 ]
+CandidatesMatchFunction = Callable[
+    [ClientInfo, DeploymentRecipe, Candidates], Iterator[Cloudlet]
+]
+Tier1MatchFunction = Union[ListMatchFunction, CandidatesMatchFunction]
+
+# Scores the resource metrics (rows of ResourceMatrix.take) of cloudlets for
+# the (cpu, mem, disk) requirements of a client.
+ResourceScore = Callable[[np.ndarray, np.ndarray], np.ndarray]
 
 
 def get_match_function_plugins() -> dict[str, EntryPoint]:
@@ -40,246 +73,515 @@ def get_match_function_plugins() -> dict[str, EntryPoint]:
     return {ep.name: ep for ep in entry_points(group="sinfonia.tier1_matchers")}
 
 
+def candidates_matcher(matcher: CandidatesMatchFunction) -> CandidatesMatchFunction:
+    """Decorator for match functions that take a Candidates set instead of a
+    list of cloudlets. Match functions are expected to discard any cloudlets
+    they consume from the candidates.
+    """
+    matcher.uses_candidates = True  # type: ignore[attr-defined]
+    return matcher
+
+
+def resource_matcher(
+    score: ResourceScore | None = None, descending: bool = False
+) -> Callable[[CandidatesMatchFunction], CandidatesMatchFunction]:
+    """Decorator for match functions that rank all remaining candidates by a
+    score of their resources, lowest first unless descending. Without a score
+    the feasible candidates keep their order. Batch placement uses the score
+    to rank the candidates again after every placed request.
+    """
+
+    def decorator(matcher: CandidatesMatchFunction) -> CandidatesMatchFunction:
+        matcher.resource_score = (score, descending)  # type: ignore[attr-defined]
+        return candidates_matcher(matcher)
+
+    return decorator
+
+
+def _adapt_list_matcher(matcher: ListMatchFunction) -> CandidatesMatchFunction:
+    """Run a match function that expects a list of cloudlets, the cloudlets it
+    removed from the list are discarded from the candidates once it is done.
+    """
+
+    def adapted(
+        client_info: ClientInfo,
+        deployment_recipe: DeploymentRecipe,
+        candidates: Candidates,
+    ) -> Iterator[Cloudlet]:
+        cloudlets = list(candidates)
+        try:
+            yield from matcher(client_info, deployment_recipe, cloudlets)
+        finally:
+            remaining = {cloudlet.uuid for cloudlet in cloudlets}
+            for cloudlet in list(candidates):
+                if cloudlet.uuid not in remaining:
+                    candidates.discard(cloudlet)
+
+    return adapted
+
+
 def tier1_best_match(
     match_functions: Sequence[Tier1MatchFunction],
     client_info: ClientInfo,
     deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    cloudlets: Candidates | Iterable[Cloudlet],
+    limit: int | None = None,
 ) -> Iterator[Cloudlet]:
-    """Generator which yields cloudlets based on selected matchers."""
+    """Generator which yields cloudlets based on selected matchers.
+    Any cloudlet is yielded at most once, and at most limit cloudlets are
+    yielded. The limit is passed on to the matchers through Candidates.wanted.
+    """
+    if isinstance(cloudlets, Candidates):
+        candidates = cloudlets
+    else:
+        candidates = Candidates(cloudlets)
+
+    if limit is not None:
+        candidates.limit = limit
+
     for matcher in match_functions:
-        yield from matcher(client_info, deployment_recipe, cloudlets)
+        if candidates.wanted == 0:
+            return
+
+        if getattr(matcher, "uses_candidates", False):
+            match = cast(CandidatesMatchFunction, matcher)
+        else:
+            match = _adapt_list_matcher(cast(ListMatchFunction, matcher))
+
+        for cloudlet in match(client_info, deployment_recipe, candidates):
+            if candidates.mark_yielded(cloudlet):
+                yield cloudlet
+                if candidates.wanted == 0:
+                    return
 
 
 # ------------------ Collection of Match functions follows --------------
 
+
+@candidates_matcher
 def match_by_network(
     client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
     """Yields any cloudlets that claim to be local.
     Also removes cloudlets that explicitly blacklist the client address
     """
-    # Used to jump the loop whenever a cloudlet can be removed from the list
-    class DropCloudlet(Exception):
-        pass
-
-    for cloudlet in cloudlets[:]:
-        try:
-            for network in cloudlet.rejected_clients:
-                if client_info.ipaddress in network:
-                    logger.debug("Cloudlet (%s) would reject client", cloudlet.name)
-                    raise DropCloudlet
-
-            for network in cloudlet.local_networks:
-                if client_info.ipaddress in network:
-                    logger.info("network (%s)", cloudlet.name)
-                    cloudlets.remove(cloudlet)
-                    yield cloudlet
-
-            for network in cloudlet.accepted_clients:
-                if client_info.ipaddress not in network:
-                    logger.debug("Cloudlet (%s) will not accept client", cloudlet.name)
-                    raise DropCloudlet
-
-        except DropCloudlet:
-            cloudlets.remove(cloudlet)
+    networks = candidates.registry.networks.classify(client_info.ipaddress)
+
+    # only visit the cloudlets with networks that matched the client address,
+    # and the ones that only accept clients from some networks
+    for uuid in networks.rejected:
+        cloudlet = candidates.get(uuid)
+        if cloudlet is not None:
+            logger.debug("Cloudlet (%s) would reject client", cloudlet.name)
+            candidates.discard(cloudlet)
+
+    local = [
+        cloudlet
+        for cloudlet in map(candidates.get, networks.local)
+        if cloudlet is not None
+    ]
+    for cloudlet in local:
+        candidates.discard(cloudlet)
+
+    for uuid in networks.refused():
+        cloudlet = candidates.get(uuid)
+        if cloudlet is not None:
+            logger.debug("Cloudlet (%s) will not accept client", cloudlet.name)
+            candidates.discard(cloudlet)
+
+    local.sort(key=lambda cloudlet: candidates.position(cloudlet.uuid))
+    for cloudlet in local:
+        logger.info("network (%s)", cloudlet.name)
+        yield cloudlet
 
 
 def _estimated_rtt(distance_in_km):
-    """Estimated RTT based on distance and speed of light
-    Only used for logging/debugging.
+    """Estimated RTT based on distance and speed of light, used for logging
+    and as the latency objective of match_weighted.
     """
     speed_of_light = 299792.458
     return 2 * (distance_in_km / speed_of_light)
 
 
+@candidates_matcher
 def match_by_location(
     client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
     """Yields any geographically close cloudlets"""
     if client_info.location is None:
         return
 
-    by_distance = []
+    seen: set[UUID] = set()
+    by_distance: list[tuple[float, int, Cloudlet]] = []
+
+    def closest(bound: float = math.inf) -> Iterator[Cloudlet]:
+        while by_distance and by_distance[0][0] <= bound:
+            distance, _, cloudlet = heapq.heappop(by_distance)
+            logger.info(
+                "distance (%s) %d km, %.3f minRTT",
+                cloudlet.name,
+                distance,
+                _estimated_rtt(distance),
+            )
+            candidates.discard(cloudlet)
+            yield cloudlet
+
+    # The spatial index returns cloudlet locations ordered by spherical
+    # distance. We only compute the exact geodesic distance for the cloudlets
+    # we come across and yield them as soon as no unseen cloudlet can be closer.
+    location_index = candidates.registry.locations
+    for spherical_distance, uuid in location_index.nearest(client_info.location):
+        yield from closest(spherical_distance * (1 - GEODESIC_ERROR))
+
+        cloudlet = candidates.get(uuid)
+        if cloudlet is None or uuid in seen:
+            continue
+        seen.add(uuid)
 
-    for cloudlet in cloudlets:
         distance = cloudlet.distance_from(client_info.location)
         if distance is not None:
-            by_distance.append((distance, cloudlet))
-
-    if not by_distance:
-        return
+            position = candidates.position(uuid)
+            heapq.heappush(by_distance, (distance, position, cloudlet))
 
-    by_distance.sort(key=itemgetter(0))
-    for distance, cloudlet in by_distance:
-        logger.info(
-            "distance (%s) %d km, %.3f minRTT",
-            cloudlet.name,
-            distance,
-            _estimated_rtt(distance),
-        )
-        cloudlets.remove(cloudlet)
-        yield cloudlet
+    yield from closest()
 
 
+@candidates_matcher
 def match_random(
     _client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
     """Shuffle anything that is left and return in randomized order"""
-    random.shuffle(cloudlets)
-    for cloudlet in cloudlets[:]:
+    cloudlets = list(candidates)
+    candidates.clear()
+
+    wanted = len(cloudlets) if candidates.wanted is None else candidates.wanted
+    for cloudlet in random.sample(cloudlets, min(wanted, len(cloudlets))):
         logger.info("random (%s)", cloudlet.name)
-        cloudlets.remove(cloudlet)
         yield cloudlet
 
+
+def _rank_by_resources(
+    client_info: ClientInfo,
+    candidates: Candidates,
+    score: ResourceScore | None = None,
+    descending: bool = False,
+    limit: int | None = None,
+) -> list[Cloudlet]:
+    """Returns the best (at most limit, by default candidates.wanted) cloudlets
+    that can satisfy the client's resource requirements ordered by score.
+    Without a score function the original order is kept.
+    All cloudlets are consumed, including the ones that are not feasible.
+    """
+    if limit is None:
+        limit = candidates.wanted
+
+    cloudlets = list(candidates)
+    values = candidates.registry.resources.take(
+        [cloudlet.uuid for cloudlet in cloudlets], _forecast_horizon()
+    )
+    candidates.clear()
+
+    reqs = requirements(client_info.resourceReqs)
+    accepted = np.flatnonzero(feasible(values, reqs))
+
+    if score is not None:
+        scores = score(values[accepted], reqs)
+        accepted = accepted[top_k(scores, limit, descending)]
+    elif limit is not None:
+        accepted = accepted[:limit]
+
+    return [cloudlets[index] for index in accepted]
+
+
+@resource_matcher()
 def match_resources(
     client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
-    
-    
-#    for cloudlet in cloudlets:
-#        print("LOG: Cloudlet info: ", cloudlet.resources) # dictionary
-#        print("LOG: Client info: ", client_info)
-    accepted_cloudlets=[]
-    for cloudlet in cloudlets[:]:
-#        print("LOG: Cloudlet resources: ", cloudlet.resources)
-        if(cloudlet.resources["cpu_avail"] >= client_info.resourceReqs["cpu"] and
-            cloudlet.resources["mem_avail"] >= client_info.resourceReqs["mem"]
-             and cloudlet.resources["disk_avail"] >= client_info.resourceReqs["disk"]):
-                accepted_cloudlets.append(cloudlet)
- #               print("LOG: Accept cloudlet ", cloudlet)
-        cloudlets.remove(cloudlet)
-
-    print("LOG: Accept cloudlet ", accepted_cloudlets[0])
-    yield accepted_cloudlets[0]
+    """Yields the first cloudlet that has sufficient resources available"""
+    for cloudlet in _rank_by_resources(client_info, candidates, limit=1):
+        logger.info("resources (%s)", cloudlet.name)
+        yield cloudlet
+
 
+def _cpu_used(values: np.ndarray, _reqs: np.ndarray) -> np.ndarray:
+    return values[:, COLUMN["cpu_used"]]
+
+
+@resource_matcher(_cpu_used, descending=True)
 def match_best_cpu(
     client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
-    
-    cpu_load=[]
-    accepted_cloudlets=[]
-    for cloudlet in cloudlets[:]:
-#        print("LOG: Cloudlet resources: ", cloudlet.resources)
-        if(cloudlet.resources["cpu_avail"] >= client_info.resourceReqs["cpu"] and
-            cloudlet.resources["mem_avail"] >= client_info.resourceReqs["mem"]
-             and cloudlet.resources["disk_avail"] >= client_info.resourceReqs["disk"]):
-                cpu_load.append(cloudlet.resources["cpu_used"])
-                accepted_cloudlets.append(cloudlet)
- #               print("LOG: Accept cloudlet ", cloudlet)
-        cloudlets.remove(cloudlet)
-
-    sorted_cloudlets=[x for _, x in sorted(zip(cpu_load, accepted_cloudlets), key=lambda pair: pair[0], reverse=True)]
-    for cloudlet in sorted_cloudlets:
+    """Best fit match function, yields the cloudlets with the most cpu used first"""
+    for cloudlet in _rank_by_resources(
+        client_info, candidates, _cpu_used, descending=True
+    ):
+        logger.info("best_cpu (%s)", cloudlet.name)
         yield cloudlet
-    print("LOG: Accept cloudlet ", sorted_cloudlets[0])
-    yield sorted_cloudlets[0]
 
+
+def _cpu_mem_used(values: np.ndarray, _reqs: np.ndarray) -> np.ndarray:
+    return load_norm(values, USED)
+
+
+@resource_matcher(_cpu_mem_used, descending=True)
 def match_best_cpu_mem(
     client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
-    
-    cpu_mem_load=[]
-    accepted_cloudlets=[]
-    for cloudlet in cloudlets[:]:
-#        print("LOG: Cloudlet resources: ", cloudlet.resources)
-        if(cloudlet.resources["cpu_avail"] >= client_info.resourceReqs["cpu"] and
-            cloudlet.resources["mem_avail"] >= client_info.resourceReqs["mem"]
-             and cloudlet.resources["disk_avail"] >= client_info.resourceReqs["disk"]):
-                norm=math.sqrt(pow(cloudlet.resources["cpu_used"],2) + pow(cloudlet.resources["mem_used"],2))
-                cpu_mem_load.append(norm)
-                accepted_cloudlets.append(cloudlet)
- #               print("LOG: Accept cloudlet ", cloudlet)
-        cloudlets.remove(cloudlet)
-
-    sorted_cloudlets=[x for _, x in sorted(zip(cpu_mem_load, accepted_cloudlets), key=lambda pair: pair[0], reverse=True)]
-    for cloudlet in sorted_cloudlets:
+    """Best fit match function based on L2 norm of (cpu, mem) used"""
+    for cloudlet in _rank_by_resources(
+        client_info, candidates, _cpu_mem_used, descending=True
+    ):
+        logger.info("best_cpu_mem (%s)", cloudlet.name)
         yield cloudlet
-    print("LOG: Accept cloudlet ", sorted_cloudlets[0])
-    yield sorted_cloudlets[0]
 
+
+def _cpu_mem_increment(values: np.ndarray, reqs: np.ndarray) -> np.ndarray:
+    return load_norm(values, USED, reqs[:2])
+
+
+@resource_matcher(_cpu_mem_increment)
 def match_balance_cpu_mem(
     client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
     """Balanced match function based on L2 norm of (cpu, mem) increment"""
-    norms=[]
-    cloudlets_accepted=[]
-    for cloudlet in cloudlets[:]:
-        if(cloudlet.resources["cpu_avail"] >= client_info.resourceReqs["cpu"] and
-            cloudlet.resources["mem_avail"] >= client_info.resourceReqs["mem"]
-                and cloudlet.resources["disk_avail"] >= client_info.resourceReqs["disk"]):
-                    cpu_increment=cloudlet.resources["cpu_used"] + client_info.resourceReqs["cpu"]
-                    mem_increment=cloudlet.resources["mem_used"] + client_info.resourceReqs["mem"]
-                    norm=math.sqrt(pow(cpu_increment,2) + pow(mem_increment,2))
-                    norms.append(norm)
-                    cloudlets_accepted.append(cloudlet)
-        cloudlets.remove(cloudlet)
-
-    # sort cloudlets based on L2 norm
-    sorted_cloudlets=[x for _, x in sorted(zip(norms, cloudlets_accepted), key=lambda pair: pair[0])]
-    for cloudlet in sorted_cloudlets:
+    for cloudlet in _rank_by_resources(client_info, candidates, _cpu_mem_increment):
+        logger.info("balance_cpu_mem (%s)", cloudlet.name)
         yield cloudlet
-        print("LOG: Accept cloudlet ", cloudlet)
 
+
+def _cpu_increment(values: np.ndarray, reqs: np.ndarray) -> np.ndarray:
+    return load_norm(values, USED[:1], reqs[:1])
+
+
+@resource_matcher(_cpu_increment)
 def match_balance_cpu(
     client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
     """Balanced match function based on L2 norm of (cpu) increment"""
-    norms=[]
-    cloudlets_accepted=[]
-    for cloudlet in cloudlets[:]:
-        if(cloudlet.resources["cpu_avail"] >= client_info.resourceReqs["cpu"] and
-            cloudlet.resources["mem_avail"] >= client_info.resourceReqs["mem"]
-                and cloudlet.resources["disk_avail"] >= client_info.resourceReqs["disk"]):
-                    cpu_increment=cloudlet.resources["cpu_used"] + client_info.resourceReqs["cpu"]
-                    norm=math.sqrt(pow(cpu_increment,2))
-                    norms.append(norm)
-                    cloudlets_accepted.append(cloudlet)
-        cloudlets.remove(cloudlet)
-    
-    # sort cloudlets based on L2 norm
-    sorted_cloudlets=[x for _, x in sorted(zip(norms, cloudlets_accepted), key=lambda pair: pair[0])]
-    sorted_cloudlets=[sorted_cloudlets[0]]
-    print("CLOUDLETS: ", sorted_cloudlets, "\n")
-	
-    for cloudlet in sorted_cloudlets:
+    for cloudlet in _rank_by_resources(
+        client_info, candidates, _cpu_increment, limit=1
+    ):
+        logger.info("balance_cpu (%s)", cloudlet.name)
         yield cloudlet
 
+
+def _mem_increment(values: np.ndarray, reqs: np.ndarray) -> np.ndarray:
+    return load_norm(values, USED[1:], reqs[1:2])
+
+
+@resource_matcher(_mem_increment)
 def match_balance_mem(
     client_info: ClientInfo,
     _deployment_recipe: DeploymentRecipe,
-    cloudlets: list[Cloudlet],
+    candidates: Candidates,
 ) -> Iterator[Cloudlet]:
     """Balanced match function based on L2 norm of (mem) increment"""
-    norms=[]
-    cloudlets_accepted=[]
-    for cloudlet in cloudlets[:]:
-        if(cloudlet.resources["cpu_avail"] >= client_info.resourceReqs["cpu"] and
-            cloudlet.resources["mem_avail"] >= client_info.resourceReqs["mem"]
-                and cloudlet.resources["disk_avail"] >= client_info.resourceReqs["disk"]):
-                    mem_increment=cloudlet.resources["mem_used"] + client_info.resourceReqs["mem"]
-                    norm=math.sqrt(pow(mem_increment,2))
-                    norms.append(norm)
-                    cloudlets_accepted.append(cloudlet)
-        cloudlets.remove(cloudlet)
-
-    # sort cloudlets based on L2 norm
-    sorted_cloudlets=[x for _, x in sorted(zip(norms, cloudlets_accepted), key=lambda pair: pair[0])]
-    for cloudlet in sorted_cloudlets:
+    for cloudlet in _rank_by_resources(client_info, candidates, _mem_increment):
+        logger.info("balance_mem (%s)", cloudlet.name)
         yield cloudlet
+
+
+# Objectives of the weighted match function, and the default weights which
+# can be overridden with the (hot-reloadable) MATCHER_WEIGHTS setting.
+WEIGHTED_OBJECTIVES = ("rtt", "cpu", "mem", "gpu", "disk", "net")
+DEFAULT_MATCHER_WEIGHTS = {
+    "rtt": 1.0,
+    "cpu": 1.0,
+    "mem": 1.0,
+    "gpu": 0.0,
+    "disk": 0.5,
+    "net": 0.5,
+}
+
+
+def _forecast_horizon() -> float:
+    """Seconds ahead to forecast cloudlet load, from the current Tier1 config"""
+    if has_app_context():
+        return float(current_app.config.get("FORECAST_HORIZON", 0.0))
+    return 0.0
+
+
+def _matcher_weights() -> np.ndarray:
+    """Weights for the WEIGHTED_OBJECTIVES from the current Tier1 config"""
+    weights = DEFAULT_MATCHER_WEIGHTS
+    if has_app_context():
+        weights = current_app.config.get("MATCHER_WEIGHTS") or weights
+
+    # the settings are reloaded while running, a bad value must not fail deploys
+    if not isinstance(weights, Mapping):
+        logger.warning("Ignoring matcher weights %r, expected a mapping", weights)
+        weights = DEFAULT_MATCHER_WEIGHTS
+
+    unknown = set(weights).difference(WEIGHTED_OBJECTIVES)
+    if unknown:
+        logger.warning("Ignoring unknown matcher weights %s", sorted(unknown))
+
+    values = []
+    for name in WEIGHTED_OBJECTIVES:
+        try:
+            value = float(weights.get(name, 0.0))
+        except (TypeError, ValueError):
+            value = math.nan
+        if not math.isfinite(value):
+            logger.warning("Ignoring matcher weight %s = %r", name, weights[name])
+            value = 0.0
+        values.append(value)
+    return np.array(values)
+
+
+def _utilization(values: np.ndarray, used: str, available: str) -> np.ndarray:
+    used_values = values[:, COLUMN[used]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return used_values / (used_values + values[:, COLUMN[available]])
+
+
+@candidates_matcher
+def match_weighted(
+    client_info: ClientInfo,
+    _deployment_recipe: DeploymentRecipe,
+    candidates: Candidates,
+) -> Iterator[Cloudlet]:
+    """Yields the cloudlets that can satisfy the client's resource requirements
+    ordered by a weighted sum of the estimated RTT, cpu, memory and gpu
+    utilization, available disk space, and network traffic. Every objective is
+    normalized over the candidates, the weights are read from MATCHER_WEIGHTS.
+    """
+    weights = _matcher_weights()
+    registry = candidates.registry
+
+    cloudlets = list(candidates)
+    values = registry.resources.take(
+        [cloudlet.uuid for cloudlet in cloudlets], _forecast_horizon()
+    )
+    candidates.clear()
+
+    reqs = requirements(client_info.resourceReqs)
+    accepted = np.flatnonzero(feasible(values, reqs))
+    values = values[accepted]
+
+    if client_info.location is not None and weights[0]:
+        uuids = [cloudlets[index].uuid for index in accepted]
+        distances = registry.locations.distances(client_info.location, uuids)
+    else:
+        distances = np.full(len(accepted), np.nan)
+
+    objectives = np.column_stack(
+        (
+            _estimated_rtt(distances),
+            _utilization(values, "cpu_used", "cpu_avail"),
+            _utilization(values, "mem_used", "mem_avail"),
+            values[:, COLUMN["gpu_ratio"]],
+            -values[:, COLUMN["disk_avail"]],
+            values[:, COLUMN["net_rx_rate"]] + values[:, COLUMN["net_tx_rate"]],
+        )
+    )
+    scores = weighted_score(objectives, weights)
+    for index in top_k(scores, candidates.wanted):
+        cloudlet = cloudlets[accepted[index]]
+        logger.info("weighted (%s) %.3f", cloudlet.name, scores[index])
+        yield cloudlet
+
+
+# Default number of randomly sampled cloudlets compared by power_of_choices,
+# and the radius around the client of the location restricted variant.
+POWER_OF_CHOICES = 2
+NEARBY_DISTANCE = 500.0  # km
+
+
+def _nearby(client_info: ClientInfo, candidates: Candidates) -> list[Cloudlet]:
+    """Candidates with a location within NEARBY_DISTANCE of the client"""
+    if client_info.location is None:
+        return []
+
+    nearby: dict[UUID, Cloudlet] = {}
+    location_index = candidates.registry.locations
+    for distance, uuid in location_index.nearest(client_info.location):
+        if distance > NEARBY_DISTANCE:
+            break
+        cloudlet = candidates.get(uuid)
+        if cloudlet is not None:
+            nearby[uuid] = cloudlet
+    return list(nearby.values())
+
+
+def _local(client_info: ClientInfo, candidates: Candidates) -> list[Cloudlet]:
+    """Candidates that claim the client is on one of their local networks"""
+    networks = candidates.registry.networks.classify(client_info.ipaddress)
+    local = (candidates.get(uuid) for uuid in networks.local)
+    return [cloudlet for cloudlet in local if cloudlet is not None]
+
+
+def power_of_choices(d: int = POWER_OF_CHOICES, scope: str | None = None):
+    """Create a match function that compares d randomly sampled cloudlets and
+    yields the one with the lowest L2 norm of (cpu, mem) used after adding the
+    client's requirements. This is repeated for as many cloudlets as are
+    wanted. Sampled cloudlets without sufficient resources are discarded.
+
+    Unlike the other resource matchers the cost per result does not depend on
+    the number of candidates. The candidates can be restricted to the ones on
+    a local network of the client (scope="network"), or within NEARBY_DISTANCE
+    of the client (scope="location").
+    """
+    scopes: dict[str | None, Callable[[ClientInfo, Candidates], list[Cloudlet]]]
+    scopes = {None: lambda _client_info, candidates: list(candidates)}
+    scopes.update(network=_local, location=_nearby)
+    if scope not in scopes:
+        raise ValueError(f"Unknown power_of_choices scope {scope}")
+    select = scopes[scope]
+    name = f"power_of_{d}" if scope is None else f"power_of_{d}_{scope}"
+
+    @candidates_matcher
+    def match_power_of_choices(
+        client_info: ClientInfo,
+        _deployment_recipe: DeploymentRecipe,
+        candidates: Candidates,
+    ) -> Iterator[Cloudlet]:
+        if scope is None:
+            pool = candidates
+        else:
+            pool = Candidates(select(client_info, candidates), candidates.registry)
+
+        reqs = requirements(client_info.resourceReqs)
+        resources = candidates.registry.resources
+        while len(pool) and candidates.wanted != 0:
+            sampled = pool.sample(d)
+            values = resources.take(
+                [cloudlet.uuid for cloudlet in sampled], _forecast_horizon()
+            )
+            accepted = feasible(values, reqs)
+
+            for cloudlet in compress(sampled, ~accepted):
+                pool.discard(cloudlet)
+                candidates.discard(cloudlet)
+
+            if accepted.any():
+                scores = load_norm(values[accepted], USED, reqs[:2])
+                best = list(compress(sampled, accepted))[top_k(scores, 1)[0]]
+                pool.discard(best)
+                candidates.discard(best)
+                logger.info("%s (%s)", name, best.name)
+                yield best
+
+    match_power_of_choices.__name__ = f"match_{name}"
+    return match_power_of_choices
+
+
+match_power_of_two = power_of_choices()
+match_power_of_two_network = power_of_choices(scope="network")
+match_power_of_two_location = power_of_choices(scope="location")
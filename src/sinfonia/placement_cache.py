@@ -0,0 +1,167 @@
+#
+# Sinfonia
+#
+# Cache of recent Tier1 placement decisions
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Reuse the result of the match functions for similar deployment requests
+
+Clients on the same network that ask for the same recipe with similar
+resource requirements mostly get the same cloudlets from the match functions.
+The cloudlets selected for the first such request are cached and returned for
+the following requests without running the match functions again.
+
+Placements are keyed by the registry version, which changes with every
+heartbeat and resource reservation. The match functions would rank the
+cloudlets differently once their load changed, so a cached placement is only
+reused for requests that arrive before that, i.e. a burst of requests from
+the same network. Because clients share placements when their requirements
+round to the same values, a cached placement is still checked against the
+acls and resources for the specific client.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from ipaddress import ip_network
+from threading import Lock
+from typing import Hashable, Iterable, Sequence
+from uuid import UUID
+
+import numpy as np
+
+from .client_info import ClientInfo
+from .cloudlets import Cloudlet
+from .registry import CloudletRegistry
+from .resource_matrix import AVAILABLE, requirements
+
+# clients within the same network prefix share placements
+CLIENT_PREFIXLEN = {4: 24, 6: 48}
+
+# resource requirements are rounded up to 4 significant bits, so requests
+# that differ by less than 6.25-12.5% share placements
+REQUIREMENT_BITS = 4
+
+# locations are rounded to 0.1 degree, about 11km
+LOCATION_DIGITS = 1
+
+
+def quantize(values: np.ndarray, bits: int = REQUIREMENT_BITS) -> tuple[float, ...]:
+    """Round positive values up to the given number of significant bits"""
+    mantissa, exponent = np.frexp(values)
+    mantissa = np.ceil(mantissa * 2**bits) / 2**bits  # 0.5 <= mantissa < 1
+    return tuple(np.ldexp(mantissa, exponent).tolist())
+
+
+class PlacementCache:
+    """LRU cache of the cloudlets selected for recent deployment requests"""
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._placements: OrderedDict[Hashable, tuple[UUID, ...]] = OrderedDict()
+        self._version: tuple[int, int] | None = None
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._placements)
+
+    def key(
+        self,
+        client_info: ClientInfo,
+        recipe_uuid: UUID,
+        registry: CloudletRegistry,
+        limit: int | None = None,
+    ) -> Hashable:
+        address = client_info.ipaddress
+        prefixlen = CLIENT_PREFIXLEN[address.version]
+        network = ip_network(f"{address}/{prefixlen}", strict=False)
+
+        location = client_info.location
+        coordinate = (
+            None
+            if location is None
+            else tuple(round(value, LOCATION_DIGITS) for value in location.coordinate)
+        )
+        reqs = quantize(requirements(client_info.resourceReqs))
+        return (network, coordinate, recipe_uuid, reqs, limit, registry.version)
+
+    def get(
+        self, key: Hashable, client_info: ClientInfo, registry: CloudletRegistry
+    ) -> list[Cloudlet] | None:
+        """Cloudlets cached for a placement, None when there is no cached
+        placement or when it is not valid for this specific client.
+        """
+        if self.maxsize <= 0:
+            return None
+
+        with self._lock:
+            uuids = self._placements.get(key)
+            if uuids is not None:
+                self._placements.move_to_end(key)
+
+        cloudlets = (
+            None if uuids is None else self._validate(uuids, client_info, registry)
+        )
+        with self._lock:
+            if cloudlets is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cloudlets
+
+    def put(self, key: Hashable, cloudlets: Iterable[Cloudlet]) -> None:
+        if self.maxsize <= 0:
+            return
+
+        uuids = tuple(cloudlet.uuid for cloudlet in cloudlets)
+        version = key[-1]  # type: ignore[index]
+        with self._lock:
+            if version != self._version:
+                # placements for older registry versions are never used again,
+                # don't store them and drop them once the registry changed
+                if self._version is not None and version < self._version:
+                    return
+                self._placements.clear()
+                self._version = version
+
+            self._placements[key] = uuids
+            self._placements.move_to_end(key)
+            while len(self._placements) > self.maxsize:
+                self._placements.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._placements.clear()
+
+    @staticmethod
+    def _validate(
+        uuids: Sequence[UUID], client_info: ClientInfo, registry: CloudletRegistry
+    ) -> list[Cloudlet] | None:
+        """A network prefix may cross the boundaries of the networks that a
+        cloudlet accepts or rejects, so check the acls for this client. Also
+        check that the cloudlets have the resources this client requested
+        available, unreported resources are not held against a cloudlet.
+        """
+        networks = registry.networks.classify(client_info.ipaddress)
+        cloudlets = []
+        for uuid in uuids:
+            cloudlet = registry.get(uuid)
+            if (
+                cloudlet is None
+                or uuid in networks.rejected
+                or not networks.accepts(uuid)
+            ):
+                return None
+            cloudlets.append(cloudlet)
+
+        reqs = requirements(client_info.resourceReqs)
+        if cloudlets and reqs.any():
+            values = registry.resources.take(uuids)
+            if np.any(values[:, AVAILABLE] < reqs):
+                return None
+        return cloudlets
@@ -0,0 +1,194 @@
+#
+# Sinfonia
+#
+# Longest prefix match index of cloudlet networks
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Binary prefix tries over the networks listed by cloudlets
+
+Instead of testing a client address against every local, accepted and
+rejected network of every cloudlet, the networks are inserted in a binary
+trie keyed by their prefix bits. Walking the trie along the bits of the client
+address finds all networks that contain the address in O(prefix length).
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
+from threading import Lock
+from typing import Any, Iterable, Iterator, Tuple, Union
+from uuid import UUID
+
+from attrs import define, field
+
+from .cloudlets import NetworkList
+
+IPAddress = Union[IPv4Address, IPv6Address]
+IPNetwork = Union[IPv4Network, IPv6Network]
+
+
+def _new_node() -> list[Any]:
+    """[child for a 0 bit, child for a 1 bit, keys of the networks ending here]"""
+    return [None, None, Counter()]
+
+
+class PrefixTrie:
+    """Binary trie of IPv4 and IPv6 networks, each network is associated with
+    one or more keys (cloudlet uuids). IPv4 and IPv6 networks are kept apart
+    because an IPv4 network never contains an IPv6 address and vice versa.
+    """
+
+    def __init__(self) -> None:
+        self._roots = {4: _new_node(), 6: _new_node()}
+
+    def insert(self, network: IPNetwork, key: UUID) -> None:
+        node = self._roots[network.version]
+        for bit in self._bits(network):
+            if node[bit] is None:
+                node[bit] = _new_node()
+            node = node[bit]
+        node[2][key] += 1
+
+    def remove(self, network: IPNetwork, key: UUID) -> None:
+        node = self._roots[network.version]
+        path = []
+        for bit in self._bits(network):
+            path.append((node, bit))
+            node = node[bit]
+            if node is None:
+                return
+
+        keys = node[2]
+        keys[key] -= 1
+        if keys[key] <= 0:
+            del keys[key]
+
+        # prune nodes that no longer lead to any network
+        for parent, bit in reversed(path):
+            child = parent[bit]
+            if child[0] is not None or child[1] is not None or child[2]:
+                break
+            parent[bit] = None
+
+    def lookup(self, address: IPAddress) -> Counter[UUID]:
+        """Returns the keys of all networks that contain address, counting
+        how many of the networks associated with each key matched.
+        """
+        matched: Counter[UUID] = Counter()
+        node = self._roots[address.version]
+        value = int(address)
+        shift: int = address.max_prefixlen
+        while node is not None:
+            matched.update(node[2])
+            if shift == 0:
+                break
+            shift -= 1
+            node = node[(value >> shift) & 1]
+        return matched
+
+    @staticmethod
+    def _bits(network: IPNetwork) -> Iterable[int]:
+        value = int(network.network_address)
+        shift: int = network.max_prefixlen
+        for _ in range(network.prefixlen):
+            shift -= 1
+            yield (value >> shift) & 1
+
+
+@define
+class ClientNetworks:
+    """Cloudlets whose network lists contain a client address"""
+
+    rejected: Counter[UUID]
+    local: Counter[UUID]
+    accepted: Counter[UUID]
+    restricted: dict[UUID, int] = field(repr=False)
+
+    def accepts(self, uuid: UUID) -> bool:
+        """Does the cloudlet accept the client.
+        A client has to be part of all accepted_clients networks of a cloudlet.
+        """
+        return self.accepted[uuid] >= self.restricted.get(uuid, 0)
+
+    def refused(self) -> Iterator[UUID]:
+        """Cloudlets that do not accept the client"""
+        # restricted is shared with the index, copy it before iterating
+        for uuid, count in list(self.restricted.items()):
+            if self.accepted[uuid] < count:
+                yield uuid
+
+
+CloudletNetworks = Tuple[Tuple[IPNetwork, ...], ...]
+
+
+class NetworkIndex:
+    """Prefix tries over the local_networks, accepted_clients and
+    rejected_clients of all known cloudlets.
+    """
+
+    def __init__(self) -> None:
+        self._networks: dict[UUID, CloudletNetworks] = {}
+        self._local = PrefixTrie()
+        self._accepted = PrefixTrie()
+        self._rejected = PrefixTrie()
+        # number of accepted_clients networks for cloudlets that have any
+        self._restricted: dict[UUID, int] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._networks)
+
+    def update(
+        self,
+        uuid: UUID,
+        local_networks: NetworkList,
+        accepted_clients: NetworkList,
+        rejected_clients: NetworkList,
+    ) -> None:
+        networks = (
+            tuple(local_networks),
+            tuple(accepted_clients),
+            tuple(rejected_clients),
+        )
+        with self._lock:
+            if self._networks.get(uuid) == networks:
+                return
+            self._remove(uuid)
+            self._networks[uuid] = networks
+
+            for trie, networklist in zip(self._tries, networks):
+                for network in networklist:
+                    trie.insert(network, uuid)
+            if accepted_clients:
+                self._restricted[uuid] = len(accepted_clients)
+
+    def remove(self, uuid: UUID) -> None:
+        with self._lock:
+            self._remove(uuid)
+
+    def _remove(self, uuid: UUID) -> None:
+        networks = self._networks.pop(uuid, None)
+        if networks is None:
+            return
+
+        for trie, networklist in zip(self._tries, networks):
+            for network in networklist:
+                trie.remove(network, uuid)
+        self._restricted.pop(uuid, None)
+
+    @property
+    def _tries(self) -> tuple[PrefixTrie, PrefixTrie, PrefixTrie]:
+        return self._local, self._accepted, self._rejected
+
+    def classify(self, address: IPAddress) -> ClientNetworks:
+        with self._lock:
+            return ClientNetworks(
+                rejected=self._rejected.lookup(address),
+                local=self._local.lookup(address),
+                accepted=self._accepted.lookup(address),
+                restricted=self._restricted,
+            )
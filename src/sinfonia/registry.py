@@ -0,0 +1,291 @@
+#
+# Sinfonia
+#
+# Registry of Tier2 cloudlets known to Tier1
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+
+from __future__ import annotations
+
+import heapq
+from threading import Lock
+from types import MappingProxyType
+from typing import (
+    ItemsView,
+    Iterable,
+    Iterator,
+    KeysView,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+    ValuesView,
+)
+from uuid import UUID
+
+import attrs
+import pendulum
+
+from .cloudlets import Cloudlet
+from .prefix_trie import NetworkIndex
+from .resource_matrix import ResourceMatrix, Resources
+from .sessions import SessionPool
+from .spatial_index import SpatialIndex
+
+# arguments of CloudletRegistry.report, updates applied with report_many
+ResourceReport = Tuple[UUID, Mapping[str, float], pendulum.DateTime, Optional[int]]
+
+
+@attrs.frozen
+class RegistrySnapshot:
+    """Immutable view of the cloudlets in a registry.
+
+    Deploy requests work from a snapshot, so they see a consistent set of
+    cloudlets while reports are handled. The snapshot only changes when
+    cloudlets are added, replaced or removed, reports update the resources of
+    the known cloudlets in place.
+    """
+
+    version: int
+    cloudlets: tuple[Cloudlet, ...]
+    uuids: tuple[UUID, ...]
+    # uuid to cloudlet and uuid to position in cloudlets
+    by_uuid: Mapping[UUID, Cloudlet]
+    positions: Mapping[UUID, int]
+
+    @classmethod
+    def from_cloudlets(
+        cls, version: int, cloudlets: Iterable[Cloudlet]
+    ) -> RegistrySnapshot:
+        cloudlets = tuple(cloudlets)
+        uuids = tuple(cloudlet.uuid for cloudlet in cloudlets)
+        return cls(
+            version,
+            cloudlets,
+            uuids,
+            MappingProxyType(dict(zip(uuids, cloudlets))),
+            MappingProxyType({uuid: index for index, uuid in enumerate(uuids)}),
+        )
+
+    def __len__(self) -> int:
+        return len(self.cloudlets)
+
+
+class CloudletRegistry(MutableMapping[UUID, Cloudlet]):
+    """Mapping of cloudlet uuid to Cloudlet.
+
+    Behaves like the plain dictionary it replaces, but also keeps the derived
+    indexes that are used by the match functions up to date whenever a
+    cloudlet is added, updated or removed.
+
+    Cloudlets that report are also pushed on a min-heap ordered by the time of
+    their last update, so that stale cloudlets can be found without scanning
+    the whole registry. Entries are not removed from the heap when a cloudlet
+    reports again, outdated entries are skipped when they are popped.
+
+    Readers that need a consistent set of cloudlets take a snapshot(), which
+    is rebuilt on first use after cloudlets were added, replaced or removed.
+    """
+
+    def __init__(self, cloudlets: Iterable[Cloudlet] = ()) -> None:
+        self._cloudlets: dict[UUID, Cloudlet] = {}
+        self._version = 0
+        # incremented when cloudlets are added, replaced or removed
+        self._membership = 0
+        self._snapshot = RegistrySnapshot.from_cloudlets(0, ())
+        self._expiry: list[tuple[float, UUID]] = []
+        self._expiry_lock = Lock()
+        self.resources = ResourceMatrix()
+        self.locations = SpatialIndex()
+        self.networks = NetworkIndex()
+        self.sessions = SessionPool()
+
+        for cloudlet in cloudlets:
+            self[cloudlet.uuid] = cloudlet
+
+    def __getitem__(self, uuid: UUID) -> Cloudlet:
+        return self._cloudlets[uuid]
+
+    @property
+    def version(self) -> tuple[int, int]:
+        """Changes whenever a cloudlet or a resource reservation changed"""
+        return self._version, self.resources.version
+
+    @property
+    def membership(self) -> int:
+        """Changes whenever a cloudlet was added, replaced or removed"""
+        return self._membership
+
+    def snapshot(self) -> RegistrySnapshot:
+        """Current cloudlets, shared by all readers until they change"""
+        snapshot = self._snapshot
+        membership = self._membership
+        if snapshot.version != membership:
+            # copying a dict view does not race with concurrent updates, a
+            # snapshot that is already outdated is replaced on the next call
+            snapshot = RegistrySnapshot.from_cloudlets(
+                membership, list(self._cloudlets.values())
+            )
+            self._snapshot = snapshot
+        return snapshot
+
+    def __setitem__(self, uuid: UUID, cloudlet: Cloudlet) -> None:
+        self._cloudlets[uuid] = cloudlet
+        self.resources.update(uuid, cloudlet.resources)
+        self.locations.update(uuid, cloudlet.locations)
+        self.networks.update(
+            uuid,
+            cloudlet.local_networks,
+            cloudlet.accepted_clients,
+            cloudlet.rejected_clients,
+        )
+        # bumped after the indexes are updated, so that a placement computed
+        # while the update was in progress is never cached as current
+        self._version += 1
+        self._membership += 1
+        self._schedule_expiry(uuid, cloudlet)
+
+    def report(
+        self,
+        uuid: UUID,
+        resources: Mapping[str, float],
+        last_update: pendulum.DateTime,
+        sequence: int | None = None,
+    ) -> None:
+        """Update the resources of a known cloudlet in place, the other
+        indexes remain valid.
+        """
+        cloudlet = self._cloudlets[uuid]
+        cloudlet.resources = resources = Resources(resources)
+        cloudlet.last_update = last_update
+        cloudlet.sequence = sequence
+        self.resources.update(uuid, resources)
+        self._version += 1
+        self._schedule_expiry(uuid, cloudlet)
+
+    def report_many(self, reports: Iterable[ResourceReport]) -> None:
+        """Update the resources of many known cloudlets, takes the arguments
+        of report for each of them. Cloudlets that were removed in the
+        meantime are skipped.
+        """
+        for uuid, resources, last_update, sequence in reports:
+            if uuid in self._cloudlets:
+                self.report(uuid, resources, last_update, sequence)
+
+    def resolve_delta(
+        self,
+        uuid: UUID,
+        sequence: int,
+        changed: dict[str, float],
+        removed: Iterable[str],
+    ) -> dict[str, float] | None:
+        """Resources of a known cloudlet after applying the resource metrics
+        that changed since its previous report. Returns None when the cloudlet
+        is unknown or a report was missed, the cloudlet has to send a full
+        report instead. A retransmitted report leaves the resources unchanged.
+        """
+        cloudlet = self._cloudlets.get(uuid)
+        if cloudlet is None or cloudlet.sequence is None:
+            return None
+        if sequence == cloudlet.sequence:  # retransmitted
+            return dict(cloudlet.resources)
+        if sequence != cloudlet.sequence + 1:
+            return None
+
+        # replace rather than modify the resources, matchers may be reading them
+        removed = set(removed)
+        resources = {
+            metric: value
+            for metric, value in cloudlet.resources.items()
+            if metric not in removed
+        }
+        resources.update(changed)
+        return resources
+
+    def apply_delta(
+        self,
+        uuid: UUID,
+        sequence: int,
+        changed: dict[str, float],
+        removed: Iterable[str],
+        last_update: pendulum.DateTime,
+    ) -> bool:
+        """Apply the resource metrics that changed since the previous report
+        of a known cloudlet. Returns False when the cloudlet is unknown or a
+        report was missed, the cloudlet has to send a full report instead.
+        """
+        resources = self.resolve_delta(uuid, sequence, changed, removed)
+        if resources is None:
+            return False
+        if sequence != self._cloudlets[uuid].sequence:  # not retransmitted
+            self.report(uuid, resources, last_update, sequence)
+        return True
+
+    def _schedule_expiry(self, uuid: UUID, cloudlet: Cloudlet) -> None:
+        if cloudlet.last_update is not None:
+            with self._expiry_lock:
+                heapq.heappush(self._expiry, (cloudlet.last_update.timestamp(), uuid))
+
+    def __delitem__(self, uuid: UUID) -> None:
+        del self._cloudlets[uuid]
+        self.resources.remove(uuid)
+        self.locations.remove(uuid)
+        self.networks.remove(uuid)
+        self.sessions.remove(uuid)
+        self._version += 1
+        self._membership += 1
+
+    def sync(self, wait: bool = False) -> None:
+        """Pick up changes made by other Tier1 workers, see SharedCloudletRegistry"""
+
+    def holds_expiry_lease(self) -> bool:
+        """Whether this worker expires cloudlets, see SharedCloudletRegistry"""
+        return True
+
+    def expire(self, before: float) -> list[Cloudlet]:
+        """Remove cloudlets that did not report since the given (POSIX) time,
+        returns the removed cloudlets.
+        """
+        expired = []
+        with self._expiry_lock:
+            while self._expiry and self._expiry[0][0] < before:
+                _, uuid = heapq.heappop(self._expiry)
+
+                cloudlet = self._cloudlets.get(uuid)
+                if (
+                    cloudlet is not None
+                    and cloudlet.last_update is not None
+                    and cloudlet.last_update.timestamp() < before
+                ):
+                    del self[uuid]
+                    expired.append(cloudlet)
+
+            # drop outdated entries when most of the heap consists of them
+            if len(self._expiry) > 2 * len(self._cloudlets) + 64:
+                self._expiry = [
+                    (cloudlet.last_update.timestamp(), uuid)
+                    for uuid, cloudlet in list(self._cloudlets.items())
+                    if cloudlet.last_update is not None
+                ]
+                heapq.heapify(self._expiry)
+        return expired
+
+    def __iter__(self) -> Iterator[UUID]:
+        return iter(self._cloudlets)
+
+    def __len__(self) -> int:
+        return len(self._cloudlets)
+
+    # return the views of the underlying dictionary, these can be copied with
+    # list() without racing concurrent updates from the reporting cloudlets
+    def keys(self) -> KeysView[UUID]:
+        return self._cloudlets.keys()
+
+    def values(self) -> ValuesView[Cloudlet]:
+        return self._cloudlets.values()
+
+    def items(self) -> ItemsView[UUID, Cloudlet]:
+        return self._cloudlets.items()
@@ -0,0 +1,449 @@
+#
+# Sinfonia
+#
+# Columnar view of the resource metrics reported by Tier2 cloudlets
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Resource matrix used by the Tier1 match functions
+
+Every Tier2 cloudlet periodically reports a dictionary of resource metrics.
+Instead of looking up these dictionaries one cloudlet at a time on every
+deployment request, the metrics are copied into a matrix with one row per
+cloudlet and one column per metric when the report arrives. Feasibility
+tests and load scores are then computed for all candidates in a single
+vectorized pass.
+
+Tier2 only reports every few seconds, so the matrix also keeps a ledger of
+the resources requested by deployments that Tier1 placed since. These are
+subtracted from the reported capacity until a later report should reflect
+them, otherwise a burst of requests would all land on the same cloudlet.
+
+Finally the last few reported values of the used cpu and memory are kept in
+a ring buffer for every cloudlet. An exponentially weighted moving average
+and the slope of a least squares fit over these values are used to forecast
+the load at the time a new deployment would be running. The report times are
+averaged as well, extrapolating from the average time removes the lag of the
+moving average when the load follows a trend.
+"""
+
+from __future__ import annotations
+
+import time
+from array import array
+from collections import deque
+from threading import Lock
+from typing import Callable, Deque, Iterable, Iterator, Mapping, Sequence
+from uuid import UUID
+
+import numpy as np
+from attrs import define
+
+# Fixed column layout of the resource matrix, these are the metrics reported
+# by Sinfonia Tier2 (see RESOURCE_QUERIES in cluster.py)
+RESOURCE_METRICS = (
+    "cpu_ratio",
+    "mem_ratio",
+    "gpu_ratio",
+    "net_rx_rate",
+    "net_tx_rate",
+    "cpu_avail",
+    "mem_avail",
+    "disk_avail",
+    "cpu_used",
+    "mem_used",
+)
+COLUMN = {metric: column for column, metric in enumerate(RESOURCE_METRICS)}
+
+# Client resource requirements and the metric each one is checked against
+REQUIREMENTS = ("cpu", "mem", "disk")
+AVAILABLE = [COLUMN["cpu_avail"], COLUMN["mem_avail"], COLUMN["disk_avail"]]
+USED = [COLUMN["cpu_used"], COLUMN["mem_used"]]
+
+# number of recent reports kept for forecasting, about a minute of reports,
+# and the smoothing factor of the moving average
+HISTORY = 12
+EWMA_ALPHA = 0.3
+
+
+class Resources(Mapping[str, float]):
+    """Read-only mapping of the resource metrics reported by a cloudlet.
+
+    The metrics in RESOURCE_METRICS are stored in a packed array of floats,
+    with NaN for metrics that were not reported, any other metrics are kept
+    in a dictionary. This is a lot smaller than a dictionary of float objects
+    and adds nothing for the garbage collector to track.
+    """
+
+    __slots__ = ("_values", "_extra")
+
+    def __init__(self, resources: Mapping[str, float] | None = None) -> None:
+        self._values = array("d", _UNREPORTED)
+        self._extra: dict[str, float] | None = None
+
+        for metric, value in (resources or {}).items():
+            column = COLUMN.get(metric)
+            if column is not None:
+                self._values[column] = value
+            elif self._extra is None:
+                self._extra = {metric: value}
+            else:
+                self._extra[metric] = value
+
+    def __getitem__(self, metric: str) -> float:
+        column = COLUMN.get(metric)
+        if column is None:
+            if self._extra is None:
+                raise KeyError(metric)
+            return self._extra[metric]
+
+        value = self._values[column]
+        if value != value:  # NaN
+            raise KeyError(metric)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        for metric, value in zip(RESOURCE_METRICS, self._values):
+            if value == value:
+                yield metric
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        reported = sum(value == value for value in self._values)
+        return reported + len(self._extra or ())
+
+    def __repr__(self) -> str:
+        return f"Resources({dict(self)!r})"
+
+    def row(self) -> np.ndarray:
+        """Metrics in RESOURCE_METRICS order, NaN when not reported"""
+        return np.array(self._values)
+
+    @classmethod
+    def from_row(
+        cls, row: Sequence[float], extra: Mapping[str, float] | None = None
+    ) -> Resources:
+        """Resources from metrics in RESOURCE_METRICS order, see row()"""
+        resources = cls(extra)
+        resources._values = array("d", row)
+        return resources
+
+    def extra(self) -> dict[str, float]:
+        """Metrics that are not in RESOURCE_METRICS"""
+        return dict(self._extra or {})
+
+
+_UNREPORTED = array("d", [np.nan] * len(RESOURCE_METRICS))
+
+
+def requirements(resource_reqs: Mapping[str, float] | None) -> np.ndarray:
+    """Vector of (cpu, mem, disk) requirements, missing requirements are 0"""
+    resource_reqs = resource_reqs or {}
+    return np.array(
+        [float(resource_reqs.get(requirement, 0.0)) for requirement in REQUIREMENTS]
+    )
+
+
+def feasible(values: np.ndarray, reqs: np.ndarray) -> np.ndarray:
+    """Boolean mask of the rows that have enough cpu, memory and disk available.
+    Rows with unreported (NaN) metrics never pass.
+    """
+    return np.all(values[:, AVAILABLE] >= reqs, axis=1)
+
+
+def load_norm(
+    values: np.ndarray, columns: Sequence[int], increment: np.ndarray | float = 0.0
+) -> np.ndarray:
+    """L2 norm of the selected columns of each row after adding increment"""
+    return np.linalg.norm(values[:, columns] + increment, axis=1)
+
+
+def weighted_score(objectives: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Weighted sum of objectives (one column per objective, lower is better).
+
+    Each objective is rescaled to [0, 1] over the rows so that the weights do
+    not depend on the units of the metrics. Unknown (NaN) values score as the
+    worst value, and an objective that is the same for all rows adds nothing.
+    """
+    if not len(objectives):
+        return np.empty(0)
+
+    known = ~np.isnan(objectives)
+    lowest = np.min(np.where(known, objectives, np.inf), axis=0)
+    highest = np.max(np.where(known, objectives, -np.inf), axis=0)
+    spread = highest - lowest
+    offset = np.where(np.isfinite(lowest), lowest, 0.0)
+    scale = np.where(spread > 0, spread, 1.0)
+    normalized = np.where(known, (objectives - offset) / scale, 1.0)
+    return normalized @ weights
+
+
+def top_k(
+    scores: np.ndarray, k: int | None = None, descending: bool = False
+) -> np.ndarray:
+    """Indices of the k lowest (or highest) scores in sorted order.
+
+    Same result as the first k entries of a stable argsort, ties keep their
+    original order and NaN scores go last, but only the selected entries are
+    sorted, which is O(n + k log k) instead of O(n log n).
+    """
+    if descending:
+        scores = -scores
+    if k is None or k >= len(scores):
+        return np.argsort(scores, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    kth = np.partition(scores, k - 1)[k - 1]
+    if np.isnan(kth):
+        below = np.flatnonzero(~np.isnan(scores))
+        ties = np.flatnonzero(np.isnan(scores))
+    else:
+        below = np.flatnonzero(scores < kth)
+        ties = np.flatnonzero(scores == kth)
+    selected = np.concatenate((below, ties[: k - len(below)]))
+    return selected[np.argsort(scores[selected], kind="stable")]
+
+
+@define(eq=False)
+class Reservation:
+    """Resources (cpu, mem, disk) charged to a cloudlet for a placed deployment"""
+
+    uuid: UUID
+    amount: np.ndarray
+    charged: float
+    active: bool = True
+
+
+class ResourceMatrix:
+    """Most recently reported resource metrics of every known cloudlet.
+
+    Row 0 is a sentinel filled with NaN, it is returned for any cloudlet that
+    has not reported (yet) so that lookups never fail.
+
+    A reservation is held until the cloudlet sends a report at least
+    reservation_settle seconds after the reservation was charged, or until it
+    is reservation_timeout seconds old for cloudlets that do not report.
+
+    The ring buffers of recent reports are stored as arrays with one row per
+    cloudlet as well, so forecasts for all candidates are computed at once.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 64,
+        reservation_settle: float = 10.0,
+        reservation_timeout: float = 60.0,
+    ) -> None:
+        capacity = max(capacity, 2)
+        self._values = np.full((capacity, len(RESOURCE_METRICS)), np.nan)
+        self._reserved = np.zeros((capacity, len(REQUIREMENTS)))
+
+        # ring buffers of report times and used resources, number of reports
+        # received and moving average of the used resources for every row
+        self._times = np.zeros((capacity, HISTORY))
+        self._history = np.full((capacity, HISTORY, len(USED)), np.nan)
+        self._reports = np.zeros(capacity, dtype=np.int64)
+        self._ewma = np.full((capacity, len(USED)), np.nan)
+        self._ewma_time = np.zeros(capacity)
+        self._rows: dict[UUID, int] = {}
+        self._free: list[int] = []
+        self._next_row = 1
+        self._lock = Lock()
+
+        # time source for the reservations, can be replaced for simulations
+        self.clock: Callable[[], float] = time.monotonic
+        self.reservation_settle = reservation_settle
+        self.reservation_timeout = reservation_timeout
+        self._reservations: dict[UUID, Deque[Reservation]] = {}
+        self._by_age: Deque[Reservation] = deque()
+        # incremented whenever the reserved resources change
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, uuid: object) -> bool:
+        return uuid in self._rows
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+
+        row = self._next_row
+        if row == len(self._values):
+            self._values = _grow(self._values, np.nan)
+            self._reserved = _grow(self._reserved, 0.0)
+            self._times = _grow(self._times, 0.0)
+            self._history = _grow(self._history, np.nan)
+            self._reports = _grow(self._reports, 0)
+            self._ewma = _grow(self._ewma, np.nan)
+            self._ewma_time = _grow(self._ewma_time, 0.0)
+        self._next_row += 1
+        return row
+
+    def _record(self, index: int, used: np.ndarray, now: float) -> None:
+        """Add the used resources of a report to the ring buffer of a row"""
+        slot = self._reports[index] % HISTORY
+        self._times[index, slot] = now
+        self._history[index, slot] = used
+        self._reports[index] += 1
+
+        first = self._reports[index] == 1
+        ewma_time = self._ewma_time[index]
+        self._ewma_time[index] = (
+            now if first else EWMA_ALPHA * now + (1 - EWMA_ALPHA) * ewma_time
+        )
+        ewma = self._ewma[index]
+        self._ewma[index] = np.where(
+            np.isnan(ewma), used, EWMA_ALPHA * used + (1 - EWMA_ALPHA) * ewma
+        )
+
+    def _clear(self, index: int) -> None:
+        self._values[index] = np.nan
+        self._reserved[index] = 0.0
+        self._history[index] = np.nan
+        self._reports[index] = 0
+        self._ewma[index] = np.nan
+
+    def update(
+        self, uuid: UUID, resources: Mapping[str, float], now: float | None = None
+    ) -> None:
+        """Replace the metrics for a cloudlet, unknown metrics are ignored.
+        Releases the reservations that should be reflected in this report.
+        """
+        now = self.clock() if now is None else now
+        if isinstance(resources, Resources):
+            row = resources.row()
+        else:
+            row = np.array(
+                [resources.get(metric, np.nan) for metric in RESOURCE_METRICS],
+                dtype=float,
+            )
+        with self._lock:
+            index = self._rows.get(uuid)
+            if index is None:
+                index = self._rows[uuid] = self._allocate()
+            self._values[index] = row
+            self._record(index, row[USED], now)
+            self._settle(uuid, now - self.reservation_settle)
+
+    def remove(self, uuid: UUID) -> None:
+        with self._lock:
+            self._settle(uuid, float("inf"))
+            index = self._rows.pop(uuid, None)
+            if index is not None:
+                self._clear(index)
+                self._free.append(index)
+
+    def take(
+        self, uuids: Iterable[UUID], horizon: float = 0.0, now: float | None = None
+    ) -> np.ndarray:
+        """Copy of the rows for the given cloudlets, in the same order.
+        Reserved resources are subtracted from the available resources and
+        added to the used resources. When horizon is set, the used cpu and
+        memory are replaced with their forecast for horizon seconds from now.
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            self._expire(now - self.reservation_timeout)
+            rows = [self._rows.get(uuid, 0) for uuid in uuids]
+            values = self._values[rows]
+            if horizon > 0:
+                self._forecast(rows, values, now + horizon)
+            if self._by_age:
+                reserved = self._reserved[rows]
+                values[:, AVAILABLE] -= reserved
+                values[:, USED] += reserved[:, : len(USED)]
+            return values
+
+    def _forecast(self, rows: list[int], values: np.ndarray, when: float) -> None:
+        """Replace used cpu and memory with the moving average extrapolated
+        along the trend of the recent reports, and adjust available resources
+        by the same amount.
+        """
+        times = self._times[rows]
+        history = self._history[rows]
+        reports = self._reports[rows]
+
+        # least squares slope over the valid entries in the ring buffers
+        valid = (np.arange(HISTORY) < reports[:, None])[..., None] & ~np.isnan(history)
+        weight = valid.astype(float)
+        count = weight.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = times[..., None]
+            t_mean = (weight * t).sum(axis=1) / count
+            y_mean = np.nansum(weight * history, axis=1) / count
+            dt = np.where(valid, t - t_mean[:, None], 0.0)
+            dy = np.where(valid, history - y_mean[:, None], 0.0)
+            slope = (dt * dy).sum(axis=1) / (dt * dt).sum(axis=1)
+        slope = np.nan_to_num(slope, nan=0.0, posinf=0.0, neginf=0.0)
+
+        ahead = when - self._ewma_time[rows]
+        forecast = self._ewma[rows] + slope * ahead[:, None]
+        forecast = np.maximum(forecast, 0.0)
+
+        change = np.nan_to_num(forecast - values[:, USED], nan=0.0)
+        values[:, USED] += change
+        values[:, AVAILABLE[: len(USED)]] -= change
+
+    def reserve(
+        self, uuid: UUID, amount: np.ndarray, now: float | None = None
+    ) -> Reservation | None:
+        """Charge the (cpu, mem, disk) requirements of a deployment that was
+        placed on a cloudlet until the cloudlet's reports should reflect it.
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            index = self._rows.get(uuid)
+            if index is None or not np.any(amount):
+                return None
+
+            reservation = Reservation(uuid, amount, now)
+            self._reservations.setdefault(uuid, deque()).append(reservation)
+            self._by_age.append(reservation)
+            self._reserved[index] += amount
+            self.version += 1
+            return reservation
+
+    def release(self, reservation: Reservation | None) -> None:
+        """Release a reservation early, i.e. when the deployment failed"""
+        if reservation is None:
+            return
+        with self._lock:
+            self._release(reservation)
+
+    def _release(self, reservation: Reservation) -> None:
+        if not reservation.active:
+            return
+        reservation.active = False
+
+        index = self._rows.get(reservation.uuid)
+        if index is not None:
+            self._reserved[index] -= reservation.amount
+        self.version += 1
+
+    def _settle(self, uuid: UUID, charged_before: float) -> None:
+        """Release reservations of a cloudlet that were charged before"""
+        reservations = self._reservations.get(uuid)
+        while reservations and reservations[0].charged <= charged_before:
+            self._release(reservations.popleft())
+        if not reservations:
+            self._reservations.pop(uuid, None)
+
+    def _expire(self, charged_before: float) -> None:
+        """Release all reservations that were charged before"""
+        while self._by_age and (
+            self._by_age[0].charged <= charged_before or not self._by_age[0].active
+        ):
+            reservation = self._by_age.popleft()
+            if reservation.active:
+                self._settle(reservation.uuid, reservation.charged)
+
+
+def _grow(array: np.ndarray, fill: float) -> np.ndarray:
+    """Double the number of rows of an array"""
+    return np.concatenate((array, np.full_like(array, fill)))
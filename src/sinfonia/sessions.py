@@ -0,0 +1,169 @@
+#
+# Sinfonia
+#
+# Keep-alive HTTP sessions from Tier1 to the Tier2 cloudlets
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Reuse connections when forwarding deployment requests
+
+Every cloudlet gets its own requests.Session, so that forwarded deployment
+requests reuse an open connection instead of paying for a new TCP (and TLS)
+handshake to a possibly distant Tier2. The number of connections kept open to
+a cloudlet is bounded, and every request has a connect and a read timeout.
+Sessions are closed when the cloudlet is removed from the registry.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import deque
+from threading import Lock
+from typing import Any
+from uuid import UUID
+
+import attrs
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+# idle connections kept open to each cloudlet
+POOL_SIZE = 4
+
+# seconds to wait for a connection, and for the response to a deployment
+# request, which includes the time Tier2 takes to deploy the backend
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 120.0
+
+# response times of recent successful requests kept for each cloudlet, and
+# how many are needed before latency percentiles are estimated from them
+LATENCY_SAMPLES = 64
+MIN_LATENCY_SAMPLES = 8
+
+
+@attrs.define
+class SessionStats:
+    """Counters for the requests sent to a single cloudlet"""
+
+    requests: int = 0
+    failures: int = 0
+    # connections opened, requests - connections were sent on a kept alive one
+    connections: int = 0
+    seconds: float = 0.0
+    latencies: deque[float] = attrs.field(
+        factory=lambda: deque(maxlen=LATENCY_SAMPLES), repr=False
+    )
+
+    def asdict(self) -> dict[str, Any]:
+        return attrs.asdict(
+            self, filter=lambda attribute, _: attribute.name != "latencies"
+        )
+
+
+@attrs.define
+class _Session:
+    session: requests.Session
+    adapter: HTTPAdapter
+    stats: SessionStats = attrs.field(factory=SessionStats)
+
+    def opened_connections(self) -> int:
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+
+class SessionPool:
+    """HTTP sessions to the cloudlets in a registry"""
+
+    def __init__(
+        self,
+        pool_size: int = POOL_SIZE,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+    ) -> None:
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._sessions: dict[UUID, _Session] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _session(self, uuid: UUID) -> _Session:
+        with self._lock:
+            session = self._sessions.get(uuid)
+            if session is None:
+                # failed deployment requests are not retried, another
+                # cloudlet may be able to handle the request
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size, max_retries=0
+                )
+                http = requests.Session()
+                http.mount("http://", adapter)
+                http.mount("https://", adapter)
+                session = self._sessions[uuid] = _Session(http, adapter)
+            return session
+
+    def request(self, method: str, uuid: UUID, url: str, **kwargs) -> requests.Response:
+        """Send a request to a cloudlet over its session, raises
+        RequestException when the request failed.
+        """
+        session = self._session(uuid)
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+
+        start = time.perf_counter()
+        try:
+            response = session.session.request(method, url, **kwargs)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            with self._lock:
+                session.stats.failures += 1
+            raise
+        else:
+            with self._lock:
+                session.stats.latencies.append(time.perf_counter() - start)
+        finally:
+            with self._lock:
+                session.stats.requests += 1
+                session.stats.seconds += time.perf_counter() - start
+                session.stats.connections = session.opened_connections()
+        return response
+
+    def post(self, uuid: UUID, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", uuid, url, **kwargs)
+
+    def delete(self, uuid: UUID, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", uuid, url, **kwargs)
+
+    def latency(self, uuid: UUID, percentile: float, default: float) -> float:
+        """Percentile of the response times of recent successful requests to
+        a cloudlet, default until enough requests were sent.
+        """
+        with self._lock:
+            session = self._sessions.get(uuid)
+            if session is None or len(session.stats.latencies) < MIN_LATENCY_SAMPLES:
+                return default
+            latencies = list(session.stats.latencies)
+        return float(np.percentile(latencies, percentile))
+
+    def remove(self, uuid: UUID) -> None:
+        """Close the connections to a cloudlet that was removed"""
+        with self._lock:
+            session = self._sessions.pop(uuid, None)
+        if session is not None:
+            session.session.close()
+
+    def stats(self) -> dict[UUID, dict[str, Any]]:
+        """Request counters for every cloudlet with an open session"""
+        with self._lock:
+            return {
+                uuid: session.stats.asdict() for uuid, session in self._sessions.items()
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.session.close()
@@ -0,0 +1,329 @@
+#
+# Sinfonia
+#
+# Cloudlet registry shared by the Tier1 worker processes on a host
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Share reporting cloudlets between Tier1 worker processes
+
+When Tier1 runs under a multi-worker WSGI server, each worker only receives
+part of the heartbeats. Reported cloudlets are therefore written to a SQLite
+database that all workers on the host open. Every change is stamped with an
+increasing version number, and each worker applies the changes made since
+the last version it has seen to its own in-memory registry. The match
+functions keep reading the local indexes without any locking.
+
+Removed cloudlets are kept as tombstones for a while so that all workers
+see the removal. Only the worker that holds the expiry lease removes stale
+cloudlets, the others pick up the removals when they synchronize.
+
+Cloudlets from the cloudlets.yaml configuration file are loaded by every
+worker and are not shared.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock, local
+from typing import Iterable, Iterator, Mapping
+from uuid import UUID
+
+import pendulum
+
+from .cloudlets import Cloudlet
+from .registry import CloudletRegistry, ResourceReport
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS cloudlets (
+    uuid TEXT PRIMARY KEY,
+    cloudlet TEXT NOT NULL,
+    resources TEXT NOT NULL,
+    last_update REAL NOT NULL,
+    sequence INTEGER,
+    version INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS cloudlets_version ON cloudlets (version);
+CREATE INDEX IF NOT EXISTS cloudlets_last_update ON cloudlets (last_update);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# the expiry lease is renewed by the holder once half of it has passed
+EXPIRY_LEASE = 10.0
+
+# removed cloudlets are forgotten after workers had time to see the removal
+TOMBSTONE_TTL = 3600.0
+
+
+class SharedCloudletRegistry(CloudletRegistry):
+    """CloudletRegistry that shares reporting cloudlets through SQLite"""
+
+    def __init__(self, database: str | Path, cloudlets: Iterable[Cloudlet] = ()):
+        self.database = str(database)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._connections = local()
+        self._sync_lock = Lock()
+        self._synced = 0
+        # static attributes of the shared cloudlets as last seen
+        self._shared: dict[UUID, str] = {}
+
+        self._db.executescript(SCHEMA)
+
+        super().__init__(cloudlets)
+        self.sync()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """Connection for the current thread"""
+        db = getattr(self._connections, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.database, timeout=30.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._connections.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @staticmethod
+    def _next_version(db: sqlite3.Connection) -> int:
+        (version,) = db.execute(
+            "SELECT coalesce(max(version), 0) + 1 FROM cloudlets"
+        ).fetchone()
+        return version
+
+    def sync(self, wait: bool = False) -> None:
+        """Apply the changes made by all workers since the last sync. Unless
+        wait is set, returns right away when another thread is syncing.
+        """
+        if not self._sync_lock.acquire(blocking=wait):
+            return
+        try:
+            changes = self._db.execute(
+                "SELECT uuid, cloudlet, resources, last_update, sequence, deleted,"
+                " version FROM cloudlets WHERE version > ? ORDER BY version",
+                (self._synced,),
+            ).fetchall()
+            for *change, version in changes:
+                self._apply(*change)
+                self._synced = version
+        finally:
+            self._sync_lock.release()
+
+    def _apply(
+        self,
+        row_uuid: str,
+        encoded: str,
+        resources: str,
+        timestamp: float,
+        sequence: int | None,
+        deleted: int,
+    ) -> None:
+        uuid = UUID(row_uuid)
+        if deleted:
+            if self._shared.pop(uuid, None) is not None:
+                CloudletRegistry.__delitem__(self, uuid)
+            return
+
+        last_update = pendulum.from_timestamp(timestamp)
+        if self._shared.get(uuid) == encoded:
+            CloudletRegistry.report(
+                self, uuid, json.loads(resources), last_update, sequence
+            )
+            return
+
+        cloudlet = Cloudlet.new_from_attributes(
+            uuid, json.loads(encoded), json.loads(resources), last_update, sequence
+        )
+        CloudletRegistry.__setitem__(self, uuid, cloudlet)
+        self._shared[uuid] = encoded
+
+    def __setitem__(self, uuid: UUID, cloudlet: Cloudlet) -> None:
+        # cloudlets from the configuration file are known to every worker
+        if cloudlet.last_update is None:
+            super().__setitem__(uuid, cloudlet)
+            return
+
+        with self._transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cloudlets VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (
+                    str(uuid),
+                    json.dumps(cloudlet.attributes()),
+                    json.dumps(dict(cloudlet.resources)),
+                    cloudlet.last_update.timestamp(),
+                    cloudlet.sequence,
+                    self._next_version(db),
+                ),
+            )
+        self.sync(wait=True)
+
+    def __delitem__(self, uuid: UUID) -> None:
+        if uuid not in self._shared:
+            super().__delitem__(uuid)
+            return
+
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE cloudlets SET deleted = 1, version = ? WHERE uuid = ?",
+                (self._next_version(db), str(uuid)),
+            )
+        self.sync(wait=True)
+
+    def report(
+        self,
+        uuid: UUID,
+        resources: Mapping[str, float],
+        last_update: pendulum.DateTime,
+        sequence: int | None = None,
+    ) -> None:
+        if uuid not in self._shared:
+            super().report(uuid, resources, last_update, sequence)
+            return
+
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE cloudlets SET resources = ?, last_update = ?, sequence = ?,"
+                " version = ? WHERE uuid = ?",
+                (
+                    json.dumps(dict(resources)),
+                    last_update.timestamp(),
+                    sequence,
+                    self._next_version(db),
+                    str(uuid),
+                ),
+            )
+        self.sync(wait=True)
+
+    def report_many(self, reports: Iterable[ResourceReport]) -> None:
+        shared: list[ResourceReport] = []
+        local: list[ResourceReport] = []
+        for update in reports:
+            (shared if update[0] in self._shared else local).append(update)
+        super().report_many(local)
+        if not shared:
+            return
+
+        with self._transaction() as db:
+            version = self._next_version(db)
+            db.executemany(
+                "UPDATE cloudlets SET resources = ?, last_update = ?, sequence = ?,"
+                " version = ? WHERE uuid = ?",
+                [
+                    (
+                        json.dumps(dict(resources)),
+                        last_update.timestamp(),
+                        sequence,
+                        version + offset,
+                        str(uuid),
+                    )
+                    for offset, (uuid, resources, last_update, sequence) in enumerate(
+                        shared
+                    )
+                ],
+            )
+        self.sync(wait=True)
+
+    def apply_delta(self, uuid: UUID, *args, **kwargs) -> bool:
+        # the previous report may have been handled by another worker
+        self.sync(wait=True)
+        return super().apply_delta(uuid, *args, **kwargs)
+
+    def _schedule_expiry(self, uuid: UUID, cloudlet: Cloudlet) -> None:
+        # shared cloudlets are expired in the database by the lease holder
+        pass
+
+    def _acquire_lease(self, name: str, db: sqlite3.Connection) -> bool:
+        now = time.time()
+        lease = db.execute(
+            "SELECT holder, expires FROM leases WHERE name = ?", (name,)
+        ).fetchone()
+        if lease is not None and lease[0] != self.holder and lease[1] > now:
+            return False
+        db.execute(
+            "INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+            (name, self.holder, now + EXPIRY_LEASE),
+        )
+        return True
+
+    def _lease(self, name: str) -> tuple[str, float] | None:
+        """Current holder and expiry of a lease, read without a transaction"""
+        return self._db.execute(
+            "SELECT holder, expires FROM leases WHERE name = ?", (name,)
+        ).fetchone()
+
+    def holds_expiry_lease(self) -> bool:
+        lease = self._lease("expire")
+        return lease is not None and lease[0] == self.holder and lease[1] > time.time()
+
+    def expire(self, before: float) -> list[Cloudlet]:
+        """Remove cloudlets that did not report since the given (POSIX) time
+        when this worker holds the expiry lease, returns removed cloudlets.
+        """
+        # this runs every second in every worker, only take the write lock
+        # when there is something to expire or the lease has to be renewed
+        now = time.time()
+        lease = self._lease("expire")
+        if lease is not None and lease[0] != self.holder and lease[1] > now:
+            return []
+        renew = lease is None or lease[1] - now < EXPIRY_LEASE / 2
+        if not renew:
+            (pending,) = self._db.execute(
+                "SELECT EXISTS (SELECT 1 FROM cloudlets"
+                " WHERE last_update < ? AND NOT deleted)",
+                (before,),
+            ).fetchone()
+            if not pending:
+                return []
+
+        stale: list[UUID] = []
+        with self._transaction() as db:
+            if self._acquire_lease("expire", db):
+                stale = [
+                    UUID(uuid)
+                    for (uuid,) in db.execute(
+                        "SELECT uuid FROM cloudlets"
+                        " WHERE last_update < ? AND NOT deleted",
+                        (before,),
+                    )
+                ]
+                version = self._next_version(db)
+                db.executemany(
+                    "UPDATE cloudlets SET deleted = 1, version = ? WHERE uuid = ?",
+                    [
+                        (version + offset, str(uuid))
+                        for offset, uuid in enumerate(stale)
+                    ],
+                )
+                # the latest version is never removed, it has to keep increasing
+                db.execute(
+                    "DELETE FROM cloudlets WHERE deleted AND last_update < ?"
+                    " AND version < (SELECT max(version) FROM cloudlets)",
+                    (before - TOMBSTONE_TTL,),
+                )
+
+        expired = [self[uuid] for uuid in stale if uuid in self]
+        self.sync(wait=True)
+        return expired
@@ -0,0 +1,157 @@
+#
+# Sinfonia
+#
+# Snapshots of the Tier1 registry for warm restarts
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Save and restore the reporting cloudlets known to Tier1
+
+Without a snapshot a restarted Tier1 does not know any of the Tier2 cloudlets
+until each one reports again. The snapshot holds the resolved attributes of
+each cloudlet, so restoring does not need DNS or GeoIP lookups, and their last
+reported resources.
+
+File layout, all integers are little endian:
+
+    magic       8 bytes     b"SINFSNAP"
+    format      uint32      SNAPSHOT_FORMAT
+    count       uint32      number of cloudlets
+    size        uint64      size of the JSON encoded cloudlet attributes
+    attributes  size bytes  JSON list with uuid, attributes, last_update,
+                            sequence and extra resources of each cloudlet
+    padding                 up to the next multiple of 8 bytes
+    resources   float64     count x len(RESOURCE_METRICS) matrix
+
+The file is memory mapped when it is loaded, the resource rows are used
+directly from the mapping. A new snapshot is written to a uniquely named
+temporary file which then replaces the previous one, so a crash leaves either
+the old or the new snapshot in place.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from uuid import UUID
+
+import numpy as np
+import pendulum
+
+from .cloudlets import Cloudlet
+from .registry import CloudletRegistry
+from .resource_matrix import RESOURCE_METRICS, Resources
+
+SNAPSHOT_MAGIC = b"SINFSNAP"
+SNAPSHOT_FORMAT = 1
+HEADER = struct.Struct("<8sIIQ")
+
+logger = logging.getLogger(__name__)
+
+
+def _padding(offset: int) -> int:
+    return -offset % 8
+
+
+def save_snapshot(registry: CloudletRegistry, path: str | Path) -> int:
+    """Write the reporting cloudlets in the registry to a snapshot file,
+    returns the number of cloudlets saved.
+    """
+    cloudlets = [
+        cloudlet
+        for cloudlet in registry.snapshot().cloudlets
+        if cloudlet.last_update is not None
+    ]
+    entries = [
+        [
+            str(cloudlet.uuid),
+            cloudlet.attributes(),
+            cloudlet.last_update.timestamp(),  # type: ignore[union-attr]
+            cloudlet.sequence,
+            Resources(cloudlet.resources).extra(),
+        ]
+        for cloudlet in cloudlets
+    ]
+    attributes = json.dumps(entries).encode()
+    resources = np.array(
+        [Resources(cloudlet.resources).row() for cloudlet in cloudlets],
+        dtype="<f8",
+    ).reshape(len(cloudlets), len(RESOURCE_METRICS))
+
+    path = Path(path)
+    snapshot = tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", delete=False
+    )
+    try:
+        with snapshot:
+            snapshot.write(
+                HEADER.pack(
+                    SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, len(entries), len(attributes)
+                )
+            )
+            snapshot.write(attributes)
+            snapshot.write(bytes(_padding(HEADER.size + len(attributes))))
+            snapshot.write(resources.tobytes())
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(snapshot.name, path)
+    except BaseException:
+        os.unlink(snapshot.name)
+        raise
+    return len(entries)
+
+
+def load_snapshot(path: str | Path) -> list[Cloudlet]:
+    """Cloudlets from a snapshot file, an empty list when the snapshot does not
+    exist or is not valid.
+    """
+    try:
+        with open(path, "rb") as snapshot:
+            contents = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # missing or empty
+        return []
+
+    try:
+        magic, version, count, size = HEADER.unpack_from(contents)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT:
+            raise ValueError("Unknown snapshot format")
+
+        offset = HEADER.size + size
+        entries = json.loads(contents[HEADER.size : offset])
+        rows = np.frombuffer(
+            contents,
+            dtype="<f8",
+            count=count * len(RESOURCE_METRICS),
+            offset=offset + _padding(offset),
+        ).reshape(count, len(RESOURCE_METRICS))
+
+        # Resources copy the rows, the mapping can be closed afterwards
+        cloudlets = [
+            Cloudlet.new_from_attributes(
+                UUID(uuid),
+                attributes,
+                Resources.from_row(row, extra),
+                pendulum.from_timestamp(last_update),
+                sequence,
+            )
+            for (uuid, attributes, last_update, sequence, extra), row in zip(
+                entries, rows
+            )
+        ]
+        del rows
+    except (struct.error, ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Ignoring snapshot {path}: {e}")
+        cloudlets = []
+
+    try:
+        contents.close()
+    except BufferError:  # rows still referenced by the exception traceback
+        pass
+    return cloudlets
@@ -0,0 +1,149 @@
+#
+# Sinfonia
+#
+# Spatial index of cloudlet locations
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Nearest neighbour search over the locations of known cloudlets
+
+Coordinates are mapped to points on the unit sphere and stored in a k-d tree.
+The straight-line (chord) distance between two such points increases
+monotonically with the great-circle distance, so the tree returns locations
+ordered by their spherical distance from a client without having to solve a
+geodesic for every cloudlet.
+"""
+
+from __future__ import annotations
+
+from threading import Lock
+from typing import Iterator, Sequence
+from uuid import UUID
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .geo_location import EARTH_RADIUS, Coordinates, GeoLocation
+
+# bound on the relative difference between the spherical distance and the
+# geodesic distance on the WGS-84 ellipsoid, which is about 0.56%
+GEODESIC_ERROR = 0.01
+
+
+def unit_vectors(coordinates: Coordinates) -> np.ndarray:
+    """Map an array of (latitude, longitude) in degrees to 3D unit vectors"""
+    latitude, longitude = np.radians(np.asarray(coordinates, dtype=float)).T
+    cos_latitude = np.cos(latitude)
+    return np.stack(
+        (
+            cos_latitude * np.cos(longitude),
+            cos_latitude * np.sin(longitude),
+            np.sin(latitude),
+        ),
+        axis=-1,
+    )
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """Convert chord length between unit vectors to great-circle distance"""
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0.0, 1.0))
+
+
+class SpatialIndex:
+    """k-d tree over the locations of all known cloudlets.
+
+    Cloudlets rarely move, so the tree is only rebuilt, lazily on the next
+    query, when a location was actually added, changed or removed.
+    """
+
+    def __init__(self) -> None:
+        self._locations: dict[UUID, tuple[tuple[float, float], ...]] = {}
+        self._tree: tuple[cKDTree, list[UUID]] | None = None
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def update(self, uuid: UUID, locations: Sequence[GeoLocation]) -> None:
+        coordinates = tuple(location.coordinate for location in locations)
+        with self._lock:
+            if self._locations.get(uuid, ()) == coordinates:
+                return
+            if coordinates:
+                self._locations[uuid] = coordinates
+            else:
+                self._locations.pop(uuid, None)
+            self._tree = None
+
+    def remove(self, uuid: UUID) -> None:
+        with self._lock:
+            if self._locations.pop(uuid, None) is not None:
+                self._tree = None
+
+    def _get_tree(self) -> tuple[cKDTree, list[UUID]] | None:
+        with self._lock:
+            if self._tree is None and self._locations:
+                owners = [
+                    uuid
+                    for uuid, coordinates in self._locations.items()
+                    for _ in coordinates
+                ]
+                points = unit_vectors(
+                    [
+                        coordinate
+                        for coordinates in self._locations.values()
+                        for coordinate in coordinates
+                    ]
+                )
+                self._tree = (cKDTree(points), owners)
+            return self._tree
+
+    def nearest(
+        self, location: GeoLocation, batch_size: int = 8
+    ) -> Iterator[tuple[float, UUID]]:
+        """Yields (spherical distance in km, cloudlet uuid) for every indexed
+        location ordered by increasing distance. A cloudlet with multiple
+        locations is yielded once for each location.
+
+        The tree is queried for progressively larger batches, so stopping early
+        only costs a logarithmic number of tree lookups.
+        """
+        indexed = self._get_tree()
+        if indexed is None:
+            return
+
+        tree, owners = indexed
+        point = unit_vectors([location.coordinate])[0]
+
+        # track what was yielded instead of skipping the first k results of
+        # the next query, equidistant points may be returned in another order
+        yielded: set[int] = set()
+        k = batch_size
+        while len(yielded) < tree.n:
+            k = min(k, tree.n)
+            chords, indices = tree.query(point, k=k)
+            for chord, index in zip(np.atleast_1d(chords), np.atleast_1d(indices)):
+                if index not in yielded:
+                    yielded.add(index)
+                    yield float(chord_to_km(chord)), owners[index]
+            k *= 2
+
+    def distances(self, location: GeoLocation, uuids: Sequence[UUID]) -> np.ndarray:
+        """Spherical distance in km from location to the closest location of
+        each of the cloudlets, NaN when a cloudlet has no known location.
+        """
+        rows: list[int] = []
+        coordinates: list[tuple[float, float]] = []
+        with self._lock:
+            for row, uuid in enumerate(uuids):
+                for coordinate in self._locations.get(uuid, ()):
+                    rows.append(row)
+                    coordinates.append(coordinate)
+
+        closest = np.full(len(uuids), np.inf)
+        if coordinates:
+            np.minimum.at(closest, rows, location.distances(coordinates))
+        closest[np.isinf(closest)] = np.nan
+        return closest
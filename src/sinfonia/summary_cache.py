@@ -0,0 +1,142 @@
+#
+# Sinfonia
+#
+# Cache of the encoded cloudlet list returned by Tier1
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Serve the list of known cloudlets without re-encoding it for every request
+
+Dashboards poll the list of known cloudlets much more often than most
+cloudlets report. The JSON encoded summary of every cloudlet is kept and only
+encoded again when that cloudlet reported, was replaced or removed. Pages of
+the list are assembled from these fragments once per registry version, along
+with an ETag derived from their contents and a gzip compressed copy that is
+created when a client first asks for it.
+
+The ETag only depends on the contents, so it is the same on every Tier1
+worker that shares the registry and clients can revalidate against any of
+them.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+from io import BytesIO
+from threading import Lock
+from typing import Any, Iterator
+from uuid import UUID
+
+import attrs
+
+from .registry import CloudletRegistry
+
+# cached pages of the list, dropped whenever the registry changes
+MAX_PAGES = 64
+
+# size of the chunks in which the encoded list is streamed to a client
+CHUNK_SIZE = 64 * 1024
+
+
+@attrs.define
+class SummaryPage:
+    """JSON encoded summaries of a range of cloudlets"""
+
+    body: bytes
+    etag: str
+    total: int  # number of cloudlets in the whole list
+    _gzipped: bytes | None = attrs.field(default=None, repr=False)
+
+    @classmethod
+    def from_fragments(cls, fragments: list[bytes], total: int) -> SummaryPage:
+        body = b"[" + b",".join(fragments) + b"]"
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        return cls(body, etag, total)
+
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            # a fixed mtime keeps the compressed copy the same on every worker,
+            # gzip.compress() only accepts mtime since Python 3.8
+            buffer = BytesIO()
+            with gzip.GzipFile(
+                fileobj=buffer, mode="wb", compresslevel=6, mtime=0
+            ) as compressed:
+                compressed.write(self.body)
+            self._gzipped = buffer.getvalue()
+        return self._gzipped
+
+    @staticmethod
+    def chunks(body: bytes) -> Iterator[bytes]:
+        for offset in range(0, len(body), CHUNK_SIZE):
+            yield body[offset : offset + CHUNK_SIZE]
+
+
+class SummaryCache:
+    """Encoded summaries of the cloudlets in a registry"""
+
+    def __init__(self, maxpages: int = MAX_PAGES) -> None:
+        self.maxpages = maxpages
+        # cloudlet, resources and last_update the summary was encoded from
+        self._fragments: dict[UUID, tuple[Any, Any, Any, bytes]] = {}
+        self._version: int | None = None
+        self._pages: dict[tuple[int, int | None], SummaryPage] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, registry: CloudletRegistry, offset: int = 0, limit: int | None = None
+    ) -> SummaryPage:
+        """Summaries of up to limit cloudlets, starting at offset"""
+        version, _ = registry.version  # reservations do not show in summaries
+
+        with self._lock:
+            if version != self._version:
+                self._refresh(registry)
+                self._pages.clear()
+                self._version = version
+
+            page = self._pages.get((offset, limit))
+            if page is not None:
+                self.hits += 1
+                return page
+            self.misses += 1
+
+            fragments = [fragment for *_, fragment in self._fragments.values()]
+            end = None if limit is None else offset + limit
+            page = SummaryPage.from_fragments(fragments[offset:end], len(fragments))
+
+            if len(self._pages) >= self.maxpages:
+                self._pages.clear()
+            self._pages[(offset, limit)] = page
+            return page
+
+    def _refresh(self, registry: CloudletRegistry) -> None:
+        """Encode the summaries of cloudlets that changed since the last
+        refresh. Reports replace the resources and last_update of a cloudlet,
+        so comparing identities is enough to find the changed ones.
+        """
+        fragments = {}
+        for cloudlet in registry.snapshot().cloudlets:
+            uuid = cloudlet.uuid
+            cached = self._fragments.get(uuid)
+            if (
+                cached is None
+                or cached[0] is not cloudlet
+                or cached[1] is not cloudlet.resources
+                or cached[2] is not cloudlet.last_update
+            ):
+                fragment = json.dumps(cloudlet.summary()).encode()
+                cached = (cloudlet, cloudlet.resources, cloudlet.last_update, fragment)
+            fragments[uuid] = cached
+        self._fragments = fragments
+
+    def clear(self) -> None:
+        with self._lock:
+            self._fragments.clear()
+            self._pages.clear()
+            self._version = None
@@ -21,6 +21,17 @@ def update_dependencies(c):
     c.run("git commit -m 'Update dependencies' poetry.lock .pre-commit-config.yaml")
 
 
+@task
+def benchmark(c, sizes="10,100,1000,10000", baseline=None, output=None):
+    """Benchmark Tier1 match functions, fails on regressions from baseline"""
+    args = f"--sizes {sizes}"
+    if baseline is not None:
+        args += f" --baseline {baseline}"
+    if output is not None:
+        args += f" --output {output}"
+    c.run(f"poetry run python -m benchmarks.matchers {args}")
+
+
 def get_current_version(c):
     """Get the current application version.
     Helm chart version should always be >= application version.
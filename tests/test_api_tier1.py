@@ -0,0 +1,416 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ipaddress import ip_address
+from pathlib import Path
+from threading import Thread
+from uuid import UUID, uuid4
+
+import connexion
+import pytest
+from connexion.resolver import MethodViewResolver
+from flask import Flask
+from geolite2 import geolite2
+from yarl import URL
+
+from sinfonia import openapi
+from sinfonia.api_tier1 import deploy_hedged
+from sinfonia.app_tier1 import (
+    STREAMED_VALIDATION_WARNING,
+    Tier1DefaultConfig,
+    skip_streamed_validation,
+)
+from sinfonia.client_info import ClientInfo
+from sinfonia.cloudlets import Cloudlet
+from sinfonia.matchers import match_by_location, match_by_network, match_random
+from sinfonia.placement_cache import PlacementCache
+from sinfonia.registry import CloudletRegistry
+from sinfonia.summary_cache import SummaryCache
+
+
+class Tier2Handler(BaseHTTPRequestHandler):
+    """Deploys after the delay in the first path component"""
+
+    protocol_version = "HTTP/1.1"
+    deleted: list[str] = []
+
+    def do_POST(self):
+        name, *_, uuid, key = self.path.split("/")[1:]
+        time.sleep(float(name.split("-")[1]))
+        status = 500 if name.startswith("failing") else 200
+        deployment = dict(
+            cloudlet=name,
+            UUID=uuid,
+            ApplicationKey=key,
+            Status="Deployed",
+            TunnelConfig=dict(
+                publicKey=key,
+                allowedIPs=["10.0.0.0/8"],
+                endpoint="127.0.0.1:51820",
+                address=["10.0.0.2/32"],
+                dns=["10.0.0.1"],
+            ),
+        )
+        body = json.dumps([deployment]).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_DELETE(self):
+        self.deleted.append(self.path.split("/")[1])
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tier2():
+    Tier2Handler.deleted = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Tier2Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def tier1(repository):
+    """Tier1 api without the background jobs started by wsgi_app_factory"""
+    specification_dir = Path(openapi.__file__).parent
+    app = connexion.FlaskApp(__name__, specification_dir=specification_dir)
+
+    flask_app = app.app
+    flask_app.config.from_object(Tier1DefaultConfig)
+    flask_app.config["executor"] = ThreadPoolExecutor(8)
+    flask_app.config["geolite2_reader"] = geolite2.reader()
+    flask_app.config["cloudlets"] = CloudletRegistry()
+    flask_app.config["deployment_repository"] = repository
+    flask_app.config["match_functions"] = [
+        match_by_network,
+        match_by_location,
+        match_random,
+    ]
+    flask_app.config["placement_cache"] = PlacementCache()
+    flask_app.config["summary_cache"] = SummaryCache()
+
+    app.add_api(
+        openapi.load_spec(specification_dir / "sinfonia_tier1.yaml"),
+        resolver=MethodViewResolver("sinfonia.api_tier1"),
+        validate_responses=True,
+    )
+    yield flask_app
+    flask_app.config["executor"].shutdown(wait=True)
+
+
+def add_cloudlet(registry, tier2, name, **resources):
+    cloudlet = Cloudlet.new(
+        uuid=uuid4(),
+        endpoint=URL(f"{tier2}/{name}/api/v1/deploy"),
+        name=name,
+        locations=[],
+        local_networks=[],
+        resources=resources,
+    )
+    registry[cloudlet.uuid] = cloudlet
+    return cloudlet
+
+
+CLOUDLET_UUID = "00000000-0000-0000-0000-00000000000a"
+
+
+class TestCloudletsView:
+    REPORT = {
+        "uuid": CLOUDLET_UUID,
+        "endpoint": "http://128.2.0.1/api/v1/deploy",
+        "locations": [[40.4439, -79.9444]],
+        "resources": {"cpu_ratio": 0.5, "mem_ratio": 0.25},
+        "sequence": 1,
+    }
+
+    def post(self, tier1, report):
+        return tier1.test_client().post("/api/v1/cloudlets/", json=report)
+
+    def cloudlet(self, tier1):
+        (cloudlet,) = tier1.config["cloudlets"].values()
+        return cloudlet
+
+    def test_report(self, tier1):
+        assert self.post(tier1, self.REPORT).status_code == 204
+        cloudlet = self.cloudlet(tier1)
+        assert cloudlet.name == "128.2.0.1"
+        assert dict(cloudlet.resources) == self.REPORT["resources"]
+        assert cloudlet.sequence == 1
+
+        assert UUID(CLOUDLET_UUID) in tier1.config["cloudlets"]
+
+        assert self.post(tier1, {"endpoint": "http://x"}).status_code == 400
+        assert self.post(tier1, dict(self.REPORT, uuid="x")).status_code == 400
+
+    def test_unchanged(self, tier1):
+        self.post(tier1, self.REPORT)
+        cloudlet = self.cloudlet(tier1)
+        membership = tier1.config["cloudlets"].membership
+
+        # only the resources changed, the cloudlet is updated in place
+        report = dict(self.REPORT, resources={"cpu_ratio": 0.75}, sequence=2)
+        assert self.post(tier1, report).status_code == 204
+        assert self.cloudlet(tier1) is cloudlet
+        assert dict(cloudlet.resources) == {"cpu_ratio": 0.75}
+        assert tier1.config["cloudlets"].membership == membership
+
+        # anything else replaces the cloudlet
+        report = dict(self.REPORT, locations=[[37.8, -122.4]])
+        assert self.post(tier1, report).status_code == 204
+        assert self.cloudlet(tier1) is not cloudlet
+        assert tier1.config["cloudlets"].membership != membership
+
+    def test_delta(self, tier1):
+        self.post(tier1, self.REPORT)
+
+        delta = dict(
+            uuid=self.REPORT["uuid"],
+            sequence=2,
+            changed={"cpu_ratio": 0.75},
+            removed=["mem_ratio"],
+        )
+        assert self.post(tier1, delta).status_code == 204
+        cloudlet = self.cloudlet(tier1)
+        assert dict(cloudlet.resources) == {"cpu_ratio": 0.75}
+        assert cloudlet.sequence == 2
+
+        # a retransmitted delta is accepted again
+        assert self.post(tier1, delta).status_code == 204
+        assert self.cloudlet(tier1).sequence == 2
+
+    def test_resync(self, tier1):
+        delta = dict(uuid=self.REPORT["uuid"], sequence=2, changed={"cpu_ratio": 1})
+
+        # unknown cloudlet
+        assert self.post(tier1, delta).status_code == 409
+
+        # missed a report
+        self.post(tier1, self.REPORT)
+        assert self.post(tier1, dict(delta, sequence=3)).status_code == 409
+        assert dict(self.cloudlet(tier1).resources) == self.REPORT["resources"]
+
+        # until the cloudlet sends a full report again
+        assert self.post(tier1, dict(self.REPORT, sequence=3)).status_code == 204
+        assert self.post(tier1, dict(delta, sequence=4)).status_code == 204
+        assert self.cloudlet(tier1).resources["cpu_ratio"] == 1
+
+
+class TestCloudletsList:
+    @pytest.fixture
+    def client(self, tier1):
+        client = tier1.test_client()
+        for n in range(3):
+            report = dict(
+                TestCloudletsView.REPORT,
+                uuid=str(uuid4()),
+                endpoint=f"http://128.2.0.{n}/api/v1/deploy",
+            )
+            client.post("/api/v1/cloudlets/", json=report)
+        return client
+
+    def test_etag(self, client):
+        response = client.get("/api/v1/cloudlets/")
+        assert response.status_code == 200
+        assert len(response.json) == 3
+        assert response.headers["X-Total-Count"] == "3"
+        etag = response.headers["ETag"]
+
+        response = client.get("/api/v1/cloudlets/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+        assert response.headers["ETag"] == etag
+
+        # a report changes the list
+        client.post("/api/v1/cloudlets/", json=TestCloudletsView.REPORT)
+        response = client.get("/api/v1/cloudlets/", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert len(response.json) == 4
+        assert response.headers["ETag"] != etag
+
+    def test_gzip(self, client):
+        plain = client.get("/api/v1/cloudlets/")
+        response = client.get("/api/v1/cloudlets/", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Content-Length"] == str(len(response.data))
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert gzip.decompress(response.data) == plain.data
+        assert response.headers["ETag"] == plain.headers["ETag"]
+
+    def test_pages(self, client):
+        everything = client.get("/api/v1/cloudlets/").json
+
+        response = client.get("/api/v1/cloudlets/?offset=1&limit=1")
+        assert response.status_code == 200
+        assert response.json == everything[1:2]
+        assert response.headers["X-Total-Count"] == "3"
+
+        response = client.get("/api/v1/cloudlets/?offset=5")
+        assert response.json == []
+        assert response.headers["X-Total-Count"] == "3"
+
+    def test_streamed_warning(self):
+        def record(message):
+            return logging.LogRecord(
+                "connexion.decorators.response",
+                logging.WARNING,
+                "",
+                0,
+                message,
+                (),
+                None,
+            )
+
+        assert not skip_streamed_validation.filter(record(STREAMED_VALIDATION_WARNING))
+        assert skip_streamed_validation.filter(record("Something else"))
+
+
+class TestBulkReports:
+    def reports(self):
+        reports = [
+            dict(TestCloudletsView.REPORT, uuid=str(uuid4()), sequence=1)
+            for _ in range(2)
+        ]
+        # a delta that follows the first report, and one that missed a report
+        reports.append(dict(uuid=reports[0]["uuid"], sequence=2, changed={}))
+        reports.append(dict(uuid=reports[1]["uuid"], sequence=3, changed={}))
+        return reports
+
+    def check(self, tier1, reports, response):
+        assert response.status_code == 200
+        assert response.json == [
+            dict(uuid=report["uuid"], status=status)
+            for report, status in zip(reports, [204, 204, 204, 409])
+        ]
+        registry = tier1.config["cloudlets"]
+        assert sorted(cloudlet.sequence for cloudlet in registry.values()) == [1, 2]
+
+    def test_json(self, tier1):
+        reports = self.reports()
+        response = tier1.test_client().post("/api/v1/cloudlets/bulk/", json=reports)
+        self.check(tier1, reports, response)
+
+    def test_consecutive_deltas(self, tier1):
+        reports = self.reports()[:1]
+        reports += [
+            dict(
+                uuid=reports[0]["uuid"], sequence=sequence, changed={"cpu_ratio": value}
+            )
+            for sequence, value in [(2, 1.0), (3, 2.0), (3, 2.0), (5, 4.0)]
+        ]
+        response = tier1.test_client().post("/api/v1/cloudlets/bulk/", json=reports)
+        statuses = [result["status"] for result in response.json]
+        assert statuses == [204, 204, 204, 204, 409]
+        cloudlet = tier1.config["cloudlets"][UUID(reports[0]["uuid"])]
+        assert cloudlet.sequence == 3
+        assert cloudlet.resources["cpu_ratio"] == 2.0
+
+    def test_msgpack(self, tier1):
+        msgpack = pytest.importorskip("msgpack")
+        reports = self.reports()
+        response = tier1.test_client().post(
+            "/api/v1/cloudlets/bulk/",
+            data=msgpack.packb(reports),
+            content_type="application/msgpack",
+        )
+        self.check(tier1, reports, response)
+
+        response = tier1.test_client().post(
+            "/api/v1/cloudlets/bulk/",
+            data=b"\xc1",
+            content_type="application/msgpack",
+        )
+        assert response.status_code == 400
+
+
+class TestDeployBatch:
+    def test_unknown_recipe(self, tier1, tier2, good_uuid, example_wgkey):
+        add_cloudlet(tier1.config["cloudlets"], tier2, "fast-0")
+        unknown = uuid4()
+        batch = [
+            dict(uuid=str(uuid), application_key=example_wgkey, client_ip="128.2.0.1")
+            for uuid in [good_uuid, unknown, good_uuid]
+        ]
+
+        response = tier1.test_client().post("/api/v1/deploy-batch/", json=batch)
+        assert response.status_code == 200
+        assert [result["status"] for result in response.json] == [
+            "deployed",
+            "invalid",
+            "deployed",
+        ]
+        assert response.json[1]["uuid"] == str(unknown)
+
+
+class TestDeployHedged:
+    @pytest.fixture
+    def app(self):
+        app = Flask("test")
+        app.config["executor"] = ThreadPoolExecutor(8)
+        app.config["cloudlets"] = CloudletRegistry()
+        yield app
+        app.config["executor"].shutdown(wait=True)
+
+    def deploy(self, app, tier2, example_wgkey, names, wanted=1):
+        registry = app.config["cloudlets"]
+        candidates = [
+            Cloudlet.new(
+                uuid=uuid4(),
+                endpoint=URL(f"{tier2}/{name}/api/v1/deploy"),
+                name=name,
+                locations=[],
+                local_networks=[],
+                resources={},
+            )
+            for name in names
+        ]
+        for cloudlet in candidates:
+            registry[cloudlet.uuid] = cloudlet
+
+        client_info = ClientInfo(example_wgkey, ip_address("128.2.0.1"), None, {})
+        with app.app_context():
+            responses = deploy_hedged(
+                registry, candidates, uuid4(), client_info, wanted, 95.0, 0.2
+            )
+        app.config["executor"].shutdown(wait=True)
+        return [
+            deployment["cloudlet"]
+            for deployments in responses
+            for deployment in deployments
+        ]
+
+    def test_fast(self, app, tier2, example_wgkey):
+        assert self.deploy(app, tier2, example_wgkey, ["fast-0", "spare-0"]) == [
+            "fast-0"
+        ]
+        assert Tier2Handler.deleted == []
+
+    def test_slow(self, app, tier2, example_wgkey):
+        # the spare wins, the deployment on the slow cloudlet is removed
+        assert self.deploy(app, tier2, example_wgkey, ["slow-1", "spare-0"]) == [
+            "spare-0"
+        ]
+        assert Tier2Handler.deleted == ["slow-1"]
+
+    def test_failing(self, app, tier2, example_wgkey):
+        assert self.deploy(app, tier2, example_wgkey, ["failing-0", "spare-0"]) == [
+            "spare-0"
+        ]
+        assert Tier2Handler.deleted == []
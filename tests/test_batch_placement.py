@@ -0,0 +1,142 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from collections import Counter
+from io import StringIO
+from ipaddress import ip_address
+
+import pytest
+
+from sinfonia import cloudlets
+from sinfonia.batch_placement import place_batch
+from sinfonia.client_info import ClientInfo
+from sinfonia.deployment_recipe import DeploymentRecipe
+from sinfonia.geo_location import GeoLocation
+from sinfonia.matchers import (
+    match_balance_cpu,
+    match_by_location,
+    match_by_network,
+    match_random,
+)
+from sinfonia.registry import CloudletRegistry
+
+CLOUDLETS = """\
+name: small
+endpoint: http://localhost/api/v1/deploy
+resources: {cpu_avail: 4, mem_avail: 4, disk_avail: 4, cpu_used: 0, mem_used: 0}
+---
+name: large
+endpoint: http://localhost/api/v1/deploy
+resources: {cpu_avail: 8, mem_avail: 8, disk_avail: 8, cpu_used: 0, mem_used: 0}
+---
+name: campus
+endpoint: http://localhost/api/v1/deploy
+local_networks: [128.2.0.0/16]
+accepted_clients: [128.2.0.0/16]
+resources: {cpu_avail: 2, mem_avail: 2, disk_avail: 2, cpu_used: 0, mem_used: 0}
+"""
+
+NEARBY = """\
+name: far
+endpoint: http://localhost/api/v1/deploy
+locations: [[37.8, -122.4]]
+resources: {cpu_avail: 8, mem_avail: 8, disk_avail: 8, cpu_used: 0, mem_used: 0}
+---
+name: near
+endpoint: http://localhost/api/v1/deploy
+locations: [[40.4, -80.0]]
+resources: {cpu_avail: 8, mem_avail: 8, disk_avail: 8, cpu_used: 0, mem_used: 0}
+"""
+
+UNEVEN = """\
+name: a
+endpoint: http://localhost/api/v1/deploy
+resources: {cpu_avail: 4, mem_avail: 4, disk_avail: 4, cpu_used: 0, mem_used: 0}
+---
+name: b
+endpoint: http://localhost/api/v1/deploy
+resources: {cpu_avail: 3, mem_avail: 4, disk_avail: 4, cpu_used: 0, mem_used: 0}
+---
+name: c
+endpoint: http://localhost/api/v1/deploy
+resources: {cpu_avail: 2, mem_avail: 4, disk_avail: 4, cpu_used: 0, mem_used: 0}
+"""
+
+MATCHERS = [match_by_network, match_by_location, match_random]
+
+
+class TestBatchPlacement:
+    @pytest.fixture
+    def registry(self, flask_app):
+        with flask_app.app_context():
+            return CloudletRegistry(cloudlets.load(StringIO(CLOUDLETS)))
+
+    @pytest.fixture
+    def recipe(self, repository, good_uuid):
+        return DeploymentRecipe.from_repo(repository, good_uuid)
+
+    def client(self, wgkey, address="1.1.1.1", location=None, **reqs):
+        return ClientInfo(wgkey, ip_address(address), location, reqs)
+
+    def placed(self, clients, registry, recipe, matchers=MATCHERS):
+        return [
+            None if cloudlet is None else cloudlet.name
+            for cloudlet in place_batch(
+                matchers, [(recipe, client) for client in clients], registry
+            )
+        ]
+
+    def test_balanced(self, registry, recipe, example_wgkey):
+        clients = [self.client(example_wgkey, cpu=1, mem=1) for _ in range(12)]
+        placed = self.placed(clients, registry, recipe)
+        assert Counter(placed) == {"small": 4, "large": 8}
+
+        # batch does not fit
+        clients.append(self.client(example_wgkey, cpu=1))
+        assert self.placed(clients, registry, recipe).count(None) == 1
+
+    def test_largest_first(self, registry, recipe, example_wgkey):
+        clients = [self.client(example_wgkey, cpu=1) for _ in range(4)]
+        clients.append(self.client(example_wgkey, cpu=8))
+        placed = self.placed(clients, registry, recipe)
+        assert placed[-1] == "large"
+        assert placed[:4] == ["small"] * 4
+
+    def test_networks(self, registry, recipe, example_wgkey):
+        local = [self.client(example_wgkey, "128.2.0.1", cpu=1) for _ in range(3)]
+        placed = self.placed(
+            local + [self.client(example_wgkey, cpu=1)], registry, recipe
+        )
+        assert placed[:2] == ["campus", "campus"]
+        assert placed[2] != "campus" and placed[3] != "campus"
+
+    def test_location(self, flask_app, recipe, example_wgkey):
+        with flask_app.app_context():
+            registry = CloudletRegistry(cloudlets.load(StringIO(NEARBY)))
+
+        # nearest cloudlet first, like the match functions for a single deploy
+        pittsburgh = GeoLocation(40.44, -79.99)
+        clients = [
+            self.client(example_wgkey, location=pittsburgh, cpu=1) for _ in range(10)
+        ]
+        assert self.placed(clients, registry, recipe) == ["near"] * 8 + ["far"] * 2
+
+    def test_spread(self, flask_app, recipe, example_wgkey):
+        with flask_app.app_context():
+            registry = CloudletRegistry(cloudlets.load(StringIO(UNEVEN)))
+
+        # the balancing matcher is scored again after every placement
+        matchers = [match_by_network, match_balance_cpu]
+        clients = [self.client(example_wgkey, cpu=1) for _ in range(8)]
+        placed = self.placed(clients, registry, recipe, matchers)
+        assert Counter(placed) == {"a": 3, "b": 3, "c": 2}
+
+        # nothing is left unplaced while any cloudlet has room
+        clients.append(self.client(example_wgkey, cpu=1))
+        assert None not in self.placed(clients, registry, recipe, matchers)
+        clients.append(self.client(example_wgkey, cpu=1))
+        assert self.placed(clients, registry, recipe, matchers).count(None) == 1
+
+    def test_empty(self, registry, recipe):
+        assert place_batch(MATCHERS, [], registry) == []
+        assert place_batch(MATCHERS, [], CloudletRegistry()) == []
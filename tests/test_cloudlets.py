@@ -2,10 +2,11 @@
 # SPDX-License-Identifier: MIT
 
 from io import StringIO
-from ipaddress import IPv4Network
+from ipaddress import IPv4Network, ip_interface
 
 import pytest
 from jsonschema import ValidationError
+from yarl import URL
 
 from sinfonia import cloudlets
 from sinfonia.geo_location import GeoLocation
@@ -91,3 +92,60 @@ locations:
             for config in failures:
                 with pytest.raises(ValidationError):
                     self.load(config)
+
+
+class TestResolverCache:
+    def test_cached(self, flask_app, monkeypatch):
+        lookups = []
+
+        def getaddrinfo(host, port):
+            lookups.append(host)
+            return [ip_interface("128.2.0.1")]
+
+        monkeypatch.setattr(cloudlets, "getaddrinfo", getaddrinfo)
+        resolver = cloudlets.ResolverCache()
+        with flask_app.app_context():
+            assert resolver.addresses("cloudlet", 80) == [ip_interface("128.2.0.1")]
+            assert resolver.locations("cloudlet", 80) == [
+                GeoLocation(40.4439, -79.9561)
+            ]
+            resolver.addresses("cloudlet", 80)
+            assert lookups == ["cloudlet"]
+
+            resolver.ttl = 0.0
+            resolver.clear()
+            resolver.addresses("cloudlet", 80)
+            resolver.addresses("cloudlet", 80)
+            assert lookups == ["cloudlet"] * 3
+
+    def test_reported_unchanged(self, flask_app):
+        report = {
+            "uuid": "00000000-0000-0000-0000-000000000000",
+            "endpoint": "http://128.2.0.1/api/v1/deploy",
+            "locations": [[40.4439, -79.9444]],
+            "resources": {"cpu_ratio": 0.5},
+        }
+        with flask_app.app_context():
+            cloudlet = cloudlets.Cloudlet.new_from_api(report)
+            assert cloudlet.reported_unchanged(dict(report, resources={}))
+            assert not cloudlet.reported_unchanged(dict(report, locations=[]))
+            assert not cloudlet.reported_unchanged(
+                dict(report, rejected_clients=["10.0.0.0/8"])
+            )
+
+            # endpoints of newer api versions are downgraded to v1
+            report["endpoint"] = "http://128.2.0.1/api/v2/deploy"
+            cloudlet = cloudlets.Cloudlet.new_from_api(report)
+            assert cloudlet.endpoint == URL("http://128.2.0.1/api/v1/deploy")
+            assert cloudlet.reported_unchanged(dict(report, resources={}))
+            assert not cloudlet.reported_unchanged(
+                dict(report, endpoint="http://128.2.0.2/api/v2/deploy")
+            )
+
+
+class TestInternNetwork:
+    def test_shared(self):
+        network = cloudlets.intern_network("10.0.0.1/8")
+        assert network == IPv4Network("10.0.0.0/8")
+        assert cloudlets.intern_network(IPv4Network("10.0.0.0/8")) is network
+        assert cloudlets.intern_network("10.0.0.0/16") is not network
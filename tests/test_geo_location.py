@@ -63,3 +63,24 @@ class TestGeoLocation:
         location2 = GeoLocation(52.3556, 4.9135)
         assert int(location1 - location2) == 6274
         assert int(location2 - location1) == 6274
+
+    def test_distances(self):
+        location = GeoLocation(40.4439, -79.9561)
+        coordinates = [(52.3556, 4.9135), (40.4439, -79.9561), (-33.8688, 151.2093)]
+        expected = [location - GeoLocation.from_tuple(coord) for coord in coordinates]
+
+        haversine = location.distances(coordinates)
+        assert haversine.shape == (3,)
+        assert haversine[1] == 0.0
+        for distance, geodesic in zip(haversine, expected):
+            assert abs(distance - geodesic) <= 0.005 * geodesic
+
+        ellipsoidal = location.distances(coordinates, method="ellipsoidal")
+        assert int(ellipsoidal[0]) == 6274
+        assert ellipsoidal[1] == 0.0
+        for distance, geodesic in zip(ellipsoidal, expected):
+            assert abs(distance - geodesic) <= 0.0001 * geodesic
+
+        assert location.distances([]).shape == (0,)
+        with pytest.raises(ValueError):
+            location.distances(coordinates, method="flat")
@@ -1,12 +1,15 @@
 # Copyright (c) 2022 Carnegie Mellon University
 # SPDX-License-Identifier: MIT
 
+import math
 from io import StringIO
+from ipaddress import ip_address
 from pathlib import Path
 
 import pytest
 
 from sinfonia import cloudlets
+from sinfonia.candidates import Candidates
 from sinfonia.client_info import ClientInfo
 from sinfonia.deployment_recipe import DeploymentRecipe
 from sinfonia.matchers import (
@@ -14,11 +17,14 @@ from sinfonia.matchers import (
     match_by_network,
     match_random,
     match_resources,
-    match_best_cpu, 
+    match_best_cpu,
     match_best_cpu_mem,
     match_balance_cpu_mem,
     match_balance_cpu,
     match_balance_mem,
+    match_power_of_two,
+    match_weighted,
+    power_of_choices,
     tier1_best_match,
 )
 
@@ -123,11 +129,34 @@ class TestMatchers:
                 "endpoint: http://localhost/api/v1/deploy\n"
                 "local_networks: [128.2.0.0/16]\n"
             )
-            cloudlets = all_cloudlets[:]
+            cloudlets = Candidates(all_cloudlets)
             cloudlet = next(match_by_network(client_info, deployment_recipe, cloudlets))
             assert cloudlet == all_cloudlets[0]
             assert len(cloudlets) == 0
 
+    def test_by_network_acl(self, deployment_recipe, flask_app, example_wgkey):
+        with flask_app.app_context():
+            client_info = ClientInfo.from_address(example_wgkey, "128.2.0.1")
+            cloudlets = Candidates(
+                self.load(
+                    "name: rejecting\n"
+                    "endpoint: http://localhost/api/v1/deploy\n"
+                    "local_networks: [128.2.0.0/16]\n"
+                    "rejected_clients: [128.2.0.0/24]\n"
+                    "---\n"
+                    "name: restricted\n"
+                    "endpoint: http://localhost/api/v1/deploy\n"
+                    "accepted_clients: [10.0.0.0/8]\n"
+                    "---\n"
+                    "name: open\n"
+                    "endpoint: http://localhost/api/v1/deploy\n"
+                )
+            )
+            assert (
+                list(match_by_network(client_info, deployment_recipe, cloudlets)) == []
+            )
+            assert [cloudlet.name for cloudlet in cloudlets] == ["open"]
+
     def test_by_location(
         self, aws_cloudlets, deployment_recipe, flask_app, example_wgkey
     ):
@@ -137,7 +166,7 @@ class TestMatchers:
                     example_wgkey,
                     address,
                 )
-                cloudlets = aws_cloudlets[:]
+                cloudlets = Candidates(aws_cloudlets)
                 nearest = [
                     cloudlet.name
                     for cloudlet in match_by_location(
@@ -150,7 +179,7 @@ class TestMatchers:
     def test_random(self, aws_cloudlets, deployment_recipe, flask_app, example_wgkey):
         with flask_app.app_context():
             client_info = ClientInfo.from_address(example_wgkey, "128.2.0.1")
-            cloudlets = aws_cloudlets[:]
+            cloudlets = Candidates(aws_cloudlets)
             for cloudlet in match_random(client_info, deployment_recipe, cloudlets):
                 assert cloudlet in aws_cloudlets
                 assert cloudlet not in cloudlets
@@ -173,3 +202,150 @@ class TestMatchers:
                     )
                 ]
                 assert nearest == nearby
+
+    def test_list_matcher(
+        self, aws_cloudlets, deployment_recipe, flask_app, example_wgkey
+    ):
+        def match_first_and_drop_last(_client_info, _deployment_recipe, cloudlets):
+            """match function written for the original list based interface"""
+            cloudlets.pop()
+            yield cloudlets.pop(0)
+
+        matchers = [match_first_and_drop_last, match_first_and_drop_last, match_random]
+        with flask_app.app_context():
+            client_info = ClientInfo.from_address(example_wgkey, "128.2.0.1")
+            candidates = Candidates(aws_cloudlets)
+            matched = list(
+                tier1_best_match(matchers, client_info, deployment_recipe, candidates)
+            )
+            assert matched[:2] == aws_cloudlets[:2]
+            assert sorted(matched[2:], key=aws_cloudlets.index) == aws_cloudlets[2:-2]
+            assert matched == candidates.yielded
+            assert len(candidates) == 0
+
+    RESOURCES = """\
+name: busy
+endpoint: http://localhost/api/v1/deploy
+resources: {cpu_avail: 4, mem_avail: 4, disk_avail: 4, cpu_used: 12, mem_used: 1}
+---
+name: idle
+endpoint: http://localhost/api/v1/deploy
+resources: {cpu_avail: 16, mem_avail: 4, disk_avail: 4, cpu_used: 0, mem_used: 3}
+---
+name: full
+endpoint: http://localhost/api/v1/deploy
+resources: {cpu_avail: 0, mem_avail: 0, disk_avail: 0, cpu_used: 16, mem_used: 4}
+---
+name: unknown
+endpoint: http://localhost/api/v1/deploy
+"""
+
+    def match_resources(
+        self, matcher, flask_app, deployment_recipe, example_wgkey, limit=None
+    ):
+        with flask_app.app_context():
+            client_info = ClientInfo(
+                example_wgkey,
+                ip_address("128.2.0.1"),
+                None,
+                {"cpu": 2, "mem": 1, "disk": 1},
+            )
+            cloudlets = Candidates(self.load(self.RESOURCES), limit=limit)
+            matched = [
+                cloudlet.name
+                for cloudlet in matcher(client_info, deployment_recipe, cloudlets)
+            ]
+            assert len(cloudlets) == 0
+            return matched
+
+    def test_resources(self, flask_app, deployment_recipe, example_wgkey):
+        args = (flask_app, deployment_recipe, example_wgkey)
+        assert self.match_resources(match_resources, *args) == ["busy"]
+        assert self.match_resources(match_best_cpu, *args) == ["busy", "idle"]
+        assert self.match_resources(match_best_cpu_mem, *args) == ["busy", "idle"]
+        assert self.match_resources(match_balance_cpu, *args) == ["idle"]
+        assert self.match_resources(match_balance_mem, *args) == ["busy", "idle"]
+        assert self.match_resources(match_balance_cpu_mem, *args) == ["idle", "busy"]
+
+    def test_resources_limit(self, flask_app, deployment_recipe, example_wgkey):
+        args = (flask_app, deployment_recipe, example_wgkey)
+        assert self.match_resources(match_best_cpu, *args, limit=1) == ["busy"]
+        assert self.match_resources(match_balance_mem, *args, limit=1) == ["busy"]
+        assert self.match_resources(match_balance_cpu_mem, *args, limit=0) == []
+
+    def test_weighted(self, flask_app, deployment_recipe, example_wgkey):
+        args = (flask_app, deployment_recipe, example_wgkey)
+        try:
+            flask_app.config["MATCHER_WEIGHTS"] = {"cpu": 1.0}
+            assert self.match_resources(match_weighted, *args) == ["idle", "busy"]
+            flask_app.config["MATCHER_WEIGHTS"] = {"mem": 1.0, "net": 1.0}
+            assert self.match_resources(match_weighted, *args) == ["busy", "idle"]
+
+            # bad weights picked up by the settings reload are skipped
+            flask_app.config["MATCHER_WEIGHTS"] = {"cpu": "high", "mem": 1.0}
+            assert self.match_resources(match_weighted, *args) == ["busy", "idle"]
+            flask_app.config["MATCHER_WEIGHTS"] = {"cpu": None, "mem": math.inf}
+            assert sorted(self.match_resources(match_weighted, *args)) == [
+                "busy",
+                "idle",
+            ]
+            flask_app.config["MATCHER_WEIGHTS"] = ["cpu"]
+            assert self.match_resources(match_weighted, *args, limit=1) == ["busy"]
+        finally:
+            del flask_app.config["MATCHER_WEIGHTS"]
+
+        assert self.match_resources(match_weighted, *args, limit=1) == ["busy"]
+
+    def test_power_of_choices(self, flask_app, deployment_recipe, example_wgkey):
+        args = (flask_app, deployment_recipe, example_wgkey)
+        matched = self.match_resources(match_power_of_two, *args)
+        assert sorted(matched) == ["busy", "idle"]
+
+        # comparing all candidates gives the same order as balance_cpu_mem
+        match_all = power_of_choices(4)
+        assert self.match_resources(match_all, *args) == ["idle", "busy"]
+
+        with pytest.raises(ValueError):
+            power_of_choices(scope="unknown")
+
+    def test_power_of_choices_scope(self, flask_app, deployment_recipe, example_wgkey):
+        with flask_app.app_context():
+            client_info = ClientInfo(
+                example_wgkey,
+                ip_address("128.2.0.1"),
+                None,
+                {"cpu": 2, "mem": 1, "disk": 1},
+            )
+            candidates = Candidates(
+                self.load(self.RESOURCES + "local_networks: [128.2.0.0/16]\n"),
+                limit=2,
+            )
+            matcher = power_of_choices(4, scope="network")
+            matched = [
+                cloudlet.name
+                for cloudlet in tier1_best_match(
+                    [matcher, match_power_of_two],
+                    client_info,
+                    deployment_recipe,
+                    candidates,
+                )
+            ]
+            # only unknown is local but it did not report any resources
+            assert sorted(matched) == ["busy", "idle"]
+            assert "unknown" not in [cloudlet.name for cloudlet in candidates]
+
+    def test_tier1_best_match_limit(
+        self, aws_cloudlets, deployment_recipe, flask_app, example_wgkey
+    ):
+        matchers = [match_by_location, match_random]
+        with flask_app.app_context():
+            client_info = ClientInfo.from_address(example_wgkey, "128.2.0.1")
+            candidates = Candidates(aws_cloudlets)
+            nearest = [
+                cloudlet.name
+                for cloudlet in tier1_best_match(
+                    matchers, client_info, deployment_recipe, candidates, limit=3
+                )
+            ]
+            assert nearest == self.NEARBY["128.2.0.1"][:3]
+            assert candidates.wanted == 0
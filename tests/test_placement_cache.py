@@ -0,0 +1,128 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from io import StringIO
+from ipaddress import ip_address
+from uuid import uuid4
+
+import attrs
+import numpy as np
+import pendulum
+import pytest
+
+from sinfonia import cloudlets
+from sinfonia.client_info import ClientInfo
+from sinfonia.placement_cache import PlacementCache, quantize
+from sinfonia.registry import CloudletRegistry
+from sinfonia.resource_matrix import requirements
+
+CLOUDLETS = """\
+name: open
+endpoint: http://localhost/api/v1/deploy
+---
+name: restricted
+endpoint: http://localhost/api/v1/deploy
+accepted_clients: [128.2.0.0/25]
+"""
+
+
+class TestPlacementCache:
+    @pytest.fixture
+    def registry(self, flask_app):
+        with flask_app.app_context():
+            return CloudletRegistry(cloudlets.load(StringIO(CLOUDLETS)))
+
+    def client(self, wgkey, address, **reqs):
+        return ClientInfo(wgkey, ip_address(address), None, reqs)
+
+    def test_quantize(self):
+        assert quantize(np.array([0.0, 1.0, 1.1, 3.0])) == (0.0, 1.0, 1.125, 3.0)
+
+    def test_cache(self, registry, example_wgkey):
+        cache = PlacementCache(maxsize=2)
+        recipe = uuid4()
+        placement = list(registry.values())
+
+        client = self.client(example_wgkey, "128.2.0.1", cpu=1.05)
+        key = cache.key(client, recipe, registry)
+        assert cache.get(key, client, registry) is None
+        cache.put(key, placement)
+
+        # same network and similar requirements
+        neighbour = self.client(example_wgkey, "128.2.0.2", cpu=1.1)
+        assert cache.key(neighbour, recipe, registry) == key
+        assert cache.get(key, neighbour, registry) == placement
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # same /24, but not accepted by the restricted cloudlet
+        outsider = self.client(example_wgkey, "128.2.0.200", cpu=1.1)
+        assert cache.key(outsider, recipe, registry) == key
+        assert cache.get(key, outsider, registry) is None
+
+        for other in [
+            self.client(example_wgkey, "128.2.1.1", cpu=1.0),
+            self.client(example_wgkey, "128.2.0.1", cpu=2.0),
+        ]:
+            assert cache.key(other, recipe, registry) != key
+        assert cache.key(client, uuid4(), registry) != key
+
+    def test_invalidate(self, registry, example_wgkey):
+        cache = PlacementCache()
+        client = self.client(example_wgkey, "128.2.0.1")
+        recipe = uuid4()
+
+        key = cache.key(client, recipe, registry)
+        cache.put(key, registry.values())
+
+        cloudlet = next(iter(registry.values()))
+        registry[cloudlet.uuid] = attrs.evolve(cloudlet, resources={"cpu_used": 1})
+        updated = cache.key(client, recipe, registry)
+        assert updated != key
+        assert cache.get(updated, client, registry) is None
+
+        # a placement computed before the update is not stored
+        cache.put(updated, registry.values())
+        cache.put(key, registry.values())
+        assert len(cache) == 1
+        assert cache.get(key, client, registry) is None
+
+    def test_heartbeats(self, registry, example_wgkey):
+        cache = PlacementCache()
+        client = self.client(example_wgkey, "128.2.0.1", cpu=1.0)
+        recipe = uuid4()
+        cloudlet = next(iter(registry.values()))
+        resources = dict(cpu_avail=4.0, mem_avail=4.0, disk_avail=4.0)
+        registry.report(cloudlet.uuid, resources, pendulum.now())
+
+        key = cache.key(client, recipe, registry)
+        cache.put(key, [cloudlet])
+
+        # reports and deployments change the load and so the placement
+        registry.report(cloudlet.uuid, resources, pendulum.now())
+        heartbeat = cache.key(client, recipe, registry)
+        assert heartbeat != key
+        assert cache.get(heartbeat, client, registry) is None
+
+        registry.resources.reserve(cloudlet.uuid, requirements({"cpu": 1.0}))
+        reserved = cache.key(client, recipe, registry)
+        assert reserved not in (key, heartbeat)
+        assert cache.get(reserved, client, registry) is None
+
+        # placements for the older versions are dropped and not stored again
+        cache.put(reserved, [cloudlet])
+        cache.put(key, [cloudlet])
+        assert len(cache) == 1
+        assert cache.get(key, client, registry) is None
+        assert cache.get(reserved, client, registry) == [cloudlet]
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_lru(self, registry, example_wgkey):
+        cache = PlacementCache(maxsize=2)
+        clients = [self.client(example_wgkey, f"128.2.{n}.1") for n in range(3)]
+        keys = [cache.key(client, uuid4(), registry) for client in clients]
+        cache.put(keys[0], [])
+        cache.put(keys[1], [])
+        assert cache.get(keys[0], clients[0], registry) == []
+        cache.put(keys[2], [])
+        assert cache.get(keys[1], clients[1], registry) is None
+        assert cache.get(keys[0], clients[0], registry) == []
@@ -0,0 +1,73 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+import random
+from ipaddress import IPv4Address, IPv4Network, IPv6Network, ip_address
+from uuid import uuid4
+
+from sinfonia.prefix_trie import NetworkIndex, PrefixTrie
+
+
+class TestPrefixTrie:
+    def test_lookup(self):
+        rng = random.Random(42)
+        networks = [
+            (IPv4Network((rng.getrandbits(32), prefix), strict=False), uuid4())
+            for prefix in (0, 8, 16, 24, 32)
+            for _ in range(20)
+        ]
+        trie = PrefixTrie()
+        for network, key in networks:
+            trie.insert(network, key)
+
+        for network, _ in networks:
+            for address in (network.network_address, network.broadcast_address):
+                expected = {key for net, key in networks if address in net}
+                assert set(trie.lookup(address)) == expected
+
+        for network, key in networks:
+            trie.remove(network, key)
+        assert not trie.lookup(IPv4Address("10.0.0.1"))
+        assert trie._roots[4] == [None, None, {}]
+
+    def test_versions(self):
+        trie = PrefixTrie()
+        v4, v6 = uuid4(), uuid4()
+        trie.insert(IPv4Network("0.0.0.0/0"), v4)
+        trie.insert(IPv6Network("2001:db8::/32"), v6)
+        trie.insert(IPv6Network("2001:db8::/32"), v6)
+        assert trie.lookup(ip_address("128.2.0.1")) == {v4: 1}
+        assert trie.lookup(ip_address("2001:db8::1")) == {v6: 2}
+        assert trie.lookup(ip_address("2001:db9::1")) == {}
+
+
+class TestNetworkIndex:
+    def test_classify(self):
+        index = NetworkIndex()
+        local, restricted, rejecting = uuid4(), uuid4(), uuid4()
+        index.update(local, [IPv4Network("128.2.0.0/16")], [], [])
+        index.update(
+            restricted, [], [IPv4Network("0.0.0.0/0"), IPv4Network("10.0.0.0/8")], []
+        )
+        index.update(rejecting, [], [], [IPv4Network("128.2.0.0/16")])
+
+        client = index.classify(ip_address("128.2.0.1"))
+        assert local in client.local
+        assert rejecting in client.rejected
+        assert client.accepts(local) and client.accepts(rejecting)
+        assert not client.accepts(restricted)
+        assert list(client.refused()) == [restricted]
+
+        client = index.classify(ip_address("10.0.0.1"))
+        assert not client.local and not client.rejected
+        assert client.accepts(restricted)
+        assert list(client.refused()) == []
+
+        client = index.classify(ip_address("2001:db8::1"))
+        assert not client.accepts(restricted)
+
+        index.update(restricted, [], [], [])
+        index.remove(local)
+        client = index.classify(ip_address("128.2.0.1"))
+        assert not client.local
+        assert client.accepts(restricted)
@@ -0,0 +1,144 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from io import StringIO
+from uuid import uuid4
+
+import attrs
+import pendulum
+from yarl import URL
+
+from sinfonia import cloudlets
+from sinfonia.candidates import Candidates
+from sinfonia.cloudlets import Cloudlet
+from sinfonia.registry import CloudletRegistry
+from sinfonia.resource_matrix import COLUMN
+
+
+class TestCloudletRegistry:
+    def test_resources(self, flask_app):
+        with flask_app.app_context():
+            cloudlet = cloudlets.load(
+                StringIO(
+                    "endpoint: http://localhost/api/v1/deploy\n"
+                    "resources: {cpu_used: 1.0}\n"
+                )
+            )[0]
+
+        registry = CloudletRegistry([cloudlet])
+        assert list(registry.values()) == [cloudlet]
+        assert registry.resources.take([cloudlet.uuid])[0, COLUMN["cpu_used"]] == 1.0
+
+        updated = attrs.evolve(cloudlet, resources={"cpu_used": 2.0})
+        registry[updated.uuid] = updated
+        assert len(registry) == 1
+        assert registry.resources.take([cloudlet.uuid])[0, COLUMN["cpu_used"]] == 2.0
+
+        assert registry.pop(cloudlet.uuid) == updated
+        assert len(registry) == 0
+        assert cloudlet.uuid not in registry.resources
+
+    def test_expire(self):
+        now = pendulum.now()
+        reporting, static = [
+            Cloudlet.new(
+                uuid=uuid4(),
+                endpoint=URL(f"http://{name}.example.com/api/v1/deploy"),
+                locations=[],
+                local_networks=[],
+                last_update=last_update,
+            )
+            for name, last_update in [("reporting", now), ("static", None)]
+        ]
+        registry = CloudletRegistry([reporting, static])
+        assert registry.expire(now.timestamp()) == []
+
+        # a later report postpones expiration
+        updated = attrs.evolve(reporting, last_update=now.add(seconds=10))
+        registry[updated.uuid] = updated
+        assert registry.expire(now.timestamp() + 5) == []
+
+        assert registry.expire(now.timestamp() + 20) == [updated]
+        assert list(registry) == [static.uuid]
+        assert registry.expire(now.timestamp() + 30) == []
+
+    def test_report(self):
+        cloudlet = Cloudlet.new(
+            uuid=uuid4(),
+            endpoint=URL("http://reporting.example.com/api/v1/deploy"),
+            locations=[],
+            local_networks=[],
+            resources={"cpu_used": 1.0},
+            last_update=pendulum.now(),
+        )
+        registry = CloudletRegistry([cloudlet])
+        version = registry.version
+
+        last_update = pendulum.from_timestamp(pendulum.now().timestamp() + 5)
+        registry.report(cloudlet.uuid, {"cpu_used": 2.0}, last_update)
+        assert registry[cloudlet.uuid] is cloudlet
+        assert cloudlet.resources == {"cpu_used": 2.0}
+        assert cloudlet.last_update == last_update
+        assert registry.resources.take([cloudlet.uuid])[0, COLUMN["cpu_used"]] == 2.0
+        assert registry.version > version
+        assert registry.expire(last_update.timestamp()) == []
+
+    def test_apply_delta(self):
+        cloudlet = Cloudlet.new(
+            uuid=uuid4(),
+            endpoint=URL("http://reporting.example.com/api/v1/deploy"),
+            locations=[],
+            local_networks=[],
+            resources={"cpu_used": 1.0, "gpu_ratio": 0.5},
+            last_update=pendulum.now(),
+        )
+        registry = CloudletRegistry([cloudlet])
+        now = pendulum.now()
+
+        # deltas need a full report with a sequence number first
+        assert not registry.apply_delta(cloudlet.uuid, 1, {"cpu_used": 2.0}, [], now)
+        registry.report(cloudlet.uuid, cloudlet.resources, now, sequence=0)
+
+        assert registry.apply_delta(
+            cloudlet.uuid, 1, {"cpu_used": 2.0}, ["gpu_ratio"], now
+        )
+        assert cloudlet.resources == {"cpu_used": 2.0}
+        assert registry.resources.take([cloudlet.uuid])[0, COLUMN["cpu_used"]] == 2.0
+
+        # retransmissions are ignored, gaps and unknown cloudlets are refused
+        assert registry.apply_delta(cloudlet.uuid, 1, {"cpu_used": 3.0}, [], now)
+        assert not registry.apply_delta(cloudlet.uuid, 3, {"cpu_used": 3.0}, [], now)
+        assert not registry.apply_delta(uuid4(), 1, {"cpu_used": 3.0}, [], now)
+        assert cloudlet.resources == {"cpu_used": 2.0}
+        assert cloudlet.sequence == 1
+
+    def test_snapshot(self):
+        reporting, static = [
+            Cloudlet.new(
+                uuid=uuid4(),
+                endpoint=URL(f"http://{name}.example.com/api/v1/deploy"),
+                locations=[],
+                local_networks=[],
+                resources={"cpu_used": 1.0},
+                last_update=pendulum.now(),
+            )
+            for name in ["reporting", "static"]
+        ]
+        registry = CloudletRegistry([reporting, static])
+        snapshot = registry.snapshot()
+        assert snapshot.cloudlets == (reporting, static)
+        assert snapshot.positions[static.uuid] == 1
+
+        # reports do not change the set of cloudlets
+        registry.report(reporting.uuid, {"cpu_used": 2.0}, pendulum.now())
+        assert registry.snapshot() is snapshot
+
+        del registry[static.uuid]
+        assert snapshot.cloudlets == (reporting, static)
+        assert registry.snapshot().cloudlets == (reporting,)
+
+        candidates = Candidates(registry.snapshot(), registry)
+        candidates.discard(reporting)
+        assert len(candidates) == 0
+        assert list(candidates) == []
+        assert registry.snapshot().by_uuid[reporting.uuid] is reporting
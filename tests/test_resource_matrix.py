@@ -0,0 +1,176 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from uuid import uuid4
+
+import numpy as np
+
+from sinfonia.resource_matrix import (
+    AVAILABLE,
+    COLUMN,
+    USED,
+    ResourceMatrix,
+    Resources,
+    feasible,
+    load_norm,
+    requirements,
+    top_k,
+    weighted_score,
+)
+
+
+class TestResourceMatrix:
+    def test_update(self):
+        matrix = ResourceMatrix(capacity=2)
+        uuids = [uuid4() for _ in range(5)]
+        for n, uuid in enumerate(uuids):
+            matrix.update(uuid, {"cpu_used": float(n), "unknown": 1.0})
+        assert len(matrix) == 5
+
+        values = matrix.take(reversed(uuids))
+        assert values.shape == (5, len(COLUMN))
+        assert list(values[:, COLUMN["cpu_used"]]) == [4.0, 3.0, 2.0, 1.0, 0.0]
+        assert np.isnan(values[:, COLUMN["mem_used"]]).all()
+
+        matrix.update(uuids[0], {"cpu_used": 10.0})
+        assert matrix.take([uuids[0]])[0, COLUMN["cpu_used"]] == 10.0
+
+    def test_remove(self):
+        matrix = ResourceMatrix()
+        uuid, other = uuid4(), uuid4()
+        matrix.update(uuid, {"cpu_used": 1.0})
+        matrix.remove(uuid)
+        assert uuid not in matrix
+        assert np.isnan(matrix.take([uuid])).all()
+
+        # freed rows are reused
+        matrix.update(other, {"mem_used": 2.0})
+        values = matrix.take([uuid, other])
+        assert np.isnan(values[0]).all()
+        assert values[1, COLUMN["mem_used"]] == 2.0
+        assert np.isnan(values[1, COLUMN["cpu_used"]])
+
+    def test_reservations(self):
+        matrix = ResourceMatrix(reservation_settle=10.0, reservation_timeout=60.0)
+        uuid, other = uuid4(), uuid4()
+        report = dict(cpu_avail=4.0, mem_avail=4.0, disk_avail=4.0, cpu_used=1.0)
+        matrix.update(uuid, report, now=0.0)
+        matrix.update(other, report, now=0.0)
+
+        reqs = requirements({"cpu": 1.0, "mem": 2.0})
+        matrix.reserve(uuid, reqs, now=1.0)
+        failed = matrix.reserve(uuid, reqs, now=2.0)
+        values = matrix.take([uuid, other], now=3.0)
+        assert list(values[0, AVAILABLE]) == [2.0, 0.0, 4.0]
+        assert values[0, COLUMN["cpu_used"]] == 3.0
+        assert list(values[1, AVAILABLE]) == [4.0, 4.0, 4.0]
+
+        matrix.release(failed)
+        matrix.release(failed)
+        assert list(matrix.take([uuid], now=3.0)[0, AVAILABLE]) == [3.0, 2.0, 4.0]
+
+        # a report that is too recent to include the deployment keeps it
+        matrix.reserve(uuid, reqs, now=15.0)
+        matrix.update(uuid, report, now=5.0)
+        assert list(matrix.take([uuid], now=5.0)[0, AVAILABLE]) == [2.0, 0.0, 4.0]
+        matrix.update(uuid, report, now=20.0)
+        assert list(matrix.take([uuid], now=20.0)[0, AVAILABLE]) == [3.0, 2.0, 4.0]
+
+        # reservations on cloudlets that stop reporting eventually time out
+        assert list(matrix.take([uuid], now=80.0)[0, AVAILABLE]) == [4.0, 4.0, 4.0]
+
+        # unknown cloudlets and empty requirements are not charged
+        assert matrix.reserve(uuid4(), reqs) is None
+        assert matrix.reserve(uuid, requirements({})) is None
+
+    def test_forecast(self):
+        matrix = ResourceMatrix()
+        rising, steady, single = uuid4(), uuid4(), uuid4()
+        for now in [0.0, 5.0, 10.0]:
+            used = 10.0 + 2.0 * now
+            matrix.update(rising, {"cpu_used": used, "cpu_avail": 100.0 - used}, now)
+            matrix.update(steady, {"cpu_used": 20.0, "cpu_avail": 80.0}, now)
+        matrix.update(single, {"cpu_used": 20.0, "cpu_avail": 80.0}, now=10.0)
+
+        uuids = [rising, steady, single]
+        reported = matrix.take(uuids, now=10.0)
+        assert list(reported[:, COLUMN["cpu_used"]]) == [30.0, 20.0, 20.0]
+
+        # a linear trend is extrapolated without lagging behind
+        values = matrix.take(uuids, horizon=10.0, now=10.0)
+        assert np.allclose(values[:, COLUMN["cpu_used"]], [50.0, 20.0, 20.0])
+        assert np.allclose(values[:, COLUMN["cpu_avail"]], [50.0, 80.0, 80.0])
+        assert np.isnan(values[:, COLUMN["mem_used"]]).all()
+
+        # the forecast never drops below zero
+        for now in [15.0, 20.0]:
+            matrix.update(rising, {"cpu_used": 0.0, "cpu_avail": 100.0}, now)
+        values = matrix.take([rising], horizon=60.0, now=20.0)
+        assert values[0, COLUMN["cpu_used"]] == 0.0
+
+        # history is cleared when a row is reused
+        matrix.remove(rising)
+        reused = uuid4()
+        matrix.update(reused, {"cpu_used": 5.0, "cpu_avail": 95.0}, now=20.0)
+        values = matrix.take([reused], horizon=10.0, now=20.0)
+        assert values[0, COLUMN["cpu_used"]] == 5.0
+
+    def test_scoring(self):
+        matrix = ResourceMatrix()
+        small, large, unknown = uuid4(), uuid4(), uuid4()
+        available = dict(cpu_avail=2.0, mem_avail=2.0, disk_avail=2.0)
+        matrix.update(small, dict(available, cpu_used=3.0, mem_used=4.0))
+        matrix.update(large, dict(available, cpu_avail=8.0, cpu_used=0, mem_used=0))
+        values = matrix.take([small, large, unknown])
+
+        reqs = requirements({"cpu": 1.0, "mem": 2.0})
+        assert list(reqs) == [1.0, 2.0, 0.0]
+        assert list(feasible(values, reqs)) == [True, True, False]
+        assert list(feasible(values, requirements({"cpu": 4.0}))) == [
+            False,
+            True,
+            False,
+        ]
+        assert list(feasible(values, requirements(None))) == [True, True, False]
+
+        assert list(load_norm(values[:2], USED)) == [5.0, 0.0]
+        assert list(load_norm(values[:2], USED[:1], 1.0)) == [4.0, 1.0]
+
+    def test_weighted_score(self):
+        objectives = np.array(
+            [[1.0, np.nan, 5.0], [3.0, np.nan, 5.0], [2.0, np.nan, np.nan]]
+        )
+        scores = weighted_score(objectives, np.array([1.0, 1.0, 2.0]))
+        assert list(scores) == [1.0, 2.0, 3.5]
+        assert len(weighted_score(np.empty((0, 3)), np.ones(3))) == 0
+
+    def test_top_k(self):
+        rng = np.random.default_rng(42)
+        scores = rng.integers(0, 10, 100).astype(float)
+        scores[rng.integers(0, 100, 10)] = np.nan
+
+        for descending in (False, True):
+            ordered = np.argsort(-scores if descending else scores, kind="stable")
+            for k in (0, 1, 5, 50, 95, 100, 200, None):
+                expected = ordered if k is None else ordered[:k]
+                assert list(top_k(scores, k, descending)) == list(expected)
+
+
+class TestResources:
+    def test_mapping(self):
+        resources = Resources({"cpu_used": 1.0, "mem_used": 2, "custom": 3.0})
+        assert resources == {"cpu_used": 1.0, "mem_used": 2.0, "custom": 3.0}
+        assert len(resources) == 3
+        assert resources["custom"] == 3.0
+        assert resources.get("cpu_ratio") is None
+        assert "gpu_ratio" not in resources
+        assert Resources() == {}
+
+        row = resources.row()
+        assert row[COLUMN["cpu_used"]] == 1.0
+        assert np.isnan(row[COLUMN["cpu_ratio"]])
+
+        matrix = ResourceMatrix()
+        uuid = uuid4()
+        matrix.update(uuid, resources)
+        assert np.array_equal(matrix.take([uuid])[0], row, equal_nan=True)
@@ -0,0 +1,78 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from uuid import uuid4
+
+import pytest
+import requests
+
+from sinfonia.sessions import SessionPool
+
+
+class DeployHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        status = 200 if self.path == "/deploy" else 404
+        body = json.dumps([{"path": self.path}]).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tier2():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DeployHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestSessionPool:
+    def test_keep_alive(self, tier2):
+        sessions = SessionPool()
+        uuid = uuid4()
+
+        for _ in range(3):
+            response = sessions.post(uuid, f"{tier2}/deploy")
+            assert response.json() == [{"path": "/deploy"}]
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            sessions.post(uuid, f"{tier2}/unknown")
+
+        stats = sessions.stats()[uuid]
+        assert stats["requests"] == 4
+        assert stats["failures"] == 1
+        assert stats["connections"] == 1
+
+        sessions.remove(uuid)
+        assert len(sessions) == 0
+
+    def test_timeout(self):
+        sessions = SessionPool(connect_timeout=0.5)
+        uuid = uuid4()
+
+        # nothing listens on the discard port
+        with pytest.raises(requests.exceptions.ConnectionError):
+            sessions.post(uuid, "http://127.0.0.1:9/deploy")
+        assert sessions.stats()[uuid]["failures"] == 1
+        sessions.close()
+
+    def test_latency(self, tier2):
+        sessions = SessionPool()
+        uuid = uuid4()
+        assert sessions.latency(uuid, 95.0, 10.0) == 10.0
+
+        for _ in range(8):
+            sessions.post(uuid, f"{tier2}/deploy")
+        assert 0.0 < sessions.latency(uuid, 95.0, 10.0) < 10.0
+        assert "latencies" not in sessions.stats()[uuid]
@@ -0,0 +1,141 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from ipaddress import IPv4Network, ip_address
+from uuid import uuid4
+
+import attrs
+import pendulum
+from yarl import URL
+
+from sinfonia.cloudlets import Cloudlet
+from sinfonia.resource_matrix import COLUMN
+from sinfonia.shared_registry import SharedCloudletRegistry
+
+
+def reporting_cloudlet(last_update, **resources):
+    return Cloudlet.new(
+        uuid=uuid4(),
+        endpoint=URL("http://reporting.example.com/api/v1/deploy"),
+        locations=[],
+        local_networks=[IPv4Network("128.2.0.0/16")],
+        resources=resources,
+        last_update=last_update,
+        sequence=0,
+    )
+
+
+class TestSharedCloudletRegistry:
+    def test_workers(self, tmp_path):
+        database = tmp_path / "registry.sqlite"
+        static = Cloudlet.new(
+            uuid=uuid4(),
+            endpoint=URL("http://static.example.com/api/v1/deploy"),
+            locations=[],
+            local_networks=[],
+        )
+        worker1 = SharedCloudletRegistry(database, [static])
+        worker2 = SharedCloudletRegistry(database)
+        assert list(worker1) == [static.uuid]
+        assert len(worker2) == 0
+
+        now = pendulum.now()
+        cloudlet = reporting_cloudlet(now, cpu_used=1.0)
+        worker1[cloudlet.uuid] = cloudlet
+        worker2.sync()
+        shared = worker2[cloudlet.uuid]
+        assert shared.local_networks == cloudlet.local_networks
+        assert shared.resources == {"cpu_used": 1.0}
+        assert worker2.networks.classify(ip_address("128.2.0.1")).local
+
+        # deltas may arrive at a different worker than the previous report
+        assert worker2.apply_delta(cloudlet.uuid, 1, {"cpu_used": 2.0}, [], now)
+        assert worker1.apply_delta(cloudlet.uuid, 2, {"cpu_used": 3.0}, [], now)
+        assert not worker2.apply_delta(cloudlet.uuid, 4, {"cpu_used": 4.0}, [], now)
+        worker2.sync()
+        values = worker2.resources.take([cloudlet.uuid])
+        assert values[0, COLUMN["cpu_used"]] == 3.0
+
+        del worker2[cloudlet.uuid]
+        worker1.sync()
+        assert list(worker1) == [static.uuid]
+
+    def test_report_many(self, tmp_path):
+        database = tmp_path / "registry.sqlite"
+        static = Cloudlet.new(
+            uuid=uuid4(),
+            endpoint=URL("http://static.example.com/api/v1/deploy"),
+            locations=[],
+            local_networks=[],
+        )
+        worker1 = SharedCloudletRegistry(database, [static])
+        worker2 = SharedCloudletRegistry(database)
+
+        now = pendulum.now()
+        cloudlets = [reporting_cloudlet(now) for _ in range(3)]
+        for cloudlet in cloudlets:
+            worker1[cloudlet.uuid] = cloudlet
+
+        # all shared cloudlets are updated in a single transaction
+        statements: list[str] = []
+        worker1._db.set_trace_callback(lambda statement: statements.append(statement))
+        worker1.report_many(
+            [
+                (cloudlet.uuid, {"cpu_used": float(n)}, now, 1)
+                for n, cloudlet in enumerate(cloudlets)
+            ]
+            + [(static.uuid, {"cpu_used": 4.0}, now, None), (uuid4(), {}, now, None)]
+        )
+        worker1._db.set_trace_callback(None)
+        assert statements.count("BEGIN IMMEDIATE") == 1
+
+        worker2.sync()
+        for n, cloudlet in enumerate(cloudlets):
+            assert worker2[cloudlet.uuid].resources == {"cpu_used": float(n)}
+            assert worker2[cloudlet.uuid].sequence == 1
+        assert worker1[static.uuid].resources == {"cpu_used": 4.0}
+
+    def test_expire(self, tmp_path):
+        database = tmp_path / "registry.sqlite"
+        worker1 = SharedCloudletRegistry(database)
+        worker2 = SharedCloudletRegistry(database)
+
+        now = pendulum.now()
+        cloudlet = reporting_cloudlet(now)
+        worker1[cloudlet.uuid] = cloudlet
+        worker2.sync()
+
+        # only the worker that holds the lease expires cloudlets
+        assert not worker1.holds_expiry_lease()
+        assert worker1.expire(now.timestamp()) == []
+        assert worker1.holds_expiry_lease()
+        assert not worker2.holds_expiry_lease()
+        assert worker2.expire(now.timestamp() + 1) == []
+        assert worker1.expire(now.timestamp() + 1) == [cloudlet]
+        worker2.sync()
+        assert len(worker1) == len(worker2) == 0
+
+        # a cloudlet that reports again is shared again
+        worker2[cloudlet.uuid] = attrs.evolve(cloudlet, last_update=now.add(seconds=2))
+        worker1.sync()
+        assert len(worker1) == 1
+
+    def test_expire_reads(self, tmp_path):
+        database = tmp_path / "registry.sqlite"
+        worker1 = SharedCloudletRegistry(database)
+        worker2 = SharedCloudletRegistry(database)
+
+        now = pendulum.now()
+        cloudlet = reporting_cloudlet(now)
+        worker1[cloudlet.uuid] = cloudlet
+        worker2.sync()
+        assert worker1.expire(now.timestamp()) == []
+
+        # without stale cloudlets or a lease to renew nothing is written
+        changes = worker1._db.total_changes, worker2._db.total_changes
+        assert worker1.expire(now.timestamp()) == []
+        assert worker2.expire(now.timestamp() + 1) == []
+        assert (worker1._db.total_changes, worker2._db.total_changes) == changes
+
+        assert worker1.expire(now.timestamp() + 1) == [cloudlet]
+        assert worker1._db.total_changes > changes[0]
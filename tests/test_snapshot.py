@@ -0,0 +1,82 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import IPv4Network
+from uuid import uuid4
+
+import pendulum
+from yarl import URL
+
+from sinfonia.cloudlets import Cloudlet
+from sinfonia.registry import CloudletRegistry
+from sinfonia.snapshot import load_snapshot, save_snapshot
+
+
+def reporting_cloudlet(last_update, **resources):
+    return Cloudlet.new(
+        uuid=uuid4(),
+        endpoint=URL("http://reporting.example.com/api/v1/deploy"),
+        name="reporting",
+        locations=[],
+        local_networks=[IPv4Network("128.2.0.0/16")],
+        rejected_clients=[IPv4Network("10.0.0.0/8")],
+        resources=resources,
+        last_update=last_update,
+        sequence=3,
+    )
+
+
+class TestSnapshot:
+    def test_round_trip(self, tmp_path):
+        now = pendulum.from_timestamp(pendulum.now().int_timestamp)
+        static = Cloudlet.new(
+            uuid=uuid4(),
+            endpoint=URL("http://static.example.com/api/v1/deploy"),
+            locations=[],
+            local_networks=[],
+        )
+        reporting = [
+            reporting_cloudlet(now, cpu_used=1.0, cpu_avail=7.0, gpu_used=0.5),
+            reporting_cloudlet(now, mem_avail=2.0),
+        ]
+        registry = CloudletRegistry([static, *reporting])
+
+        path = tmp_path / "registry.snapshot"
+        assert save_snapshot(registry, path) == 2
+
+        # only reporting cloudlets are saved
+        restored = {cloudlet.uuid: cloudlet for cloudlet in load_snapshot(path)}
+        assert len(restored) == 2
+        for cloudlet in reporting:
+            copy = restored[cloudlet.uuid]
+            assert copy.attributes() == cloudlet.attributes()
+            assert dict(copy.resources) == dict(cloudlet.resources)
+            assert copy.last_update == now
+            assert copy.sequence == 3
+
+    def test_empty(self, tmp_path):
+        path = tmp_path / "registry.snapshot"
+        assert save_snapshot(CloudletRegistry(), path) == 0
+        assert load_snapshot(path) == []
+
+    def test_invalid(self, tmp_path):
+        path = tmp_path / "registry.snapshot"
+        assert load_snapshot(path) == []
+
+        path.write_bytes(b"")
+        assert load_snapshot(path) == []
+
+        registry = CloudletRegistry([reporting_cloudlet(pendulum.now())])
+        save_snapshot(registry, path)
+        path.write_bytes(path.read_bytes()[:40])
+        assert load_snapshot(path) == []
+
+    def test_concurrent(self, tmp_path):
+        path = tmp_path / "registry.snapshot"
+        registry = CloudletRegistry([reporting_cloudlet(pendulum.now())])
+        with ThreadPoolExecutor(4) as pool:
+            saved = list(pool.map(lambda _: save_snapshot(registry, path), range(16)))
+        assert saved == [1] * 16
+        assert len(load_snapshot(path)) == 1
+        assert [entry.name for entry in tmp_path.iterdir()] == [path.name]
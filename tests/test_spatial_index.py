@@ -0,0 +1,75 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+import random
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from sinfonia.geo_location import GeoLocation
+from sinfonia.spatial_index import GEODESIC_ERROR, SpatialIndex
+
+
+class TestSpatialIndex:
+    @pytest.fixture
+    def locations(self):
+        rng = random.Random(42)
+        return {
+            uuid4(): [
+                GeoLocation(rng.uniform(-90, 90), rng.uniform(-180, 180))
+                for _ in range(rng.randint(1, 3))
+            ]
+            for _ in range(50)
+        }
+
+    def test_nearest(self, locations):
+        index = SpatialIndex()
+        for uuid, coordinates in locations.items():
+            index.update(uuid, coordinates)
+
+        client = GeoLocation(40.4439, -79.9561)
+        nearest = list(index.nearest(client, batch_size=2))
+        assert len(nearest) == sum(len(coords) for coords in locations.values())
+
+        distances = [distance for distance, _ in nearest]
+        assert distances == sorted(distances)
+
+        # spherical distance is close to the geodesic to one of the locations
+        for distance, uuid in nearest:
+            assert any(
+                abs((location - client) - distance) <= distance * GEODESIC_ERROR
+                for location in locations[uuid]
+            )
+
+    def test_update(self, locations):
+        index = SpatialIndex()
+        uuid = uuid4()
+        assert list(index.nearest(GeoLocation(0, 0))) == []
+
+        index.update(uuid, [GeoLocation(0, 0)])
+        assert [owner for _, owner in index.nearest(GeoLocation(0, 0))] == [uuid]
+
+        index.update(uuid, [GeoLocation(10, 10), GeoLocation(0, 1)])
+        distance, owner = next(index.nearest(GeoLocation(0, 0)))
+        assert owner == uuid and 110 < distance < 112
+
+        index.update(uuid, [])
+        assert len(index) == 0
+
+        index.update(uuid, [GeoLocation(0, 0)])
+        index.remove(uuid)
+        assert list(index.nearest(GeoLocation(0, 0))) == []
+
+    def test_distances(self, locations):
+        index = SpatialIndex()
+        for uuid, coordinates in locations.items():
+            index.update(uuid, coordinates)
+
+        client = GeoLocation(40.4439, -79.9561)
+        uuids = list(locations) + [uuid4()]
+        distances = index.distances(client, uuids)
+        assert np.isnan(distances[-1])
+        for uuid, distance in zip(uuids, distances[:-1]):
+            closest = min(location - client for location in locations[uuid])
+            assert abs(closest - distance) <= closest * GEODESIC_ERROR
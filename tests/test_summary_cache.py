@@ -0,0 +1,67 @@
+# Copyright (c) 2022 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+import gzip
+import json
+from uuid import uuid4
+
+import pendulum
+from yarl import URL
+
+from sinfonia.cloudlets import Cloudlet
+from sinfonia.registry import CloudletRegistry
+from sinfonia.resource_matrix import requirements
+from sinfonia.summary_cache import SummaryCache
+
+
+def reporting_cloudlet(**resources):
+    return Cloudlet.new(
+        uuid=uuid4(),
+        endpoint=URL("http://reporting.example.com/api/v1/deploy"),
+        locations=[],
+        local_networks=[],
+        resources=resources,
+        last_update=pendulum.now(),
+    )
+
+
+class TestSummaryCache:
+    def test_cache(self):
+        cloudlets = [reporting_cloudlet(cpu_used=float(i)) for i in range(3)]
+        registry = CloudletRegistry(cloudlets)
+        cache = SummaryCache()
+
+        page = cache.get(registry)
+        assert page.total == 3
+        assert json.loads(page.body) == [c.summary() for c in cloudlets]
+        assert json.loads(gzip.decompress(page.gzipped())) == json.loads(page.body)
+        assert b"".join(page.chunks(page.body)) == page.body
+
+        # unchanged registry and reservations return the cached page
+        registry.resources.reserve(cloudlets[0].uuid, requirements({"cpu": 1.0}))
+        assert cache.get(registry) is page
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # a report changes the contents and the etag
+        registry.report(cloudlets[1].uuid, {"cpu_used": 5.0}, pendulum.now())
+        updated = cache.get(registry)
+        assert updated.etag != page.etag
+        assert json.loads(updated.body)[1]["resources"] == {"cpu_used": 5.0}
+
+        # etags only depend on the contents
+        assert SummaryCache().get(registry).etag == updated.etag
+
+    def test_pages(self):
+        cloudlets = [reporting_cloudlet(cpu_used=float(i)) for i in range(5)]
+        registry = CloudletRegistry(cloudlets)
+        cache = SummaryCache()
+
+        page = cache.get(registry, offset=1, limit=2)
+        assert page.total == 5
+        assert json.loads(page.body) == [c.summary() for c in cloudlets[1:3]]
+        assert json.loads(cache.get(registry, offset=5).body) == []
+
+        del registry[cloudlets[0].uuid]
+        page = cache.get(registry, offset=1, limit=2)
+        assert page.total == 4
+        assert json.loads(page.body) == [c.summary() for c in cloudlets[2:4]]